@@ -0,0 +1,459 @@
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+
+import closures
+import transpiler
+import vm
+from lexer import Lexer, ReferenceLexer
+from parser import Parser
+from interpreter import Interpreter
+from resolver import resolve
+from state import State
+from expression import Expression
+from statement import Statement
+from trogon import count_nodes, slots
+from variables import TrogonNumber, TrogonString, TrogonTable
+
+# A chunk of typical Trogon code. Benchmarks repeat it to get bigger inputs
+sample = '''
+# ===========================
+#          Factorial
+# ===========================
+function factr(n) {
+	if n <= 1 { 1 } else { n * factr(n - 1) }
+}
+
+let animal = table {
+	'say': function() { print('meow'); },
+	'breed': 'Siamese cat',
+	'age': 6, 'mask': 0xFF_FF, 'flags': 0b1010, 'weight': 4.25
+};
+
+for let i in 1 .. 20 {
+	let fizzbuzz =
+		(if i % 3 == 0 { 'Fizz' } else { '' }) + (if i % 5 == 0 { 'Buzz' } else { '' });
+
+	if fizzbuzz != '' and not (i >= 10) {
+		printf('{breed}\\t{age}\\n', animal);
+	}
+	animal['age'] += i << 2 >> 1;
+}
+'''
+
+
+def best_time(function, repeat):
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+
+	return best
+
+
+def bench_lexer(args):
+	code = sample * args.size
+	print(f'{len(code)} characters')
+
+	reference = [(t.type, t.line, t.value) for t in ReferenceLexer(code).scan()]
+	tokens = [(t.type, t.line, t.value) for t in Lexer(code).scan()]
+	if tokens != reference:
+		raise AssertionError('Lexer and ReferenceLexer disagree')
+
+	results = {}
+	for lexer in (ReferenceLexer, Lexer):
+		elapsed = best_time(lambda: lexer(code).scan(), args.repeat)
+		results[lexer] = elapsed
+		print(f'{lexer.__name__:>16}: {len(tokens) / elapsed:12,.0f} tokens/s')
+
+	print(f'speedup: {results[ReferenceLexer] / results[Lexer]:.1f}x')
+
+
+def allocated(function):
+	tracemalloc.start()
+	try:
+		result = function()
+		return result, tracemalloc.get_traced_memory()[0]
+	finally:
+		tracemalloc.stop()
+
+
+def bench_tokens(args):
+	code = sample * args.size
+
+	tokens, size = allocated(lambda: ReferenceLexer(code).scan())
+	print(f'{"list of Token":>16}: {size / len(tokens):6.1f} bytes/token')
+
+	buffer, size = allocated(lambda: Lexer(code).scan())
+	print(f'{"TokenBuffer":>16}: {size / len(buffer):6.1f} bytes/token')
+
+	for name, tokens in (('list of Token', tokens), ('TokenBuffer', buffer)):
+		elapsed = best_time(lambda: Parser(tokens).parse(), args.repeat)
+		print(f'{name:>16}: {len(buffer) / elapsed:12,.0f} tokens/s parsed')
+
+
+def bench_expressions(args):
+	line = 'let x = (a + b * c - d // 2) << 1 >= e % 3 and not f or g as number == h[i].j(k, l + 1);\n'
+	tokens = Lexer(line * args.size * 10).scan()
+
+	elapsed = best_time(lambda: Parser(tokens).parse(), args.repeat)
+	print(f'{len(tokens) / elapsed:12,.0f} tokens/s parsed')
+
+	depth = 1
+	try:
+		while True:
+			Parser(Lexer('(' * depth + '1' + ')' * depth + ';').scan()).parse()
+			depth += 1
+	except RecursionError:
+		print(f'deepest parenthesized expression: {depth - 1}')
+
+
+# Scripts that spend their time interpreting, `{size}` sets the amount of work
+programs = {
+	'calls': '''
+		function fib(n) { if n < 2 { n } else { fib(n - 1) + fib(n - 2) } }
+		fib({size} // 10 + 10);
+	''',
+	'loops': '''
+		let total = 0;
+		for let i in 0 .. {size} * 100 {
+			if i % 3 == 0 { total += i; } else { total -= 1; }
+		}
+	''',
+	'tables': '''
+		let t = table {};
+		for let i in 0 .. {size} * 20 { t[i % 50] = i; t[i % 50] += t[i % 50]; }
+	''',
+}
+
+
+def interpret(ast, state):
+	for s in ast:
+		s.interpret(state)
+
+
+engines = {
+	'tree': interpret,
+	'vm': vm.run,
+	'closures': closures.run,
+	'python': transpiler.run,
+}
+
+
+def bench_engines(args):
+	for name, program in programs.items():
+		ast = Parser(Lexer(program.replace('{size}', str(args.size))).scan()).parse()
+		resolve(ast)
+
+		results = {}
+		for engine, run in engines.items():
+			results[engine] = best_time(lambda: run(ast, State()), args.repeat)
+
+		print(f'{name:>8}: ' + '  '.join(
+			f'{engine} {elapsed:.4f}s ({results["tree"] / elapsed:.2f}x)'
+			for engine, elapsed in results.items()))
+
+
+# Loops that mostly store values somewhere, `{string}` is a 1000 characters
+# long string literal
+assignments = {
+	'numbers': '''
+		let a = 0; let b = 1;
+		for let i in 0 .. {size} * 100 { a = b; b = a + 1; }
+	''',
+	'strings': '''
+		let s = '{string}'; let t = '';
+		for let i in 0 .. {size} * 100 { t = s; s = t; }
+	''',
+	'tables': '''
+		let s = '{string}'; let t = table {};
+		for let i in 0 .. {size} * 100 { t[i % 10] = s; t[i % 10 + 10] = i; }
+	''',
+	'arguments': '''
+		let s = '{string}';
+		function f(x, y) { y }
+		for let i in 0 .. {size} * 100 { f(s, i); }
+	''',
+}
+
+
+def bench_assignments(args):
+	for name, program in assignments.items():
+		program = program.replace('{size}', str(args.size)).replace('{string}', 'x' * 1000)
+		ast = Parser(Lexer(program).scan()).parse()
+		resolve(ast)
+
+		elapsed = best_time(lambda: interpret(ast, State()), args.repeat)
+		print(f'{name:>10}: {elapsed:.4f}s ({elapsed / (args.size * 100) * 1e6:.2f} us/iteration)')
+
+
+# Building strings and using them as table keys, `{string}` is a 1000
+# characters long string literal
+strings = {
+	'concat': '''
+		let s = '';
+		for let i in 0 .. {size} * 100 { s = s + 'x'; }
+	''',
+	'reverse': '''
+		let s = '{string}'; let r = '';
+		for let n in 0 .. {size} / 10 {
+			r = '';
+			for let i in s.length() - 1 .. (-1) { r = r + s[i]; }
+		}
+	''',
+	'keys': '''
+		let s = '{string}'; let t = table { s: 0 };
+		for let i in 0 .. {size} * 100 { t[s] = t[s] + 1; }
+	''',
+}
+
+
+def bench_strings(args):
+	for name, program in strings.items():
+		program = program.replace('{size}', str(args.size)).replace('{string}', 'x' * 1000)
+		ast = Parser(Lexer(program).scan()).parse()
+		resolve(ast)
+
+		elapsed = best_time(lambda: interpret(ast, State()), args.repeat)
+		print(f'{name:>10}: {elapsed:.4f}s')
+
+
+# Table reads and writes with the different kinds of keys
+tables = {
+	'numbers': '''
+		let t = table {};
+		for let i in 0 .. {size} * 100 { t[i % 100] = i; t[i % 50] + t[i % 100]; }
+	''',
+	'strings': '''
+		let t = table { 'a': 0, 'b': 0, 'c': 0 }; let k = 'b';
+		for let i in 0 .. {size} * 100 { t[k] = t['a'] + t['c']; }
+	''',
+	'bools': '''
+		let t = table { true: 0, null: 0 };
+		for let i in 0 .. {size} * 100 { t[i > 10] = t[null]; }
+	''',
+	'arrays': '''
+		let t = table {}; let sum = 0;
+		for let i in 0 .. {size} * 100 { t[i] = i; }
+		for let i in 0 .. {size} * 100 { sum = sum + t[i]; }
+	''',
+}
+
+
+def bench_tables(args):
+	for name, program in tables.items():
+		ast = Parser(Lexer(program.replace('{size}', str(args.size))).scan()).parse()
+		resolve(ast)
+
+		elapsed = best_time(lambda: interpret(ast, State()), args.repeat)
+		print(f'{name:>10}: {elapsed:.4f}s ({elapsed / (args.size * 100) * 1e6:.2f} us/iteration)')
+
+
+# Formatting like in debug.tr, printf's output is thrown away
+formats = {
+	'format': '''
+		let pattern = '{first_part} {second_part}';
+		for let i in 0 .. {size} * 10 {
+			pattern.format(table{'first_part': '{a}{b}', 'second_part': '{c}{d}'})
+				.format(table{'a': i, 'b': 37, 'c': 11, 'd': '00'});
+		}
+	''',
+	'printf': '''
+		let pattern = '{greeting}, {name}! You are visitor number {n}\\n';
+		for let i in 0 .. {size} * 10 {
+			printf(pattern, table{'greeting': 'Hello', 'name': 'QiZD90', 'n': i});
+		}
+	''',
+}
+
+
+def bench_format(args):
+	for name, program in formats.items():
+		ast = Parser(Lexer(program.replace('{size}', str(args.size))).scan()).parse()
+		Interpreter().resolve(ast)
+
+		# printf is a builtin, so every run gets the global scope of a new
+		# interpreter
+		with contextlib.redirect_stdout(io.StringIO()):
+			elapsed = best_time(lambda: interpret(ast, Interpreter().globals), args.repeat)
+		print(f'{name:>10}: {elapsed:.4f}s ({elapsed / (args.size * 10) * 1e6:.2f} us/iteration)')
+
+
+# Leaving blocks early: `continue` in a hot loop, `return` from a loop and
+# from an `if` in a function
+control = {
+	'continue': '''
+		let odd = 0;
+		for let i in 0 .. {size} * 100 { if i % 2 == 0 { continue; } odd = odd + 1; }
+	''',
+	'break': '''
+		for let i in 0 .. {size} * 20 { let j = 0; while true { j = j + 1; if j == 5 { break; } } }
+	''',
+	'return': '''
+		function sign(x) { if x < 0 { return -1; } if x > 0 { return 1; } 0 }
+		for let i in 0 .. {size} * 100 { sign(i - 50); }
+	''',
+	'search': '''
+		function find(n) { for let i in 0 .. 10 { if i == n { return i; } } -1 }
+		for let i in 0 .. {size} * 20 { find(i % 12); }
+	''',
+}
+
+
+def bench_control(args):
+	for name, program in control.items():
+		ast = Parser(Lexer(program.replace('{size}', str(args.size))).scan()).parse()
+		resolve(ast)
+
+		elapsed = best_time(lambda: interpret(ast, State()), args.repeat)
+		print(f'{name:>10}: {elapsed:.4f}s')
+
+
+# Functions that do nothing and methods of built-in types, to see what a
+# call costs in every engine. The same loop without the call is subtracted
+calls = {
+	'0 args': ('function f() { 0 }', 'f()'),
+	'1 arg': ('function f(a) { a }', 'f(i)'),
+	'3 args': ('function f(a, b, c) { c }', 'f(i, i, i)'),
+	'length': ('let s = \'meow\';', 's.length()'),
+	'format': ('let s = \'{a}\'; let t = table { \'a\': 1 };', 's.format(t)'),
+}
+
+
+def bench_calls(args):
+	count = args.size * 100
+	loop = 'for let i in 0 .. {count} { {call}; }'.replace('{count}', str(count))
+
+	def measure(program, run):
+		ast = Parser(Lexer(program).scan()).parse()
+		resolve(ast)
+		return best_time(lambda: run(ast, State()), args.repeat)
+
+	empty = {engine: measure(loop.replace('{call}', 'i'), run) for engine, run in engines.items()}
+	for name, (function, call) in calls.items():
+		program = function + '\n' + loop.replace('{call}', call)
+		print(f'{name:>8}: ' + '  '.join(
+			f'{engine} {(measure(program, run) - empty[engine]) / count * 1e6:.3f}us'
+			for engine, run in engines.items()))
+
+
+# A `for` loop whose bound can't change (see `resolver.py`) from 10^3 to 10^7
+# iterations, and the same loop reading its bound from a global, which it
+# evaluates every iteration
+ranges = {
+	'invariant': 'let s = 0; for let i in 0 .. {count} { s = i; }',
+	'variable': 'let n = {count}; let s = 0; for let i in 0 .. n { s = i; }',
+}
+
+
+def bench_ranges(args):
+	for power in range(3, 8):
+		count = 10 ** power
+		# the long ones are timed once
+		repeat = args.repeat if power <= 5 else 1
+
+		for name, program in ranges.items():
+			ast = Parser(Lexer(program.replace('{count}', str(count))).scan()).parse()
+			resolve(ast)
+
+			print(f'10^{power} {name:>9}: ' + '  '.join(
+				f'{engine} {best_time(lambda: run(ast, State()), repeat) / count * 1e9:.0f}ns'
+				for engine, run in engines.items()))
+
+
+# What a parsed program and the values it creates take in memory, next to
+# the same objects with a __dict__ as they were before the classes had
+# __slots__. The lists holding the values are subtracted, a string includes
+# its list of characters and a table its dict
+def bench_memory(args):
+	code = sample * args.size
+	ast = Parser(Lexer(code)).parse()
+	nodes = count_nodes(ast)
+
+	print(f'{"":>8}  {"slots":>6}  {"dict":>6}')
+
+	# both copy the same tree, so they share the same leaves
+	sizes = [allocated(lambda: copy_ast(ast, classes))[1] for classes in (same_class, dict_backed)]
+	print(f'{"AST":>8}: {sizes[0] / nodes:6.1f}  {sizes[1] / nodes:6.1f} bytes/node')
+
+	count = args.size * 100
+	values = {
+		# not from the small number cache
+		'numbers': lambda cls: [cls(i + 0.5) for i in range(count)],
+		'strings': lambda cls: [cls('meow') for i in range(count)],
+		'tables': lambda cls: [cls() for i in range(count)],
+	}
+	classes = {'numbers': TrogonNumber, 'strings': TrogonString, 'tables': TrogonTable}
+
+	for name, create in values.items():
+		_, empty = allocated(lambda: [None for i in range(count)])
+		sizes = [allocated(lambda: create(cls))[1] - empty for cls in (classes[name], dict_backed(classes[name]))]
+		print(f'{name:>8}: {sizes[0] / count:6.1f}  {sizes[1] / count:6.1f} bytes/value')
+
+
+def same_class(cls):
+	return cls
+
+
+# `cls` without __slots__: the same methods and class attributes, the fields
+# in an instance __dict__
+def dict_backed(cls):
+	if cls is object:
+		return object
+
+	if cls not in dict_backed_classes:
+		skipped = set(getattr(cls, '__slots__', ())) | {'__slots__', '__dict__', '__weakref__'}
+		namespace = {name: value for name, value in vars(cls).items() if name not in skipped}
+		bases = tuple(dict_backed(base) for base in cls.__bases__)
+		dict_backed_classes[cls] = type(cls.__name__, bases, namespace)
+
+	return dict_backed_classes[cls]
+
+
+dict_backed_classes = {}
+
+
+def copy_ast(node, classes):
+	if isinstance(node, list):
+		return [copy_ast(child, classes) for child in node]
+	elif isinstance(node, tuple):
+		return tuple(copy_ast(child, classes) for child in node)
+	elif isinstance(node, dict):
+		return {copy_ast(k, classes): copy_ast(v, classes) for k, v in node.items()}
+	elif isinstance(node, (Expression, Statement)):
+		copy = object.__new__(classes(type(node)))
+		for name in slots(node):
+			if hasattr(node, name):
+				setattr(copy, name, copy_ast(getattr(node, name), classes))
+		return copy
+
+	return node
+
+
+benchmarks = {
+	'lexer': bench_lexer,
+	'tokens': bench_tokens,
+	'expressions': bench_expressions,
+	'engines': bench_engines,
+	'assignments': bench_assignments,
+	'memory': bench_memory,
+	'strings': bench_strings,
+	'tables': bench_tables,
+	'format': bench_format,
+	'control': bench_control,
+	'calls': bench_calls,
+	'ranges': bench_ranges,
+}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Trogon interpreter benchmarks')
+	parser.add_argument('benchmark', choices=benchmarks)
+	parser.add_argument('--size', type=int, default=200, help='input size multiplier')
+	parser.add_argument('--repeat', type=int, default=5, help='runs per measurement')
+	args = parser.parse_args()
+
+	benchmarks[args.benchmark](args)
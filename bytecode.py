@@ -0,0 +1,661 @@
+from expression import *
+from statement import *
+from runtime import *
+from variables import *
+from lexer import Token
+
+# ==== Opcodes ====
+#
+# Every instruction is two slots in `Code.instructions`: the opcode and its
+# argument (0 if the opcode doesn't take one). Jump arguments are absolute
+# positions in `instructions`
+
+LOAD_CONST = 0      # push constants[arg]
+LOAD_NAME = 1       # push the variable constants[arg] (a `resolver.Reference`)
+LOAD_LOCAL = 49     # push slot arg of the scope, or load `Code.references` if it's not defined yet
+LOAD_OUTER = 50     # LOAD_LOCAL from the scope around it
+LOAD_GLOBAL = 51    # push the global variable constants[arg] (a name)
+STORE_NAME = 2      # assign TOS to the variable constants[arg], replace TOS with the stored value
+SET_NAME = 41       # pop and assign it to the variable constants[arg]
+STORE_LOCAL = 52    # STORE_NAME to slot arg of the scope, see LOAD_LOCAL
+STORE_OUTER = 53
+STORE_GLOBAL = 64   # STORE_NAME to the global variable constants[arg] (a name)
+SET_LOCAL = 54      # SET_NAME to slot arg of the scope, see LOAD_LOCAL
+SET_OUTER = 55
+SET_GLOBAL = 57     # pop and assign it to the global variable constants[arg] (a name)
+DEFINE_NAME = 3     # pop and `let` it, constants[arg] is (slot, name)
+POP = 4
+DUP = 5
+SWAP = 6
+BEGIN_SCOPE = 7     # arg is the number of slots
+END_SCOPE = 8
+NEW_FRAME = 42      # push a frame with arg slots for a loop's body, see `resolver.py`
+ENTER_FRAME = 43    # reset the frame arg slots below TOS and make it the scope
+TAIL_CALL = 44      # CALL whose result the function returns, the callee takes over its frame
+LOAD_METHOD = 45    # replace TOS with constants[arg].lookup(TOS) and TOS, see `MethodCache`
+CALL_METHOD = 46    # arg is the number of arguments, the method and receiver are below them
+JUMP = 9
+JUMP_IF_FALSE = 10  # pop, jump if it's not truthy
+AND_JUMP = 11       # pop, if it's not truthy push false and jump
+OR_JUMP = 12        # pop, if it's truthy push true and jump
+TO_BOOL = 13
+ADD = 14
+SUB = 15
+MUL = 16
+MOD = 56
+ADD_CONST = 58      # ADD with constants[arg] as the right operand, instead of a LOAD_CONST
+SUB_CONST = 59
+MOD_CONST = 60
+LESS_CONST = 61
+EQUAL_CONST = 62
+LESS = 17
+GREATER = 18
+EQUAL = 19
+BINARY = 20         # the operator `arg` (a token type) from `BinaryExpression.functions`
+UNARY_MINUS = 21
+UNARY_NOT = 22
+CALL = 23           # arg is the number of arguments, the callee is below them
+RETURN = 24
+MAKE_FUNCTION = 25  # constants[arg] is a `FunctionTemplate`
+NEW_TABLE = 26
+TABLE_SET = 27      # pop value and key, add them to the table on TOS
+SUBSCRIPT = 28
+STORE_SUBSCR = 29   # pop index, container and value, push container.subscript_assign(...)
+SET_SUBSCR = 63     # STORE_SUBSCR that doesn't push the result
+DOT = 30            # replace TOS with TOS.dot(constants[arg])
+CAST = 31
+SETUP_LOOP = 32     # constants[arg] is (exit, continue), see `VM.execute`
+POP_LOOP = 33
+BREAK = 34          # arg is how many loops to skip before the target one
+CONTINUE = 35
+FOR_TEST = 36       # pop the right bound, jump out if the counter (TOS) reached it
+FOR_STEP = 37       # pop the right bound, move the counter (TOS) towards it
+FOR_RANGE = 47      # pop the right bound, replace the counter (TOS) with `counters(counter, right)`
+FOR_ITER = 48       # push the next counter from the iterator on TOS, jump if there's none
+RAISE = 38          # raise constants[arg]()
+RAISE_RETURN = 39   # `return` outside of a function
+HALT = 40
+
+opnames = {v: k for k, v in list(globals().items()) if k.isupper() and type(v) is int}
+
+jumps = (JUMP, JUMP_IF_FALSE, AND_JUMP, OR_JUMP, FOR_TEST, FOR_ITER)
+
+assignments = {
+	Token.PLUS_EQUAL: Token.PLUS, Token.MINUS_EQUAL: Token.MINUS,
+	Token.STAR_EQUAL: Token.STAR, Token.SLASH_EQUAL: Token.SLASH,
+	Token.DOUBLE_SLASH_EQUAL: Token.DOUBLE_SLASH, Token.PERCENT_EQUAL: Token.PERCENT,
+	Token.SHL_EQUAL: Token.SHL, Token.SHR_EQUAL: Token.SHR
+}
+
+# operators that are evaluated at compile time when both operands are number
+# literals. Not `<<`, `1 << 10 ** 10` in dead code shouldn't hang the compiler
+foldable = frozenset((
+	Token.PLUS, Token.MINUS, Token.STAR, Token.SLASH,
+	Token.DOUBLE_SLASH, Token.PERCENT, Token.SHR
+))
+
+# the opcodes that load, store or set a variable: a local one of the scope,
+# of the one around it, a global one and any other, see `Compiler.name`
+loads = (LOAD_LOCAL, LOAD_OUTER, LOAD_GLOBAL, LOAD_NAME)
+stores = (STORE_LOCAL, STORE_OUTER, STORE_GLOBAL, STORE_NAME)
+sets = (SET_LOCAL, SET_OUTER, SET_GLOBAL, SET_NAME)
+
+binary_opcodes = {
+	Token.PLUS: ADD, Token.MINUS: SUB, Token.STAR: MUL, Token.PERCENT: MOD,
+	Token.LESS: LESS, Token.GREATER: GREATER, Token.EQUAL_EQUAL: EQUAL
+}
+
+
+# operators whose right operand is often a literal, see `Compiler.binary`
+constant_opcodes = {
+	Token.PLUS: ADD_CONST, Token.MINUS: SUB_CONST, Token.PERCENT: MOD_CONST,
+	Token.LESS: LESS_CONST, Token.EQUAL_EQUAL: EQUAL_CONST
+}
+
+
+# the value of a constant expression or None. Binary expressions are folded
+# once, bottom-up, by `Resolver` (see `fold_binary`), so this doesn't walk
+# the operands again
+def fold(e):
+	if type(e) is LiteralExpression:
+		return e.value if type(e.value) is TrogonNumber else None
+	elif type(e) is BinaryExpression:
+		return e.constant
+
+	return None
+
+
+# the value of a binary expression whose operands are already folded
+def fold_binary(e):
+	if e.operator not in foldable:
+		return None
+
+	left, right = fold(e.left), fold(e.right)
+	if left is None or right is None:
+		return None
+
+	try:
+		return BinaryExpression.functions[e.operator](left, right)
+	except (ArithmeticError, ValueError):
+		return None # let it fail at runtime
+
+
+class Code:
+	def emit(self, opcode, argument=0):
+		self.instructions.append(opcode)
+		self.instructions.append(argument)
+		return len(self.instructions) - 1
+
+	def here(self):
+		return len(self.instructions)
+
+	def patch(self, slot, target):
+		self.instructions[slot] = target
+
+	def constant(self, value):
+		# only names are shared, TrogonObjects compare by value
+		if type(value) is not str:
+			self.constants.append(value)
+			return len(self.constants) - 1
+
+		if value not in self.names:
+			self.names[value] = len(self.constants)
+			self.constants.append(value)
+		return self.names[value]
+
+	def __init__(self, name):
+		self.name = name
+		self.instructions = []
+		self.constants = []
+		self.names = {}
+		# the reference of every LOAD_LOCAL and the like, by the position of
+		# its argument. Only needed when the slot isn't defined
+		self.references = {}
+
+	def __repr__(self):
+		return f'<code {self.name}>'
+
+
+# Everything `MAKE_FUNCTION` needs to create a function at runtime
+class FunctionTemplate:
+	def __init__(self, name, argnames, block, code, layout):
+		self.name = name
+		self.argnames = argnames
+		self.block = block
+		self.code = code
+		self.layout = layout
+
+	def __repr__(self):
+		return f'<function {self.name}>'
+
+
+class Loop:
+	def __init__(self):
+		self.in_body = False
+
+
+# Compiles the statements of a program (or a function body) to a `Code`.
+# The generated code has to behave exactly like `interpret`/`evaluate` on
+# the same AST, including the evaluation order and the error messages
+class Compiler:
+	def compile_program(self, statements):
+		for s in statements:
+			self.statement(s)
+		self.code.emit(HALT)
+		return self.code
+
+	def compile_function(self, block):
+		self.expression(block)
+		self.code.emit(RETURN)
+
+		# a jump to the end of the function returns right away
+		instructions = self.code.instructions
+		for pc in range(0, len(instructions), 2):
+			if instructions[pc] == JUMP and instructions[instructions[pc + 1]] == RETURN:
+				instructions[pc] = RETURN
+				instructions[pc + 1] = 0
+
+		return self.code
+
+	# ==== Statements ====
+
+	def statement(self, s):
+		kind = type(s)
+
+		if kind is ExpressionStatement:
+			self.effect(s.expression)
+
+		elif kind is LetStatement:
+			self.expression_or_null(s.expression)
+			self.code.emit(DEFINE_NAME, self.code.constant((s.slot, s.name)))
+
+		elif kind is WhileStatement:
+			self.while_statement(s)
+
+		elif kind is ForStatement:
+			self.for_statement(s)
+
+		elif kind is FunctionDeclarationStatement:
+			self.expression(s.expression)
+			self.code.emit(DEFINE_NAME, self.code.constant((s.slot, s.expression.name)))
+
+		# everything else (including return/break/continue outside of a
+		# block) does nothing when interpreted
+
+	# a statement that's directly in a block
+	def block_statement(self, s):
+		if s.type == Statement.RETURN:
+			self.expression_or_null(s.expression)
+			self.code.emit(RETURN if self.function else RAISE_RETURN)
+
+		elif s.type in (Statement.BREAK, Statement.CONTINUE):
+			is_break = s.type == Statement.BREAK
+			for i, loop in enumerate(reversed(self.loops)):
+				if is_break or loop.in_body:
+					self.code.emit(BREAK if is_break else CONTINUE, i)
+					return
+
+			if self.function:
+				self.error(RuntimeException, 'Uncaught break or continue')
+			else:
+				self.error(BreakException if is_break else ContinueException)
+
+		else:
+			self.statement(s)
+
+	def begin_loop(self):
+		loop = Loop()
+		self.loops.append(loop)
+		targets = [None, None]
+		self.code.emit(SETUP_LOOP, self.code.constant(targets))
+		return loop, targets
+
+	def end_loop(self, targets, exit):
+		self.loops.pop()
+		self.code.emit(POP_LOOP)
+		targets[0] = self.code.here()
+		if exit is not None:
+			self.code.patch(exit, targets[0] - 2)
+
+	def while_statement(self, s):
+		reusable = s.block.reusable
+		if reusable:
+			self.code.emit(NEW_FRAME, s.block.size)
+		loop, targets = self.begin_loop()
+
+		targets[1] = start = self.code.here()
+		self.truthy(s.condition)
+		exit = self.code.emit(JUMP_IF_FALSE)
+
+		loop.in_body = True
+		self.block_effect(s.block, 0 if reusable else None)
+		loop.in_body = False
+
+		self.code.emit(JUMP, start)
+		self.end_loop(targets, exit)
+		if reusable:
+			self.code.emit(POP)
+
+	def for_statement(self, s):
+		self.code.emit(BEGIN_SCOPE, s.size)
+		reusable = s.block.reusable
+		if reusable:
+			self.code.emit(NEW_FRAME, s.block.size)
+
+		self.expression(s.left_bound)
+		if s.has_let:
+			self.code.emit(DEFINE_NAME, self.code.constant((s.slot, s.lvalue.name)))
+		else:
+			self.assign(s.lvalue, discard=True)
+
+		# the counter stays on the stack for the whole loop
+		self.expression(s.lvalue)
+		if s.invariant:
+			return self.counting_for_statement(s)
+
+		loop, targets = self.begin_loop()
+
+		start = self.code.here()
+		self.expression(s.right_bound)
+		exit = self.code.emit(FOR_TEST)
+
+		self.code.emit(DUP)
+		self.assign(s.lvalue, discard=True)
+
+		loop.in_body = True
+		self.block_effect(s.block, 1 if reusable else None)
+		loop.in_body = False
+
+		targets[1] = self.code.here()
+		self.expression(s.right_bound)
+		self.code.emit(FOR_STEP)
+		self.code.emit(JUMP, start)
+
+		self.end_loop(targets, exit)
+		self.code.emit(POP)
+		if reusable:
+			self.code.emit(POP)
+		self.code.emit(END_SCOPE)
+
+	# the rest of a `for` loop whose right bound can't change, see `counters`:
+	# its iterator replaces the counter
+	def counting_for_statement(self, s):
+		reusable = s.block.reusable
+		self.expression(s.right_bound)
+		self.code.emit(FOR_RANGE)
+		loop, targets = self.begin_loop()
+
+		targets[1] = start = self.code.here()
+		exit = self.code.emit(FOR_ITER)
+		self.assign(s.lvalue, discard=True)
+
+		loop.in_body = True
+		self.block_effect(s.block, 1 if reusable else None)
+		loop.in_body = False
+		self.code.emit(JUMP, start)
+
+		self.end_loop(targets, exit)
+		self.code.emit(POP)
+		if reusable:
+			self.code.emit(POP)
+		self.code.emit(END_SCOPE)
+
+	# ==== Expressions ====
+
+	def expression(self, e):
+		if e is None:
+			self.error(AttributeError, '\'NoneType\' object has no attribute \'evaluate\'')
+			return
+
+		self.expressions[type(e)](self, e)
+
+	# compiles `e` for its side effects only, nothing is left on the stack
+	def effect(self, e):
+		kind = type(e)
+
+		if kind is BlockExpression:
+			self.block_effect(e)
+
+		elif kind is IfExpression:
+			self.truthy(e.condition)
+			otherwise = self.code.emit(JUMP_IF_FALSE)
+			self.effect(e.true_block)
+
+			if e.else_block:
+				end = self.code.emit(JUMP)
+				self.code.patch(otherwise, self.code.here())
+				self.effect(e.else_block)
+				self.code.patch(end, self.code.here())
+			else:
+				self.code.patch(otherwise, self.code.here())
+
+		elif kind is BinaryExpression and (
+				e.operator == Token.EQUAL or e.operator in assignments):
+			if not self.constant_assignment(e, discard=True):
+				self.expression(e.right)
+				self.assign(e.left, assignments.get(e.operator), discard=True)
+
+		else:
+			self.expression(e)
+			self.code.emit(POP)
+
+	def expression_or_null(self, e):
+		if e:
+			self.expression(e)
+		else:
+			self.code.emit(LOAD_CONST, self.code.constant(TrogonNull))
+
+	def truthy(self, e):
+		self.expression(e)
+
+	def literal(self, e):
+		self.code.emit(LOAD_CONST, self.code.constant(e.value))
+
+	def table_literal(self, e):
+		self.code.emit(NEW_TABLE)
+		for k, v in e.arguments.items():
+			self.expression(k)
+			self.expression(v)
+			self.code.emit(TABLE_SET)
+
+	def variable(self, e):
+		self.name(e.reference, loads)
+
+	# Like closures.py, a variable that has a single candidate in this scope
+	# or the one around it is accessed by its slot, one without candidates in
+	# the global scope by its name and the rest by `State`. `opcodes` is one
+	# of `loads`, `stores` and `sets`
+	def name(self, reference, opcodes):
+		candidates = reference.candidates
+		if len(candidates) == 1 and candidates[0][0] <= 1:
+			depth, slot = candidates[0]
+			self.code.references[self.code.emit(opcodes[depth], slot)] = reference
+		elif not candidates:
+			self.code.emit(opcodes[2], self.code.constant(reference.name))
+		else:
+			self.code.emit(opcodes[3], self.code.constant(reference))
+
+	def dot(self, e):
+		if not isinstance(e.right, VariableExpression):
+			self.error(RuntimeException, 'Expected VariableExpression!')
+			return
+
+		self.expression(e.left)
+		self.code.emit(DOT, self.code.constant(e.right.name))
+
+	def subscription(self, e):
+		self.expression(e.expression)
+		self.expression(e.index)
+		self.code.emit(SUBSCRIPT)
+
+	def cast(self, e):
+		self.expression(e.left)
+		self.expression(e.right)
+		self.code.emit(CAST)
+
+	def call(self, e):
+		if e.cache is not None:
+			self.expression(e.expression.left)
+			self.code.emit(LOAD_METHOD, self.code.constant(e.cache))
+			for argument in e.arguments:
+				self.expression(argument)
+			self.code.emit(CALL_METHOD, len(e.arguments))
+			return
+
+		self.expression(e.expression)
+		for argument in e.arguments:
+			self.expression(argument)
+		self.code.emit(TAIL_CALL if e.tail else CALL, len(e.arguments))
+
+	def unary(self, e):
+		self.expression(e.operand)
+		self.code.emit(UNARY_MINUS if e.operator == Token.MINUS else UNARY_NOT)
+
+	def binary(self, e):
+		if e.operator == Token.EQUAL or e.operator in assignments:
+			if not self.constant_assignment(e):
+				self.expression(e.right)
+				self.assign(e.left, assignments.get(e.operator))
+			return
+
+		value = e.constant
+		if value is not None:
+			self.code.emit(LOAD_CONST, self.code.constant(value))
+		elif e.operator in constant_opcodes and type(e.right) is LiteralExpression:
+			self.expression(e.left)
+			self.code.emit(constant_opcodes[e.operator], self.code.constant(e.right.value))
+		else:
+			self.expression(e.left)
+			self.expression(e.right)
+			self.operator(e.operator)
+
+	# `x += 1` and the like: loading a literal has no effect, so it doesn't
+	# have to come first and be swapped with `x`. False if `e` isn't one
+	def constant_assignment(self, e, discard=False):
+		operator = assignments.get(e.operator)
+		if operator not in constant_opcodes or type(e.left) is not VariableExpression \
+				or type(e.right) is not LiteralExpression:
+			return False
+
+		self.expression(e.left)
+		self.code.emit(constant_opcodes[operator], self.code.constant(e.right.value))
+		self.name(e.left.reference, sets if discard else stores)
+		return True
+
+	def operator(self, operator):
+		if operator in binary_opcodes:
+			self.code.emit(binary_opcodes[operator])
+		else:
+			self.code.emit(BINARY, operator)
+
+	# the value is on the stack, `operator` is set for compound assignments.
+	# With `discard` the result of the assignment isn't left on the stack
+	def assign(self, target, operator=None, discard=False):
+		if getattr(target, 'type', None) not in (Expression.LVALUE, Expression.SUBSCRIPTION):
+			self.error(RuntimeException, 'Expected lvalue!')
+			return
+
+		if operator:
+			self.expression(target)
+			self.code.emit(SWAP)
+			self.operator(operator)
+
+		if isinstance(target, VariableExpression):
+			self.name(target.reference, sets if discard else stores)
+			return
+
+		if isinstance(target, SubscriptionExpression):
+			self.expression(target.expression)
+			self.expression(target.index)
+			self.code.emit(SET_SUBSCR if discard else STORE_SUBSCR)
+			return
+		elif isinstance(target, DotExpression):
+			self.error(RuntimeException, 'Assignment to a dot expression is not implemented')
+		else:
+			self.code.emit(POP)
+			self.code.emit(LOAD_CONST, self.code.constant(TrogonNull))
+
+		if discard:
+			self.code.emit(POP)
+
+	def logical(self, e):
+		self.expression(e.left)
+		jump = self.code.emit(AND_JUMP if e.operator == Token.AND else OR_JUMP)
+		self.expression(e.right)
+		self.code.emit(TO_BOOL)
+		self.code.patch(jump, self.code.here())
+
+	def block(self, e):
+		if e.scoped:
+			self.code.emit(BEGIN_SCOPE, e.size)
+		for s in e.statements:
+			self.block_statement(s)
+		self.expression_or_null(e.expression)
+		if e.scoped:
+			self.code.emit(END_SCOPE)
+
+	# `frame` is where the reused frame of a loop's body is on the stack
+	def block_effect(self, e, frame=None):
+		if frame is not None:
+			self.code.emit(ENTER_FRAME, frame)
+		elif e.scoped:
+			self.code.emit(BEGIN_SCOPE, e.size)
+
+		for s in e.statements:
+			self.block_statement(s)
+		if e.expression:
+			self.effect(e.expression)
+
+		if e.scoped:
+			self.code.emit(END_SCOPE)
+
+	def if_expression(self, e):
+		self.truthy(e.condition)
+		otherwise = self.code.emit(JUMP_IF_FALSE)
+		self.expression(e.true_block)
+		end = self.code.emit(JUMP)
+
+		self.code.patch(otherwise, self.code.here())
+		if e.else_block:
+			self.expression(e.else_block)
+		else:
+			# that's what IfExpression.evaluate returns
+			self.code.emit(LOAD_CONST, self.code.constant(None))
+		self.code.patch(end, self.code.here())
+
+	def function(self, e):
+		code = Compiler(e.name or '<anonymous>', function=True).compile_function(e.block)
+		template = FunctionTemplate(e.name, e.argnames, e.block, code, e.layout)
+		self.code.emit(MAKE_FUNCTION, self.code.constant(template))
+
+	def error(self, exception, *arguments):
+		self.code.emit(RAISE, self.code.constant(lambda: exception(*arguments)))
+
+	expressions = {
+		LiteralExpression: literal,
+		TableLiteralExpression: table_literal,
+		VariableExpression: variable,
+		DotExpression: dot,
+		SubscriptionExpression: subscription,
+		CastExpression: cast,
+		CallExpression: call,
+		UnaryExpression: unary,
+		BinaryExpression: binary,
+		LogicalExpression: logical,
+		BlockExpression: block,
+		IfExpression: if_expression,
+		FunctionDeclarationExpression: function,
+	}
+
+	def __init__(self, name='<program>', function=False):
+		self.code = Code(name)
+		self.function = function
+		self.loops = []
+
+
+def describe(constant):
+	if isinstance(constant, TrogonString):
+		return repr(constant.value)
+	elif isinstance(constant, (TrogonNumber, TrogonBool)):
+		return str(constant.value)
+	elif constant is TrogonNull:
+		return 'null'
+	elif isinstance(constant, tuple):
+		# (slot, name) of DEFINE_NAME, the slot is None for globals
+		slot, name = constant
+		return name if slot is None else f'{name} @{slot}'
+
+	return str(constant)
+
+
+def disassemble(code, indent=''):
+	lines = [f'{indent}{code.name}:']
+	nested = []
+	instructions = code.instructions
+
+	for pc in range(0, len(instructions), 2):
+		opcode, argument = instructions[pc], instructions[pc + 1]
+		text = f'{indent}  {pc:5} {opnames[opcode]:<14}'
+
+		if pc + 1 in code.references:
+			text += f' {argument} ({code.references[pc + 1]})'
+		elif opcode in (
+				LOAD_CONST, LOAD_NAME, LOAD_GLOBAL, STORE_NAME, STORE_GLOBAL, SET_NAME, SET_GLOBAL,
+				DEFINE_NAME, DOT, LOAD_METHOD, MAKE_FUNCTION, SETUP_LOOP,
+				ADD_CONST, SUB_CONST, MOD_CONST, LESS_CONST, EQUAL_CONST):
+			constant = code.constants[argument]
+			text += f' {argument} ({describe(constant)})'
+			if opcode == MAKE_FUNCTION:
+				nested.append(constant.code)
+		elif opcode == BINARY:
+			text += f' {Token.names[argument]}'
+		elif opcode in jumps or opcode in (
+				CALL, TAIL_CALL, CALL_METHOD, BREAK, CONTINUE, BEGIN_SCOPE, NEW_FRAME, ENTER_FRAME):
+			text += f' {argument}'
+
+		lines.append(text)
+
+	for function in nested:
+		lines.append(disassemble(function, indent + '  '))
+
+	return '\n'.join(lines)
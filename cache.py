@@ -0,0 +1,277 @@
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+import zlib
+
+import expression
+import lexer
+import parser
+import statement
+import variables
+from expression import *
+from statement import *
+from variables import *
+
+# An on-disk cache of parsed scripts, the same idea as `__pycache__`.
+#
+# A cache file is MAGIC, a 32 byte key, a crc32 of the payload and the payload:
+# the encoded AST (see below) in the `marshal` format. The key is a hash of the source and of the
+# interpreter (the files below plus the Python version), so editing either
+# one invalidates the entry. Files are written to a temporary name and then
+# renamed, so parallel runs never see a half-written file: the last writer
+# wins and every version is a complete one.
+
+MAGIC = b'TRGC'
+FORMAT_VERSION = 2
+CACHE_DIRECTORY = '__trogoncache__'
+
+header_size = len(MAGIC) + 32 + 4
+
+
+class CacheException(Exception):
+	pass
+
+
+# ==== AST encoding ====
+#
+# The AST is flattened into a string of opcodes and a list of the values
+# they use, both in prefix order: a node's tag comes before its arguments
+# (its constructor's), a list's LIST before its items. The encoder needs no
+# recursion, and the decoder reads both backwards, so every node comes
+# after its arguments and a stack is enough to build it, no nested tuples
+# are ever created. The encoder visits arguments last to first, so the
+# decoder finds them on the stack in order.
+
+nodes = [
+	(Statement, ('type', 'args')),
+	(ExpressionStatement, ('expression',)),
+	(LetStatement, ('name', 'expression')),
+	(ReturnStatement, ('expression',)),
+	(BreakStatement, ()),
+	(ContinueStatement, ()),
+	(WhileStatement, ('condition', 'block')),
+	(ForStatement, ('lvalue', 'left_bound', 'right_bound', 'block', 'has_let')),
+	(FunctionDeclarationStatement, ('expression',)),
+
+	(LiteralExpression, ('value',)),
+	(TableLiteralExpression, ('arguments',)),
+	(VariableExpression, ('name',)),
+	(DotExpression, ('left', 'right')),
+	(SubscriptionExpression, ('expression', 'index')),
+	(CastExpression, ('left', 'right')),
+	(CallExpression, ('expression', 'arguments')),
+	(UnaryExpression, ('operator', 'operand')),
+	(BinaryExpression, ('operator', 'left', 'right')),
+	(LogicalExpression, ('operator', 'left', 'right')),
+	(BlockExpression, ('statements', 'expression')),
+	(IfExpression, ('condition', 'true_block', 'else_block')),
+	(FunctionDeclarationExpression, ('name', 'argnames', 'block')),
+]
+
+node_tags = {cls: (tag, fields) for tag, (cls, fields) in enumerate(nodes)}
+node_classes = [(cls, len(fields)) for cls, fields in nodes]
+
+# the opcodes after the node tags. LIST and DICT take their length from the
+# values, TYPE the index of a type literal
+VALUE = len(nodes)
+LIST = VALUE + 1
+DICT = VALUE + 2
+TYPE = VALUE + 3
+
+# `LiteralExpression` takes a token value, and for the type keywords that's
+# one of the TrogonType objects from `Lexer.keywords_values`
+type_literals = [
+	value for value in lexer.Lexer.keywords_values.values()
+	if isinstance(value, TrogonType)]
+
+
+# the token value of a literal, an int for the TYPE opcode
+def literal_value(value):
+	if isinstance(value, TrogonString):
+		return VALUE, value.value
+	elif isinstance(value, TrogonType):
+		for i, literal in enumerate(type_literals):
+			if literal.value is value.value:
+				return TYPE, i
+	elif value is TrogonNull:
+		return VALUE, None
+	elif isinstance(value, TrogonNumber):
+		return VALUE, value.value
+
+	raise CacheException(f'Can\'t encode literal {value}')
+
+
+scalars = (str, int, float, bool, type(None))
+
+
+# returns (opcodes, values)
+def encode(ast):
+	ops = bytearray()
+	values = []
+	pending = [ast]
+
+	while pending:
+		value = pending.pop()
+		kind = value.__class__
+
+		if kind in scalars:
+			ops.append(VALUE)
+			values.append(value)
+
+		elif kind is list:
+			ops.append(LIST)
+			values.append(len(value))
+			pending.extend(value)
+
+		elif kind is dict:
+			ops.append(DICT)
+			values.append(len(value))
+			for k, v in value.items():
+				pending.append(k)
+				pending.append(v)
+
+		elif kind is LiteralExpression:
+			ops.append(node_tags[kind][0])
+			op, literal = literal_value(value.value)
+			ops.append(op)
+			values.append(literal)
+
+		elif kind in node_tags:
+			tag, fields = node_tags[kind]
+			ops.append(tag)
+			pending.extend([getattr(value, field) for field in fields])
+
+		else:
+			raise CacheException(f'Can\'t encode {kind.__name__}')
+
+	return bytes(ops), values
+
+
+def decode(ops, values):
+	stack = []
+	push = stack.append
+	value = values.pop
+
+	for op in reversed(ops):
+		if op == VALUE:
+			push(value())
+
+		elif op < VALUE:
+			cls, arity = node_classes[op]
+			if arity == 1:
+				stack[-1] = cls(stack[-1])
+			elif arity:
+				arguments = stack[-arity:]
+				del stack[-arity:]
+				push(cls(*arguments))
+			else:
+				push(cls())
+
+		elif op == LIST:
+			count = value()
+			items = stack[len(stack) - count:]
+			del stack[len(stack) - count:]
+			push(items)
+
+		elif op == DICT:
+			count = value() * 2
+			items = stack[len(stack) - count:]
+			del stack[len(stack) - count:]
+			push({items[i]: items[i + 1] for i in range(0, count, 2)})
+
+		else:
+			push(type_literals[value()])
+
+	[ast] = stack
+	return ast
+
+
+# ==== Cache files ====
+
+fingerprint = None
+
+def interpreter_fingerprint():
+	global fingerprint
+
+	if not fingerprint:
+		digest = hashlib.sha256(
+			f'{FORMAT_VERSION} {sys.implementation.cache_tag}'.encode())
+
+		for module in (lexer, parser, expression, statement, variables, sys.modules[__name__]):
+			with open(module.__file__, 'rb') as file:
+				digest.update(file.read())
+
+		fingerprint = digest.digest()
+
+	return fingerprint
+
+
+class ASTCache:
+	def key(self, code):
+		return hashlib.sha256(interpreter_fingerprint() + code.encode()).digest()
+
+	def path(self, script):
+		directory = self.directory
+		if directory is None:
+			directory = os.path.join(os.path.dirname(os.path.abspath(script)), CACHE_DIRECTORY)
+
+		name = f'{os.path.basename(script)}.{sys.implementation.cache_tag}.trc'
+		return os.path.join(directory, name)
+
+	# returns the cached AST or None if there's no valid entry
+	def load(self, script, code):
+		try:
+			with open(self.path(script), 'rb') as file:
+				data = file.read()
+		except OSError:
+			return None
+
+		if len(data) < header_size or data[:len(MAGIC)] != MAGIC:
+			return None
+
+		key = data[len(MAGIC):len(MAGIC) + 32]
+		crc = int.from_bytes(data[len(MAGIC) + 32:header_size], 'little')
+		payload = data[header_size:]
+
+		if key != self.key(code) or zlib.crc32(payload) != crc:
+			return None
+
+		try:
+			return decode(*marshal.loads(payload))
+		except Exception:
+			return None
+
+	# returns False if the AST couldn't be stored, the cache is best-effort
+	def store(self, script, code, ast):
+		try:
+			payload = marshal.dumps(encode(ast))
+		except (CacheException, ValueError):
+			return False
+
+		data = MAGIC + self.key(code) + zlib.crc32(payload).to_bytes(4, 'little') + payload
+		path = self.path(script)
+
+		try:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			fd, temporary = tempfile.mkstemp(
+				dir=os.path.dirname(path), prefix=os.path.basename(path), suffix='.tmp')
+		except OSError:
+			return False
+
+		try:
+			with os.fdopen(fd, 'wb') as file:
+				file.write(data)
+			os.replace(temporary, path)
+		except OSError:
+			try:
+				os.unlink(temporary)
+			except OSError:
+				pass
+			return False
+
+		return True
+
+	def __init__(self, directory=None):
+		self.directory = directory
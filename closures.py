@@ -0,0 +1,530 @@
+from expression import *
+from statement import *
+from runtime import *
+from variables import *
+from lexer import Token
+from bytecode import assignments, fold
+from state import State, UNDEFINED
+
+# Compiles every AST node to a Python closure `f(state)` once, so running the
+# program doesn't dispatch on node types and operators anymore. The closures
+# do exactly what `evaluate`/`interpret` of their node would.
+
+
+class ClosureFunction(TrogonFunction):
+	type = TrogonObject.FUNCTION
+	__slots__ = ('body',)
+
+	# makes the tail calls the body returns, see `TrogonFunction.call`
+	def call(self, arguments):
+		function = self
+		while True:
+			try:
+				result = function.body(function.bind(arguments))
+			except ReturnException as e:
+				result = e.value
+			except (ContinueException, BreakException) as e:
+				raise RuntimeException('Uncaught break or continue')
+
+			if result.__class__ is not Completion:
+				return result
+
+			function, arguments = result.value
+			if function.__class__ is not ClosureFunction:
+				return function.call(arguments)
+
+	def __init__(self, name, argnames, block, layout, body, state):
+		self.arity = len(argnames)
+		self.name = name
+		self.argnames = argnames
+		self.block = block
+		self.layout = layout
+		self.body = body
+		self.state = state
+
+
+def nothing(state):
+	pass
+
+
+def fail(exception, *arguments):
+	def closure(state):
+		raise exception(*arguments)
+
+	return closure
+
+
+# Operators that are a single method call on the left operand. Every one
+# gets its own closure so the method is a plain attribute lookup, and the
+# `constant_operators` version saves a call when the right operand is constant
+operators = {
+	Token.PLUS: lambda left, right: lambda state: left(state).add(right(state)),
+	Token.MINUS: lambda left, right: lambda state: left(state).sub(right(state)),
+	Token.STAR: lambda left, right: lambda state: left(state).mul(right(state)),
+	Token.SLASH: lambda left, right: lambda state: left(state).divide(right(state)),
+	Token.DOUBLE_SLASH: lambda left, right: lambda state: left(state).div(right(state)),
+	Token.PERCENT: lambda left, right: lambda state: left(state).mod(right(state)),
+	Token.SHL: lambda left, right: lambda state: left(state).shl(right(state)),
+	Token.SHR: lambda left, right: lambda state: left(state).shr(right(state)),
+	Token.EQUAL_EQUAL: lambda left, right: lambda state: left(state).equal(right(state)),
+	Token.GREATER: lambda left, right: lambda state: left(state).greater(right(state)),
+	Token.LESS: lambda left, right: lambda state: left(state).less(right(state)),
+}
+
+constant_operators = {
+	Token.PLUS: lambda left, y: lambda state: left(state).add(y),
+	Token.MINUS: lambda left, y: lambda state: left(state).sub(y),
+	Token.STAR: lambda left, y: lambda state: left(state).mul(y),
+	Token.SLASH: lambda left, y: lambda state: left(state).divide(y),
+	Token.DOUBLE_SLASH: lambda left, y: lambda state: left(state).div(y),
+	Token.PERCENT: lambda left, y: lambda state: left(state).mod(y),
+	Token.SHL: lambda left, y: lambda state: left(state).shl(y),
+	Token.SHR: lambda left, y: lambda state: left(state).shr(y),
+	Token.EQUAL_EQUAL: lambda left, y: lambda state: left(state).equal(y),
+	Token.GREATER: lambda left, y: lambda state: left(state).greater(y),
+	Token.LESS: lambda left, y: lambda state: left(state).less(y),
+}
+
+
+class ClosureCompiler:
+	def compile_program(self, statements):
+		compiled = [self.statement(s) for s in statements]
+
+		def program(state):
+			for s in compiled:
+				s(state)
+
+		return program
+
+	# ==== Statements ====
+
+	def statement(self, s):
+		kind = type(s)
+
+		if kind is ExpressionStatement:
+			return self.expression(s.expression)
+
+		elif kind is LetStatement:
+			return self.let(s.slot, s.name, self.expression_or_null(s.expression))
+
+		elif kind is WhileStatement:
+			return self.while_statement(s)
+
+		elif kind is ForStatement:
+			return self.for_statement(s)
+
+		elif kind is FunctionDeclarationStatement:
+			return self.let(s.slot, s.expression.name, self.expression(s.expression))
+
+		# return/break/continue outside of a block do nothing
+		return nothing
+
+	def block_statement(self, s):
+		if s.type == Statement.RETURN:
+			value = self.expression_or_null(s.expression)
+
+			def return_statement(state):
+				raise ReturnException(value(state))
+
+			return return_statement
+
+		elif s.type == Statement.BREAK:
+			return fail(BreakException)
+
+		elif s.type == Statement.CONTINUE:
+			return fail(ContinueException)
+
+		return self.statement(s)
+
+	def let(self, slot, name, value):
+		def let(state):
+			state.declare(slot, name, value(state))
+
+		return let
+
+	def while_statement(self, s):
+		condition = self.expression(s.condition)
+		block = self.loop_body(s.block)
+		size = s.block.size if s.block.reusable else None
+
+		def while_statement(state):
+			frame = State(state, size) if size is not None else state
+			try:
+				while condition(state).to(TrogonBool).value == True:
+					try:
+						block(frame)
+					except ContinueException:
+						continue
+			except BreakException:
+				return
+
+		return while_statement
+
+	def for_statement(self, s):
+		name, slot, size = s.lvalue.name if s.has_let else None, s.slot, s.size
+		left_bound = self.expression(s.left_bound)
+		right_bound = self.expression(s.right_bound)
+		assign = self.assigner(s.lvalue)
+		lvalue = self.expression(s.lvalue)
+		block = self.loop_body(s.block)
+		block_size = s.block.size if s.block.reusable else None
+
+		if s.invariant:
+			return self.counting_for_statement(s, left_bound, right_bound, assign, lvalue, block)
+
+		def for_statement(state):
+			state = State(state, size)
+			frame = State(state, block_size) if block_size is not None else state
+
+			if name:
+				state.declare(slot, name, left_bound(state))
+			else:
+				assign(state, left_bound(state))
+
+			counter = lvalue(state)
+			try:
+				while abs(counter.sub(right_bound(state)).value) >= 1:
+					assign(state, counter)
+
+					try:
+						block(frame)
+					except ContinueException:
+						pass
+
+					if right_bound(state).greater(counter).value:
+						counter = number(counter.value + 1)
+					else:
+						counter = number(counter.value - 1)
+			except BreakException:
+				pass
+
+		return for_statement
+
+	# a `for` loop whose right bound can't change, see `counters`
+	def counting_for_statement(self, s, left_bound, right_bound, assign, lvalue, block):
+		name, slot, size = s.lvalue.name if s.has_let else None, s.slot, s.size
+		block_size = s.block.size if s.block.reusable else None
+
+		def for_statement(state):
+			state = State(state, size)
+			frame = State(state, block_size) if block_size is not None else state
+
+			if name:
+				state.declare(slot, name, left_bound(state))
+			else:
+				assign(state, left_bound(state))
+
+			slots = state.slots if name else None
+			try:
+				for counter in counters(lvalue(state), right_bound(state)):
+					if slots is not None:
+						slots[slot] = counter
+					else:
+						assign(state, counter)
+
+					try:
+						block(frame)
+					except ContinueException:
+						pass
+			except BreakException:
+				pass
+
+		return for_statement
+
+	# Returns `f(frame)`. If the body's frame is reused the loop creates it
+	# and passes it to `f`, otherwise it passes its own scope
+	def loop_body(self, block):
+		if not block.reusable:
+			return self.expression(block)
+
+		statements = [self.block_statement(s) for s in block.statements]
+		result = self.expression_or_null(block.expression)
+
+		def body(frame):
+			frame.reset()
+			for s in statements:
+				s(frame)
+			return result(frame)
+
+		return body
+
+	# ==== Expressions ====
+
+	def expression(self, e):
+		if e is None:
+			return fail(AttributeError, '\'NoneType\' object has no attribute \'evaluate\'')
+
+		return self.expressions[type(e)](self, e)
+
+	def expression_or_null(self, e):
+		if e:
+			return self.expression(e)
+
+		return lambda state: TrogonNull
+
+	def literal(self, e):
+		value = e.value
+		return lambda state: value
+
+	def table_literal(self, e):
+		pairs = [(self.expression(k), self.expression(v)) for k, v in e.arguments.items()]
+
+		def table_literal(state):
+			table = TrogonTable()
+			for k, v in pairs:
+				table.subscript_assign(k(state), v(state))
+			return table
+
+		return table_literal
+
+	def variable(self, e):
+		reference = e.reference
+
+		if not reference.candidates:
+			name = reference.name
+			return lambda state: state.globals.get(name)
+
+		elif len(reference.candidates) > 1:
+			return lambda state: state.load(reference)
+
+		# the common case, a single local variable that's usually defined
+		[(depth, slot)] = reference.candidates
+
+		if depth == 0:
+			def load(state):
+				value = state.slots[slot]
+				return value if value is not UNDEFINED else state.load(reference)
+
+		elif depth == 1:
+			def load(state):
+				value = state.parent.slots[slot]
+				return value if value is not UNDEFINED else state.load(reference)
+
+		else:
+			return lambda state: state.load(reference)
+
+		return load
+
+	def dot(self, e):
+		if not isinstance(e.right, VariableExpression):
+			return fail(RuntimeException, 'Expected VariableExpression!')
+
+		left = self.expression(e.left)
+		name = e.right.name
+		return lambda state: left(state).dot(name)
+
+	def subscription(self, e):
+		expression = self.expression(e.expression)
+		index = self.expression(e.index)
+		return lambda state: expression(state).subscript(index(state))
+
+	def cast(self, e):
+		left = self.expression(e.left)
+		right = self.expression(e.right)
+		return lambda state: left(state).to(right(state).value)
+
+	def call(self, e):
+		if e.cache is not None:
+			return self.method_call(e)
+
+		callee = self.expression(e.expression)
+		arguments = [self.expression(x) for x in e.arguments]
+
+		if e.tail:
+			return lambda state: Completion(
+				Completion.CALL, (callee(state), [x(state) for x in arguments]))
+
+		if not arguments:
+			return lambda state: callee(state).call([])
+
+		elif len(arguments) == 1:
+			first, = arguments
+			return lambda state: callee(state).call([first(state)])
+
+		elif len(arguments) == 2:
+			first, second = arguments
+			return lambda state: callee(state).call([first(state), second(state)])
+
+		return lambda state: callee(state).call([x(state) for x in arguments])
+
+	def method_call(self, e):
+		receiver = self.expression(e.expression.left)
+		arguments = [self.expression(x) for x in e.arguments]
+		lookup = e.cache.lookup
+
+		if not arguments:
+			def method_call(state):
+				value = receiver(state)
+				return lookup(value).call(value, ())
+
+		elif len(arguments) == 1:
+			first, = arguments
+
+			def method_call(state):
+				value = receiver(state)
+				return lookup(value).call(value, [first(state)])
+
+		else:
+			def method_call(state):
+				value = receiver(state)
+				return lookup(value).call(value, [x(state) for x in arguments])
+
+		return method_call
+
+	def unary(self, e):
+		operand = self.expression(e.operand)
+
+		if e.operator == Token.MINUS:
+			return lambda state: operand(state).unary_minus()
+
+		return lambda state: TrogonFalse if operand(state).to(TrogonBool).value else TrogonTrue
+
+	def binary(self, e):
+		if e.operator == Token.EQUAL or e.operator in assignments:
+			return self.assignment(e)
+
+		value = e.constant
+		if value is not None:
+			return lambda state: value
+
+		left = self.expression(e.left)
+		constant = fold(e.right)
+
+		if constant is not None and e.operator in constant_operators:
+			return constant_operators[e.operator](left, constant)
+
+		right = self.expression(e.right)
+		if e.operator in operators:
+			return operators[e.operator](left, right)
+
+		function = BinaryExpression.functions[e.operator]
+		return lambda state: function(left(state), right(state))
+
+	# `f(state, value)` that assigns to the lvalue and returns the result
+	def assigner(self, target):
+		if isinstance(target, VariableExpression):
+			reference = target.reference
+
+			def assign_variable(state, value):
+				state.store(reference, value)
+				return state.load(reference)
+
+			return assign_variable
+
+		elif isinstance(target, SubscriptionExpression):
+			expression = self.expression(target.expression)
+			index = self.expression(target.index)
+			return lambda state, value: expression(state).subscript_assign(index(state), value)
+
+		elif isinstance(target, DotExpression):
+			def assign_dot(state, value):
+				raise RuntimeException('Assignment to a dot expression is not implemented')
+
+			return assign_dot
+
+		return lambda state, value: TrogonNull
+
+	def assignment(self, e):
+		right = self.expression(e.right)
+
+		if getattr(e.left, 'type', None) not in (Expression.LVALUE, Expression.SUBSCRIPTION):
+			def not_lvalue(state):
+				right(state)
+				raise RuntimeException('Expected lvalue!')
+
+			return not_lvalue
+
+		assign = self.assigner(e.left)
+		if e.operator == Token.EQUAL:
+			return lambda state: assign(state, right(state))
+
+		current = self.expression(e.left)
+		function = BinaryExpression.functions[assignments[e.operator]]
+
+		def compound_assignment(state):
+			y = right(state)
+			return assign(state, function(current(state), y))
+
+		return compound_assignment
+
+	def logical(self, e):
+		left = self.expression(e.left)
+		right = self.expression(e.right)
+
+		if e.operator == Token.AND:
+			return lambda state: (
+				TrogonFalse if not left(state).to(TrogonBool).value
+				else right(state).to(TrogonBool))
+
+		return lambda state: (
+			TrogonTrue if left(state).to(TrogonBool).value
+			else right(state).to(TrogonBool))
+
+	def block(self, e):
+		statements = [self.block_statement(s) for s in e.statements]
+		result = self.expression_or_null(e.expression)
+		size = e.size
+
+		if not e.scoped:
+			if not statements:
+				return result
+
+			def unscoped_block(state):
+				for s in statements:
+					s(state)
+				return result(state)
+
+			return unscoped_block
+
+		def block(state):
+			state = State(state, size)
+			for s in statements:
+				s(state)
+			return result(state)
+
+		return block
+
+	def if_expression(self, e):
+		condition = self.expression(e.condition)
+		true_block = self.expression(e.true_block)
+
+		if not e.else_block:
+			def if_expression(state):
+				if condition(state).to(TrogonBool).value == True:
+					return true_block(state)
+
+			return if_expression
+
+		else_block = self.expression(e.else_block)
+
+		def if_else_expression(state):
+			if condition(state).to(TrogonBool).value == True:
+				return true_block(state)
+			return else_block(state)
+
+		return if_else_expression
+
+	def function(self, e):
+		name, argnames, block, layout = e.name, e.argnames, e.block, e.layout
+		body = self.expression(block)
+		return lambda state: ClosureFunction(name, argnames, block, layout, body, state)
+
+	expressions = {
+		LiteralExpression: literal,
+		TableLiteralExpression: table_literal,
+		VariableExpression: variable,
+		DotExpression: dot,
+		SubscriptionExpression: subscription,
+		CastExpression: cast,
+		CallExpression: call,
+		UnaryExpression: unary,
+		BinaryExpression: binary,
+		LogicalExpression: logical,
+		BlockExpression: block,
+		IfExpression: if_expression,
+		FunctionDeclarationExpression: function,
+	}
+
+
+def run(statements, state):
+	return ClosureCompiler().compile_program(statements)(state)
@@ -16,20 +16,21 @@ class Expression:
 	SUBSCRIPTION = 8
 	CAST = 9
 
-	def evaluate(self):
-		return None
+	# AST nodes are slotted, a big script has millions of them
+	__slots__ = ('type',)
 
-	def __init__(self, type, value=None, children=[]):
-		self.type = type
-		self.value = value
-		self.children = children
+	def evaluate(self, state):
+		return None
 
-	def __repr__(self):
-		return f'({self.type} {self.value} {self.children})'
+	# the value, or for blocks and ifs the `Completion` if they ended early
+	def complete(self, state):
+		return self.evaluate(state)
 
 
 class LiteralExpression(Expression):
-	def evaluate(self):
+	__slots__ = ('value',)
+
+	def evaluate(self, state):
 		return self.value
 
 	def __init__(self, value):
@@ -38,9 +39,9 @@ class LiteralExpression(Expression):
 		if isinstance(value, str):
 			self.value = TrogonString(value)
 		elif isinstance(value, int) or isinstance(value, float):
-			self.value = TrogonNumber(value)
+			self.value = number(value)
 		elif isinstance(value, bool):
-			self.value = TrogonBool(value)
+			self.value = boolean(value)
 		elif isinstance(value, TrogonType):
 			self.value = TrogonType(value.value)
 		else:
@@ -51,10 +52,12 @@ class LiteralExpression(Expression):
 
 
 class TableLiteralExpression(Expression):
-	def evaluate(self):
+	__slots__ = ('arguments',)
+
+	def evaluate(self, state):
 		table = TrogonTable()
 		for k, v in self.arguments.items():
-			table.subscript_assign(k.evaluate(), v.evaluate())
+			table.subscript_assign(k.evaluate(state), v.evaluate(state))
 		return table
 
 	def __init__(self, arguments):
@@ -66,27 +69,24 @@ class TableLiteralExpression(Expression):
 
 
 class LvalueExpression(Expression):
-	def evaluate(self):
-		return TrogonNull
+	__slots__ = ()
 
-	def assign(self, value):
+	def evaluate(self, state):
 		return TrogonNull
 
-	def __init__(self, value):
-		self.type = Expression.LVALUE
-		self.value = value
-
-	def __repr__(self):
-		return f'(GENERIC LVALUE {self.value})'
+	def assign(self, state, value):
+		return TrogonNull
 
 
 class VariableExpression(LvalueExpression):
-	def evaluate(self):
-		return State.get_state().get(self.name)
+	__slots__ = ('name', 'reference')
 
-	def assign(self, value):
-		State.get_state().set(self.name, value)
-		return State.get_state().get(self.name)
+	def evaluate(self, state):
+		return state.load(self.reference)
+
+	def assign(self, state, value):
+		state.store(self.reference, value)
+		return state.load(self.reference)
 
 	def __init__(self, name):
 		self.type = Expression.LVALUE
@@ -97,13 +97,15 @@ class VariableExpression(LvalueExpression):
 
 
 class DotExpression(LvalueExpression):
-	def evaluate(self):
+	__slots__ = ('left', 'right')
+
+	def evaluate(self, state):
 		if not isinstance(self.right, VariableExpression):
 			raise RuntimeException('Expected VariableExpression!')
 
-		return self.left.evaluate().dot(self.right.name)
+		return self.left.evaluate(state).dot(self.right.name)
 
-	def assign(self, value):
+	def assign(self, state, value):
 		# TODO:
 		raise RuntimeException('Assignment to a dot expression is not implemented')
 
@@ -117,12 +119,14 @@ class DotExpression(LvalueExpression):
 
 
 class SubscriptionExpression(LvalueExpression):
-	def evaluate(self):
-		return self.expression.evaluate().subscript(self.index.evaluate())
+	__slots__ = ('expression', 'index')
 
-	def assign(self, value):
-		return self.expression.evaluate().subscript_assign(
-			self.index.evaluate(), value)
+	def evaluate(self, state):
+		return self.expression.evaluate(state).subscript(self.index.evaluate(state))
+
+	def assign(self, state, value):
+		return self.expression.evaluate(state).subscript_assign(
+			self.index.evaluate(state), value)
 
 	def __init__(self, expression, index):
 		self.type = Expression.LVALUE
@@ -134,8 +138,10 @@ class SubscriptionExpression(LvalueExpression):
 
 
 class CastExpression(Expression):
-	def evaluate(self):
-		return self.left.evaluate().to(self.right.evaluate().value)
+	__slots__ = ('left', 'right')
+
+	def evaluate(self, state):
+		return self.left.evaluate(state).to(self.right.evaluate(state).value)
 
 	def __init__(self, left, right):
 		self.type = Expression.CAST
@@ -147,26 +153,50 @@ class CastExpression(Expression):
 
 
 class CallExpression(Expression):
-	def evaluate(self):
-		return self.expression.evaluate().call([x.evaluate() for x in self.arguments])
+	__slots__ = ('expression', 'arguments', 'tail', 'cache')
+
+	def evaluate(self, state):
+		if self.cache is not None:
+			receiver = self.expression.left.evaluate(state)
+			return self.cache.lookup(receiver).call(
+				receiver, [x.evaluate(state) for x in self.arguments])
+
+		return self.expression.evaluate(state).call([x.evaluate(state) for x in self.arguments])
+
+	# a call whose result the function returns (see `resolver.py`) is left to
+	# the function, so it doesn't nest another one on the Python stack
+	def complete(self, state):
+		if not self.tail:
+			return self.evaluate(state)
+
+		return Completion(Completion.CALL, (
+			self.expression.evaluate(state), [x.evaluate(state) for x in self.arguments]))
 
 	def __init__(self, expression, arguments=[]):
 		self.type = Expression.CALL
 		self.expression = expression
 		self.arguments = arguments
+		self.tail = False
+
+		# `x.name(...)` calls the method without a bound one in between
+		self.cache = None
+		if type(expression) is DotExpression and type(expression.right) is VariableExpression:
+			self.cache = MethodCache(expression.right.name)
 
 	def __repr__(self):
 		return f'(CALL {self.expression} {self.arguments})'
 
 
 class UnaryExpression(Expression):
+	__slots__ = ('operator', 'operand')
+
 	functions = {
-		Token.MINUS: lambda x: x.evaluate().unary_minus(),
-		Token.NOT: lambda x: TrogonFalse if x.evaluate().to(TrogonBool).value else TrogonTrue
+		Token.MINUS: lambda x, state: x.evaluate(state).unary_minus(),
+		Token.NOT: lambda x, state: TrogonFalse if x.evaluate(state).to(TrogonBool).value else TrogonTrue
 	}
 
-	def evaluate(self):
-		return UnaryExpression.functions[self.operator](self.operand)
+	def evaluate(self, state):
+		return UnaryExpression.functions[self.operator](self.operand, state)
 
 	def __init__(self, operator, operand):
 		self.type = Expression.UNARY
@@ -174,16 +204,27 @@ class UnaryExpression(Expression):
 		self.operand = operand
 
 	def __repr__(self):
-		return f'({self.operator} {self.operand})'
+		return f'({Token.names[self.operator]} {self.operand})'
+
+
+assignment_operators = frozenset((
+	Token.EQUAL, Token.PLUS_EQUAL, Token.MINUS_EQUAL, Token.STAR_EQUAL,
+	Token.SLASH_EQUAL, Token.DOUBLE_SLASH_EQUAL, Token.PERCENT_EQUAL,
+	Token.SHL_EQUAL, Token.SHR_EQUAL
+))
 
 
 class BinaryExpression(Expression):
+	# `constant` is the folded value, see `bytecode.fold`
+	__slots__ = ('operator', 'left', 'right', 'constant')
+
+	# the assignments take the scope too, the tree walker is the only user
 	def assign(f):
-		def inner(x, y):
+		def inner(x, y, state):
 			if x.type not in (Expression.LVALUE, Expression.SUBSCRIPTION):
 				raise RuntimeException('Expected lvalue!')
 
-			return x.assign(f(x.evaluate(), y) if f else y)
+			return x.assign(state, f(x.evaluate(state), y) if f else y)
 
 		return inner
 
@@ -214,50 +255,47 @@ class BinaryExpression(Expression):
 		Token.GREATER: lambda x, y: x.greater(y),
 		Token.LESS: lambda x, y: x.less(y),
 		Token.GREATER_EQUAL: 
-			lambda x, y: TrogonBool(x.equal(y).value or x.greater(y).value),
+			lambda x, y: boolean(x.equal(y).value or x.greater(y).value),
 		Token.LESS_EQUAL:
-			lambda x, y: TrogonBool(x.equal(y).value or x.less(y).value),
+			lambda x, y: boolean(x.equal(y).value or x.less(y).value),
 	}
 
 
-	def evaluate(self):
+	def evaluate(self, state):
 		function = BinaryExpression.functions[self.operator]
 
-		assignments = (
-			Token.EQUAL, Token.PLUS_EQUAL,Token.MINUS_EQUAL, Token.STAR_EQUAL,
-			Token.SLASH_EQUAL, Token.DOUBLE_SLASH_EQUAL, Token.PERCENT_EQUAL,
-			Token.SHL_EQUAL, Token.SHR_EQUAL
-		)
+		if self.operator in assignment_operators:
+			return function(self.left, self.right.evaluate(state), state)
 
-		if self.operator in assignments:
-			return function(self.left, self.right.evaluate())
-
-		return function(self.left.evaluate(), self.right.evaluate())
+		return function(self.left.evaluate(state), self.right.evaluate(state))
 
 	def __init__(self, operator, left, right):
 		self.type = Expression.BINARY
 		self.operator = operator
 		self.left = left
 		self.right = right
+		self.constant = None
 
 	def __repr__(self):
-		return f'({self.operator} {self.left} {self.right})'
+		return f'({Token.names[self.operator]} {self.left} {self.right})'
 
 
 class LogicalExpression(Expression):
+	__slots__ = ('operator', 'left', 'right')
+
 	# TODO: reimplement and move to TrogonObject
-	def evaluate(self):
+	def evaluate(self, state):
 		if self.operator == Token.AND:
-			if not self.left.evaluate().to(TrogonBool).value:
+			if not self.left.evaluate(state).to(TrogonBool).value:
 				return TrogonFalse
 
-			return self.right.evaluate().to(TrogonBool)
+			return self.right.evaluate(state).to(TrogonBool)
 
 		elif self.operator == Token.OR:
-			if self.left.evaluate().to(TrogonBool).value:
+			if self.left.evaluate(state).to(TrogonBool).value:
 				return TrogonTrue
 
-			return self.right.evaluate().to(TrogonBool)
+			return self.right.evaluate(state).to(TrogonBool)
 
 	def __init__(self, operator, left, right):
 		self.type = Expression.LOGICAL
@@ -266,35 +304,37 @@ class LogicalExpression(Expression):
 		self.right = right
 
 	def __repr__(self):
-		return f'({self.operator} {self.left} {self.right})'
+		return f'({Token.names[self.operator]} {self.left} {self.right})'
 
 
 class BlockExpression(Expression):
-	def evaluate(self):
-		State.begin()
-		result = TrogonNull
+	__slots__ = ('statements', 'expression', 'size', 'scoped', 'reusable')
 
-		try:
-			for s in self.statements:
-				if s.type == Statement.RETURN:
-					result = s.expression.evaluate() if s.expression else TrogonNull
-					raise ReturnException(result)
+	def evaluate(self, state, frame=None):
+		result = self.complete(state, frame)
+		if result.__class__ is Completion:
+			raise result.exception()
 
-				elif s.type == Statement.BREAK:
-					raise BreakException()
-
-				elif s.type == Statement.CONTINUE:
-					raise ContinueException()
+		return result
 
-				else:
-					s.interpret()
+	# `frame` is the one from `loop_frame` when the block is a loop's body
+	def complete(self, state, frame=None):
+		if frame:
+			frame.reset()
+			state = frame
+		elif self.scoped:
+			state = State(state, self.size)
 
-			result = self.expression.evaluate() if self.expression else TrogonNull
+		for s in self.statements:
+			completion = s.execute(state)
+			if completion is not None:
+				return completion
 
-		finally:
-			State.end()
+		return self.expression.complete(state) if self.expression else TrogonNull
 
-		return result
+	# the frame every iteration of a loop reuses, None if it can't be reused
+	def loop_frame(self, state):
+		return State(state, self.size) if self.reusable else None
 
 	def __init__(self, statements, expression):
 		self.type = Expression.BLOCK
@@ -306,11 +346,20 @@ class BlockExpression(Expression):
 
 
 class IfExpression(Expression):
-	def evaluate(self):
-		if self.condition.evaluate().to(TrogonBool).value == True:
-			return self.true_block.evaluate()
+	__slots__ = ('condition', 'true_block', 'else_block')
+
+	def evaluate(self, state):
+		result = self.complete(state)
+		if result.__class__ is Completion:
+			raise result.exception()
+
+		return result
+
+	def complete(self, state):
+		if self.condition.evaluate(state).to(TrogonBool).value == True:
+			return self.true_block.complete(state)
 		elif self.else_block:
-			return self.else_block.evaluate()
+			return self.else_block.complete(state)
 
 	def __init__(self, condition, true_block, else_block=None):
 		self.type = Expression.IF;
@@ -323,9 +372,11 @@ class IfExpression(Expression):
 
 
 class FunctionDeclarationExpression(Expression):
-	def evaluate(self):
+	__slots__ = ('name', 'argnames', 'block', 'layout')
+
+	def evaluate(self, state):
 		return TrogonFunction(
-			len(self.argnames), self.name, self.argnames, self.block)
+			len(self.argnames), self.name, self.argnames, self.block, self.layout, state)
 
 	def __init__(self, name, argnames, block):
 		self.name = name
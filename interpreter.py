@@ -0,0 +1,159 @@
+from lexer import Lexer
+from parser import Parser
+from resolver import resolve
+from bytecode import Compiler, disassemble
+from variables import *
+from memoize import TrogonMemoizeFunction
+from state import State
+import contextlib
+import sys
+import threading
+import closures
+import transpiler
+import vm
+
+# Everything a running program owns: its global scope with the builtins, and
+# the engine that runs it. Local scopes are passed along by the engines
+# themselves, nothing is kept in module globals, so one process can host any
+# number of interpreters and run them from different threads.
+#
+# Only the VM keeps the frames of calls that aren't tail calls in a list of
+# its own, so only its recursion goes as deep as memory allows. The tree,
+# closures and python engines nest a few Python calls for every such Trogon
+# call, and Python's recursion limit stops them: with the default limit,
+# tree and closures don't get to 300 levels. With a `stack_size` a program
+# runs on a thread of its own with a stack of that many bytes, and the
+# limit is raised to about as many Python frames as fit in it, see
+# `FRAME_SIZE`. With 1 GiB, tree gets to about 200,000 levels, closures to
+# 400,000 and python past 1,000,000. The limit is raised only while the
+# program runs, the calling thread's stack is no bigger. Either way going
+# past it is a `RuntimeException`.
+#
+# The limit belongs to the whole process, not a thread, and programs may run
+# at the same time: `deep_recursion` only ever raises it while any of them
+# runs, and puts the old limit back once the last one is done.
+
+
+recursion_lock = threading.Lock()
+recursion_users = 0
+recursion_base = None
+
+stack_size_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def deep_recursion(limit):
+	global recursion_users, recursion_base
+
+	with recursion_lock:
+		if recursion_users == 0:
+			recursion_base = sys.getrecursionlimit()
+		recursion_users += 1
+		if sys.getrecursionlimit() < limit:
+			sys.setrecursionlimit(limit)
+
+	try:
+		yield
+	finally:
+		with recursion_lock:
+			recursion_users -= 1
+			if recursion_users == 0:
+				sys.setrecursionlimit(recursion_base)
+
+
+class Interpreter:
+	engines = ('tree', 'vm', 'closures', 'python')
+
+	# bytes of stack a Python frame of the tree walker takes at most, an
+	# estimate on the safe side: a limit that lets the frames outgrow the
+	# thread's stack crashes the process instead of raising RecursionError
+	FRAME_SIZE = 512
+
+	# the lexer runs as the parser needs tokens, see `Parser`
+	def parse(self, code):
+		return Parser(Lexer(code)).parse()
+
+	# annotates `ast` for the engines, returns the names it uses that aren't
+	# defined anywhere
+	def resolve(self, ast):
+		return resolve(ast, self.globals.variables, self.assigned_globals)
+
+	# returns a function that runs the program in a scope and the text for
+	# --dump-code (None if the engine runs the AST itself)
+	def prepare(self, ast):
+		if self.engine == 'vm':
+			code = Compiler().compile_program(ast)
+			return lambda state: vm.execute(code, state), lambda: disassemble(code)
+
+		elif self.engine == 'closures':
+			return closures.ClosureCompiler().compile_program(ast), None
+
+		elif self.engine == 'python':
+			translation = transpiler.Transpiler()
+			program = translation.transpile_program(ast)
+			return program, lambda: '\n\n'.join(translation.sources)
+
+		def interpret(state):
+			for s in ast:
+				s.interpret(state)
+
+		return interpret, None
+
+	def execute(self, program):
+		try:
+			return self.execute_on_stack(program)
+		except RecursionError:
+			raise RuntimeException('Maximum recursion depth exceeded') from None
+
+	def execute_on_stack(self, program):
+		if not self.stack_size:
+			return program(self.globals)
+
+		error = None
+
+		def run():
+			nonlocal error
+			try:
+				program(self.globals)
+			except BaseException as e:
+				error = e
+
+		with deep_recursion(self.stack_size // Interpreter.FRAME_SIZE):
+			self.start(run).join()
+
+		if error is not None:
+			raise error
+
+	# `threading.stack_size` is process-wide too, it's only set while the
+	# program's thread starts
+	def start(self, target):
+		with stack_size_lock:
+			size = threading.stack_size(self.stack_size)
+			try:
+				thread = threading.Thread(target=target, daemon=True)
+				thread.start()
+			finally:
+				threading.stack_size(size)
+
+		return thread
+
+	def run(self, code):
+		ast = self.parse(code)
+		self.resolve(ast)
+		self.execute(self.prepare(ast)[0])
+
+	# with the default `stack_size` of 0 programs run on the calling thread
+	def __init__(self, engine='tree', stack_size=0):
+		if engine not in Interpreter.engines:
+			raise ValueError(f'Unknown engine {engine}')
+
+		self.engine = engine
+		self.stack_size = stack_size
+		self.globals = State()
+		# names of the globals every program so far assigns, see `resolver.py`
+		self.assigned_globals = {}
+		self.globals.register('print', TrogonPrintFunction())
+		self.globals.register('printf', TrogonPrintFormattedFunction())
+		self.globals.register('input', TrogonInputFunction())
+		self.globals.register('random', TrogonRandomFunction())
+		self.globals.register('memoize', TrogonMemoizeFunction(self.assigned_globals))
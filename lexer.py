@@ -1,71 +1,76 @@
+import itertools
+import re
 import string
 import variables
+from array import array
 
 class Token:
-	EOF = 'EOF' # 0
-
-	LEFT_PAREN = 'LEFT_PAREN' #1
-	RIGHT_PAREN = 'RIGHT_PAREN' #2
-	LEFT_BRACE = 'LEFT_BRACE' #3
-	RIGHT_BRACE = 'RIGHT_BRACE' #4
-	LEFT_BRACKET = 'LEFT_BRACKET'
-	RIGHT_BRACKET = 'RIGHT_BRACKET'
-	SEMICOLON = 'SEMICOLON'#5
-	COLON = 'COLON'
-	COMMA = 'COMMA'
-	DOT = 'DOT'
-	DOUBLE_DOT = 'DOUBLE_DOT'
-	PLUS = 'PLUS' #6
-	MINUS = 'MINUS' #7
-	STAR = 'STAR' #8
-	SLASH = 'SLASH' #9
-	DOUBLE_SLASH = 'DOUBLE_SLASH'#10
-	PERCENT = 'PERCENT'
-	SHL = 'SHL'#11
-	SHR = 'SHR'#12
-
-	EQUAL = 'EQUAL'#16
-	EQUAL_EQUAL = 'EQUAL_EQUAL'#17
-	LESS = 'LESS'#18
-	LESS_EQUAL = 'LESS_EQUAL'#19
-	GREATER = 'GREATER'#20
-	GREATER_EQUAL = 'GREATER_EQUAL'#21
-	PLUS_EQUAL = 'PLUS_EQUAL'#22
-	MINUS_EQUAL = 'MINUS_EQUAL'#23
-	STAR_EQUAL = 'STAR_EQUAL'#24
-	SLASH_EQUAL = 'SLASH_EQUAL'#25
-	DOUBLE_SLASH_EQUAL = 'DOUBLE_SLASH_EQUAL'#26
-	PERCENT_EQUAL = 'PERCENT_EQUAL'
-	BANG_EQUAL = 'BANG_EQUAL'#27
-	SHL_EQUAL = 'SHL_EQUAL'#28
-	SHR_EQUAL = 'SHR_EQUAL'#29
-
-	IDENTIFIER = 'IDENTIFIER'#50
-	STRING_LITERAL = 'STRING_LITERAL'#51
-	NUMBER_LITERAL = 'NUMBER_LITERAL'#52
-
-	IF = 'IF'#80
-	ELSE = 'ELSE'#81
-	FOR = 'FOR'#82
-	WHILE = 'WHILE'#83
-	NULL = 'NULL'#84
-	TRUE = 'TRUE'#85
-	FALSE = 'FALSE'#86
-	FUNCTION = 'FUNCTION'#87
-	RETURN = 'RETURN'#88
-	BREAK = 'BREAK'
-	CONTINUE = 'CONTINUE'
-	LET = 'LET'#89
-	NOT = 'NOT'#91
-	AND = 'AND'#92 
-	OR = 'OR'#93
-	IN = 'IN'
-	AS = 'AS'
-	BOOL = 'BOOL'
-	STRING = 'STRING'
-	NUMBER = 'NUMBER'
-	NULLTYPE = 'NULLTYPE'
-	TABLE = 'TABLE'
+	EOF = 0
+
+	LEFT_PAREN = 1
+	RIGHT_PAREN = 2
+	LEFT_BRACE = 3
+	RIGHT_BRACE = 4
+	LEFT_BRACKET = 5
+	RIGHT_BRACKET = 6
+	SEMICOLON = 7
+	COLON = 8
+	COMMA = 9
+	DOT = 10
+	DOUBLE_DOT = 11
+	PLUS = 12
+	MINUS = 13
+	STAR = 14
+	SLASH = 15
+	DOUBLE_SLASH = 16
+	PERCENT = 17
+	SHL = 18
+	SHR = 19
+
+	EQUAL = 20
+	EQUAL_EQUAL = 21
+	LESS = 22
+	LESS_EQUAL = 23
+	GREATER = 24
+	GREATER_EQUAL = 25
+	PLUS_EQUAL = 26
+	MINUS_EQUAL = 27
+	STAR_EQUAL = 28
+	SLASH_EQUAL = 29
+	DOUBLE_SLASH_EQUAL = 30
+	PERCENT_EQUAL = 31
+	BANG_EQUAL = 32
+	SHL_EQUAL = 33
+	SHR_EQUAL = 34
+
+	IDENTIFIER = 35
+	STRING_LITERAL = 36
+	NUMBER_LITERAL = 37
+
+	IF = 38
+	ELSE = 39
+	FOR = 40
+	WHILE = 41
+	NULL = 42
+	TRUE = 43
+	FALSE = 44
+	FUNCTION = 45
+	RETURN = 46
+	BREAK = 47
+	CONTINUE = 48
+	LET = 49
+	NOT = 50
+	AND = 51
+	OR = 52
+	IN = 53
+	AS = 54
+	BOOL = 55
+	STRING = 56
+	NUMBER = 57
+	NULLTYPE = 58
+	TABLE = 59
+
+	__slots__ = ('type', 'line', 'value')
 
 	def __init__(self, type, line, value=None):
 		self.type = type
@@ -73,7 +78,51 @@ class Token:
 		self.value = value
 
 	def __repr__(self):
-		return f'token({self.type}, {self.value})'
+		return f'token({Token.names[self.type]}, {self.value})'
+
+Token.names = {v: k for k, v in vars(Token).items() if type(v) is int}
+
+
+# The whole token stream in a few flat arrays instead of a list of `Token`s:
+# token `i` has kind `kinds[i]`, is on line `lines[i]` and has the value
+# `literals[values[i]]`. Equal literals (mostly identifiers) share a slot,
+# index 0 is None
+class TokenBuffer:
+	def append(self, type, line, value=None):
+		self.kinds.append(type)
+		self.lines.append(line)
+
+		if value is None:
+			self.values.append(0)
+			return
+
+		# the class is a part of the key so `true` doesn't turn into `1`
+		key = (value.__class__, value)
+		index = self.literal_indices.get(key)
+		if index is None:
+			index = self.literal_indices[key] = len(self.literals)
+			self.literals.append(value)
+		self.values.append(index)
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def __getitem__(self, i):
+		return Token(self.kinds[i], self.lines[i], self.literals[self.values[i]])
+
+	def __iter__(self):
+		for i in range(len(self.kinds)):
+			yield self[i]
+
+	def __init__(self):
+		self.kinds = array('B')
+		self.lines = array('I')
+		self.values = array('I')
+		self.literals = [None]
+		self.literal_indices = {}
+
+	def __repr__(self):
+		return repr(list(self))
 
 
 class LexingException(Exception):
@@ -118,11 +167,170 @@ class Lexer:
 	identifier_start = string.ascii_letters + '_'
 	identifier_chars = identifier_start + string.digits
 
+	operators = {
+		'(': Token.LEFT_PAREN, ')': Token.RIGHT_PAREN,
+		'{': Token.LEFT_BRACE, '}': Token.RIGHT_BRACE,
+		'[': Token.LEFT_BRACKET, ']': Token.RIGHT_BRACKET,
+		';': Token.SEMICOLON, ':': Token.COLON, ',': Token.COMMA,
+		'.': Token.DOT, '..': Token.DOUBLE_DOT,
+		'+': Token.PLUS, '-': Token.MINUS, '*': Token.STAR, '/': Token.SLASH,
+		'//': Token.DOUBLE_SLASH, '%': Token.PERCENT,
+		'<<': Token.SHL, '>>': Token.SHR,
+		'=': Token.EQUAL, '==': Token.EQUAL_EQUAL, '!=': Token.BANG_EQUAL,
+		'<': Token.LESS, '<=': Token.LESS_EQUAL,
+		'>': Token.GREATER, '>=': Token.GREATER_EQUAL,
+		'+=': Token.PLUS_EQUAL, '-=': Token.MINUS_EQUAL,
+		'*=': Token.STAR_EQUAL, '/=': Token.SLASH_EQUAL,
+		'//=': Token.DOUBLE_SLASH_EQUAL, '%=': Token.PERCENT_EQUAL,
+		'<<=': Token.SHL_EQUAL, '>>=': Token.SHR_EQUAL
+	}
+
+	# Horizontal whitespace is skipped in front of every token, then one
+	# alternative per token class is tried. The groups are numbered in the
+	# order below, `scan` dispatches on the number of the group that matched.
+	# ERROR matches any other character, so the scanner stops only at the end
+	# of the input (or in the trailing whitespace)
+	OPERATOR, IDENTIFIER, NEWLINE, NUMBER, STRING, COMMENT, UNTERMINATED, ERROR = range(1, 9)
+
+	master = re.compile(r"""
+		[ \t\r]*
+		(?:
+			(//=|<<=|>>=|\.\.|//|<<|>>|[-+*/%=<>!]=|[-+*/%=<>(){}\[\];:,.])
+			| ([A-Za-z_][A-Za-z0-9_]*)
+			| (\n[ \t\r\n]*)
+			| (0b(?:[01_]|\.(?!\.))*
+				| 0x(?:[0-9A-Fa-f_]|\.(?!\.))*
+				| [0-9](?:[0-9_]|\.(?!\.))*)
+			| ('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+			| (\#[^\n\0]*\0?)
+			| (['"])
+			| ([^ \t\r])
+		)
+	""", re.VERBOSE | re.DOTALL)
+
+	escape_sequence = re.compile(r'\\(.)', re.DOTALL)
+
 	def __init__(self, code):
 		self.code = code
 		self.line = 1
 		self.start = 0
 		self.pos = 0
+		self.tokens = TokenBuffer()
+
+	def number(self, text, end):
+		radix = 10
+		if len(text) > 1 and text[1] in 'bx':
+			radix = 2 if text[1] == 'b' else 16
+			digits = self.radix_digits[radix]
+			if len(text) < 3 or text[2] not in digits:
+				following = text[2] if len(text) > 2 else self.peek_at(end)
+				raise LexingException(
+					f"Invalid digit '{following}' while parsing base-{radix} number on line {self.line}")
+
+		dots = text.count('.')
+		if not dots:
+			return int(text, radix)
+
+		if dots > 1:
+			raise LexingException("Error while parsing number literal on line " + str(self.line))
+
+		if radix != 10:
+			raise LexingException('Float literals are only allowed for base-10')
+
+		return float(text)
+
+	def unescape(self, value, line):
+		parts = []
+		pos = 0
+		for match in self.escape_sequence.finditer(value):
+			sequence = match.group()
+			if sequence not in self.escape_characters:
+				line += value.count('\n', 0, match.start())
+				raise LexingException(f'line {line}: Invalid escape sequence')
+
+			parts.append(value[pos:match.start()])
+			parts.append(self.escape_characters[sequence])
+			pos = match.end()
+
+		parts.append(value[pos:])
+		return ''.join(parts)
+
+	def peek_at(self, pos):
+		return self.code[pos] if pos < len(self.code) else None
+
+	# Yields (type, line, value) for every token as the source is scanned
+	def tokenize(self):
+		code = self.code
+		keywords = self.keywords
+		keywords_values = self.keywords_values
+		operators = self.operators
+		line = self.line
+
+		for match in iter(self.master.scanner(code, self.pos).match, None):
+			group = match.lastindex
+			text = match.group(group)
+
+			if group == Lexer.OPERATOR:
+				yield operators[text], line, None
+
+			elif group == Lexer.IDENTIFIER:
+				if text in keywords:
+					yield keywords[text], line, keywords_values.get(text)
+				else:
+					yield Token.IDENTIFIER, line, text
+
+			elif group == Lexer.NEWLINE:
+				line += text.count('\n')
+
+			elif group == Lexer.NUMBER:
+				self.line = line
+				yield Token.NUMBER_LITERAL, line, self.number(text, match.end())
+
+			elif group == Lexer.STRING:
+				value = text[1:-1]
+				if '\\' in value:
+					value = self.unescape(value, line)
+
+				yield Token.STRING_LITERAL, line, value
+				line += text.count('\n')
+
+			elif group == Lexer.COMMENT:
+				pass
+
+			elif group == Lexer.UNTERMINATED:
+				# the reference scanner reports a bad escape before the missing quote
+				self.unescape(code[match.end():] + '\0', line)
+				raise LexingException(f'line {line}: Can\'t find a matching {text}')
+
+			elif text == '!':
+				following = self.peek_at(match.end())
+				raise LexingException(f'Expected "!=" but got "!{following}" on line {line}')
+
+			else:
+				raise LexingException(f'Unexpected character "{text}" on line {line}')
+
+		self.line = line
+		self.pos = self.start = len(code)
+
+	# Tokens one by one, so a consumer (e.g. `Parser`) can start before the
+	# whole file is lexed
+	def iter_tokens(self):
+		return itertools.starmap(Token, self.tokenize())
+
+	# All the tokens at once, packed into a `TokenBuffer`
+	def scan(self):
+		append = self.tokens.append
+		for type, line, value in self.tokenize():
+			append(type, line, value)
+
+		return self.tokens
+
+
+# The original character-at-a-time scanner. It's kept as a reference
+# implementation: `bench.py` checks the table-driven `Lexer` against it
+class ReferenceLexer(Lexer):
+	def __init__(self, code):
+		Lexer.__init__(self, code)
 		self.tokens = []
 
 	def peek(self):
@@ -256,16 +464,17 @@ class Lexer:
 					self.tokens.append(Token(Token.GREATER, self.line))
 
 			elif c == '!':
-				if self.nextchar() == '=':
+				if self.peek() == '=':
 					self.nextchar()
 					self.tokens.append(Token(Token.BANG_EQUAL, self.line))
 				else:
-					raise LexingException('Expected "!=" but got "!{}" on line'.format(c, self.line))
+					raise LexingException(f'Expected "!=" but got "!{self.peek()}" on line {self.line}')
 
 			elif c == '#':
 				while self.peek() not in ['\n', '\0', None]:
 					self.nextchar()
-				self.nextchar()
+				if self.peek() == '\0':
+					self.nextchar()
 
 			elif c in '0123456789':
 				tmp = [c]
@@ -315,12 +524,18 @@ class Lexer:
 			elif c in '\'"':
 				tmp = []
 				literal = c
+				line = self.line
 
 				while self.peek() != literal:
+					if self.peek() == None:
+						raise LexingException(f'line {line}: Can\'t find a matching {literal}')
+
 					c = self.nextchar()
+					if c == '\n':
+						self.line += 1
 
 					if c == '\\':
-						if (c + self.peek()) in self.escape_characters:
+						if (c + (self.peek() or '')) in self.escape_characters:
 							tmp.append(self.escape_characters[(c + self.nextchar())])
 						else:
 							raise LexingException(f'line {self.line}: Invalid escape sequence')
@@ -328,15 +543,11 @@ class Lexer:
 						tmp.append(c)
 				else:
 					self.nextchar()
-					self.tokens.append(Token(Token.STRING_LITERAL, self.line, ''.join(tmp)))
-					continue
-
-				if self.peek() == None:
-					raise LexingException(f'line {self.line}: Can\'t find a matching {literal}')
+					self.tokens.append(Token(Token.STRING_LITERAL, line, ''.join(tmp)))
 
 			elif c in self.identifier_start:
 				tmp = [c]
-				while self.peek() in self.identifier_chars:
+				while self.peek() and self.peek() in self.identifier_chars:
 					tmp.append(self.nextchar())
 
 				tmp = ''.join(tmp)
@@ -0,0 +1,442 @@
+import collections
+import copy
+import math
+
+from expression import *
+from statement import *
+from variables import *
+from lexer import Token
+from bytecode import assignments
+from state import UNDEFINED
+
+# `memoize(f)` and `memoize(f, size)`: a function that remembers the results
+# of the last `size` calls of `f` by their arguments.
+#
+# Only a function whose result depends on nothing but its arguments can be
+# memoized, so `memoize` first looks through its body (and the bodies of the
+# functions it calls by name) and refuses it if it calls a builtin with a side
+# effect, assigns to a variable it doesn't declare itself or changes a table.
+# It also refuses a call it can't follow, like `t['f']()` or one through a
+# local variable that may hold something else than a function it checked,
+# e.g. `let p = print; p(x)`. Only the arguments of `f` may be called
+# blindly: a call with a function or a table argument is never cached.
+#
+# A variable from outside `f` that it calls must hold a checked function
+# (or a memoized one) when `memoize` runs, and nothing else may ever be
+# assigned to it anywhere in the program, see `resolver.py`. So a function
+# that isn't defined yet or that a global only gets later is refused too.
+#
+# The memoized copy of `f` doesn't define its own name when it's called, so a
+# recursive call goes to whatever the name means outside: after
+# `fib = memoize(fib);` the recursion is memoized too, like in Python.
+
+
+DEFAULT_SIZE = 1024
+
+# builtins that print, read or change the state of the random generator
+impure_builtins = {
+	TrogonPrintFunction: 'print',
+	TrogonPrintFormattedFunction: 'printf',
+	TrogonInputFunction: 'input',
+	TrogonRandomFunction: 'random',
+}
+
+mutating_methods = ('clear', 'remove')
+
+
+class ImpureException(Exception):
+	pass
+
+
+# The slots of one scope of the checked function that are certainly defined
+# at the current node (see `Resolver.definite`), the ones that hold a table
+# or string the function created itself from a literal, and the ones that
+# are safe to call: a function whose body is checked, or an argument of the
+# memoized function
+class Scope:
+	__slots__ = ('defined', 'owned', 'callable')
+
+	def __init__(self, defined=(), callable=()):
+		self.defined = set(defined)
+		self.owned = set()
+		self.callable = set(callable)
+
+
+# Walks a function's body like `Resolver` did. `depth` is the number of
+# scopes between the current node and the function's own frame, `scopes`
+# has one `Scope` for each of them. A reference is local if one of its
+# candidates that's at most that deep is certainly defined, otherwise it may
+# still mean an outer or a global variable.
+#
+# A function may change a table or string it created, as long as the
+# variable holding it never holds anything else: `changed` has the
+# variables it changed, so losing one later refuses the function too.
+# `called` does the same for the variables it called
+class PurityChecker:
+	# `own_name` is False for the memoized copy, it doesn't define its name
+	def check(self, function, own_name=True):
+		if function.block in self.checked:
+			return
+		self.checked.add(function.block)
+
+		# the arguments of a callee may be anything the caller passes
+		memoized = not own_name
+		outer, self.state = self.state, function.state
+		scopes, self.scopes = self.scopes, [
+			self.frame(function.argnames, function.layout, own_name, memoized)]
+		self.block(function.block, 0)
+		self.state, self.scopes = outer, scopes
+
+	# the scope of a call, with the slots it defines before its body runs,
+	# see `TrogonFunction.bind`
+	def frame(self, argnames, layout, own_name=True, memoized=False):
+		size, argslots, self_slot = layout
+		slots = list(range(len(argnames))) if argslots is None else list(argslots)
+		scope = Scope(slots, slots if memoized else ())
+		if self_slot is not None and own_name:
+			scope.defined.add(self_slot)
+			scope.callable.add(self_slot)
+		elif self_slot is not None:
+			self.unbound.add((scope, self_slot))
+
+		return scope
+
+	# (scope, slot) of the local variable a reference certainly means, None
+	# if it may mean one outside the function
+	def local(self, reference, depth):
+		for d, slot in reference.candidates:
+			if d > depth:
+				return None
+
+			scope = self.scopes[depth - d]
+			if slot in scope.defined:
+				return scope, slot
+
+		return None
+
+	# the value a name outside the function has right now, UNDEFINED if it
+	# doesn't have one yet: a `let` that runs later may still give it one
+	def value(self, reference, depth):
+		for d, slot in reference.candidates:
+			# not defined here, see `local`
+			if d <= depth:
+				if (self.scopes[depth - d], slot) in self.unbound:
+					continue
+				return UNDEFINED
+
+			head = self.state
+			for _ in range(d - depth - 1):
+				head = head.parent
+
+			return head.slots[slot]
+
+		return self.state.globals.variables.get(reference.name, UNDEFINED)
+
+	# whether a name outside the function may hold something else later
+	def reassigned(self, reference):
+		if reference.candidates:
+			assigned = reference.assigned
+		else:
+			assigned = self.assigned_globals.get(reference.name)
+
+		# False if it's only ever assigned `memoize(...)`, unless `memoize` is
+		return assigned or assigned is False and 'memoize' in self.assigned_globals
+
+	def block(self, block, depth):
+		if block.scoped:
+			depth += 1
+			self.scopes.append(Scope())
+
+		for s in block.statements:
+			self.statement(s, depth)
+		self.expression(block.expression, depth)
+
+		if block.scoped:
+			self.scopes.pop()
+
+	def statement(self, s, depth):
+		kind = type(s)
+
+		if kind in (LetStatement, FunctionDeclarationStatement):
+			self.expression(s.expression, depth)
+
+			scope = self.scopes[depth]
+			scope.defined.add(s.slot)
+			if kind is LetStatement and created(s.expression):
+				scope.owned.add(s.slot)
+			name = s.name if kind is LetStatement else s.expression.name
+			self.bind((scope, s.slot), name, s.expression)
+
+		elif kind in (ReturnStatement, ExpressionStatement):
+			self.expression(s.expression, depth)
+
+		elif kind is WhileStatement:
+			self.expression(s.condition, depth)
+			self.block(s.block, depth)
+
+		elif kind is ForStatement:
+			depth += 1
+			self.scopes.append(Scope())
+
+			self.expression(s.left_bound, depth)
+			if s.has_let:
+				self.scopes[depth].defined.add(s.slot)
+			else:
+				self.assign(s.lvalue, None, depth)
+
+			self.expression(s.right_bound, depth)
+			self.block(s.block, depth)
+			self.scopes.pop()
+
+	# `value` is the expression assigned, None if it isn't one
+	def assign(self, lvalue, value, depth):
+		if type(lvalue) is not VariableExpression:
+			self.change(lvalue, depth)
+			return
+
+		variable = self.local(lvalue.reference, depth)
+		if variable is None:
+			raise ImpureException(f'it assigns to {lvalue.name}, which may not be its own variable')
+
+		if not created(value):
+			scope, slot = variable
+			scope.owned.discard(slot)
+			if variable in self.changed:
+				raise ImpureException(
+					f'it changes {lvalue.name}, which doesn\'t always hold a value it created')
+
+		self.bind(variable, lvalue.name, value)
+
+	# `variable` gets `value`, the expression assigned (None if unknown)
+	def bind(self, variable, name, value):
+		scope, slot = variable
+		if type(value) is FunctionDeclarationExpression:
+			scope.callable.add(slot)
+			return
+
+		scope.callable.discard(slot)
+		if variable in self.called:
+			raise ImpureException(f'it calls {name}, which doesn\'t always hold a function it checked')
+
+	# `target` is a subscript or a dot whose table or string changes
+	def change(self, target, depth):
+		root = target.expression if type(target) is SubscriptionExpression else target.left
+
+		variable = None
+		if type(root) is VariableExpression:
+			variable = self.local(root.reference, depth)
+
+		if variable is None or variable[1] not in variable[0].owned:
+			name = root.name if type(root) is VariableExpression else 'a table or string'
+			raise ImpureException(f'it changes {name}, which it didn\'t create')
+
+		self.changed.add(variable)
+
+	def expression(self, e, depth):
+		kind = type(e)
+
+		if kind is TableLiteralExpression:
+			for k, v in e.arguments.items():
+				self.expression(k, depth)
+				self.expression(v, depth)
+
+		elif kind is DotExpression:
+			self.expression(e.left, depth)
+
+		elif kind is SubscriptionExpression:
+			self.expression(e.expression, depth)
+			self.expression(e.index, depth)
+
+		elif kind is CallExpression:
+			self.call(e, depth)
+			self.expression(e.expression, depth)
+			for argument in e.arguments:
+				self.expression(argument, depth)
+
+		elif kind is UnaryExpression:
+			self.expression(e.operand, depth)
+
+		elif kind is BinaryExpression:
+			self.expression(e.left, depth)
+			self.expression(e.right, depth)
+			if e.operator == Token.EQUAL:
+				self.assign(e.left, e.right, depth)
+			elif e.operator in assignments:
+				self.assign(e.left, None, depth)
+
+		elif kind in (LogicalExpression, CastExpression):
+			self.expression(e.left, depth)
+			self.expression(e.right, depth)
+
+		elif kind is BlockExpression:
+			self.block(e, depth)
+
+		elif kind is IfExpression:
+			self.expression(e.condition, depth)
+			self.expression(e.true_block, depth)
+			self.expression(e.else_block, depth)
+
+		elif kind is FunctionDeclarationExpression:
+			# its frame, it may be called from here
+			self.scopes.append(self.frame(e.argnames, e.layout))
+			self.block(e.block, depth + 1)
+			self.scopes.pop()
+
+	def call(self, e, depth):
+		callee = e.expression
+		kind = type(callee)
+
+		if kind is DotExpression:
+			if callee.right.name in mutating_methods:
+				self.change(callee, depth)
+			return
+		elif kind is FunctionDeclarationExpression:
+			# its body is checked as any expression
+			return
+
+		# `t['f']()` is only followed if `t` is an argument
+		root = callee.expression if kind is SubscriptionExpression else callee
+		if type(root) is not VariableExpression:
+			raise ImpureException('it calls a function it can\'t see')
+
+		variable = self.local(root.reference, depth)
+		if variable is not None:
+			scope, slot = variable
+			if slot not in scope.callable:
+				raise ImpureException(
+					f'it calls {root.name}, which doesn\'t always hold a function it checked')
+			self.called.add(variable)
+			return
+
+		if kind is SubscriptionExpression:
+			raise ImpureException(f'it calls a function from {root.name}, which it can\'t see')
+
+		value = self.value(root.reference, depth)
+		if value is UNDEFINED:
+			raise ImpureException(f'it calls {root.name}, which isn\'t defined yet')
+		elif type(value) in impure_builtins:
+			raise ImpureException(f'it calls {impure_builtins[type(value)]}')
+		elif self.reassigned(root.reference):
+			raise ImpureException(f'it calls {root.name}, which may hold something else later')
+		elif isinstance(value, TrogonFunction):
+			self.check(value)
+		elif type(value) is not TrogonMemoizedFunction:
+			raise ImpureException(f'it calls {root.name}, which isn\'t a function it can check')
+
+	# `assigned_globals` is the interpreter's, see `resolver.py`
+	def __init__(self, assigned_globals):
+		self.assigned_globals = assigned_globals
+		self.state = None
+		self.scopes = []
+		self.checked = set()
+		self.changed = set()
+		self.called = set()
+		# the name of the memoized copy, that it never defines
+		self.unbound = set()
+
+
+# whether `e` creates a new table or string, that only the variable it's
+# assigned to holds
+def created(e):
+	return type(e) is TableLiteralExpression or (
+		type(e) is LiteralExpression and e.value.type == TrogonObject.STRING)
+
+
+# How the cache knows a call, None if it can't: tables can change between
+# calls and functions aren't compared by value
+def call_key(arguments):
+	key = []
+	for value in arguments:
+		kind = value.type
+		if kind == TrogonObject.NUMBER:
+			# 1, 1.0 and true print differently
+			key.append((type(value.value), value.value))
+		elif kind == TrogonObject.STRING:
+			key.append(value.value)
+		elif kind == TrogonObject.NULL or kind == TrogonObject.BOOL or kind == TrogonObject.TYPE:
+			key.append((kind, value.value))
+		else:
+			return None
+
+	return tuple(key)
+
+
+class TrogonMemoizedFunction(TrogonCallable):
+	type = TrogonObject.FUNCTION
+	__slots__ = ('cache', 'size', 'hits', 'misses')
+
+	def equal(self, y):
+		return boolean(self is y)
+
+	methods = {
+		'hits': Method('hits', 0, lambda self, arguments: number(self.hits)),
+		'misses': Method('misses', 0, lambda self, arguments: number(self.misses)),
+	}
+
+	def call(self, arguments):
+		key = call_key(arguments)
+		if key is not None:
+			result = self.cache.get(key, UNDEFINED)
+			if result is not UNDEFINED:
+				self.hits += 1
+				self.cache.move_to_end(key)
+				return result
+
+		self.misses += 1
+		result = self.function.call(arguments)
+
+		# a table result would be shared by every call
+		if key is not None and not isinstance(result, TrogonTable):
+			self.cache[key] = result
+			if len(self.cache) > self.size:
+				self.cache.popitem(last=False)
+
+		return result
+
+	def __init__(self, function, size):
+		self.arity = function.arity
+		self.function = function
+		self.cache = collections.OrderedDict()
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+
+
+class TrogonMemoizeFunction(TrogonCallable):
+	type = TrogonObject.FUNCTION
+	__slots__ = ('assigned_globals',)
+
+	def equal(self, y):
+		return TrogonTrue if isinstance(y, TrogonMemoizeFunction) else TrogonFalse
+
+	def call(self, arguments):
+		if len(arguments) not in (1, 2):
+			raise RuntimeException(f'Expected 1 or 2 arguments, got {len(arguments)}')
+
+		function = arguments[0]
+		if not isinstance(function, TrogonFunction):
+			raise RuntimeException('Only functions declared in Trogon can be memoized')
+
+		size = DEFAULT_SIZE
+		if len(arguments) == 2:
+			size = arguments[1].value if arguments[1].type == TrogonObject.NUMBER else None
+			# inf and nan can't be converted, check before `int`
+			if size is None or not (isinstance(size, int) or math.isfinite(size) and size.is_integer()) \
+					or size < 1:
+				raise RuntimeException('The size of a memoized function\'s cache must be a positive integer')
+
+		try:
+			PurityChecker(self.assigned_globals).check(function, own_name=False)
+		except ImpureException as e:
+			raise RuntimeException(f'Can\'t memoize {function.name or "<function>"}: {e}')
+
+		# see the comment at the top
+		function = copy.copy(function)
+		frame, argslots, self_slot = function.layout
+		function.layout = (frame, argslots, None)
+
+		return TrogonMemoizedFunction(function, int(size))
+
+	def __init__(self, assigned_globals):
+		self.arity = 1
+		self.assigned_globals = assigned_globals
@@ -1,3 +1,5 @@
+import itertools
+
 from expression import *
 from statement import *
 from state import *
@@ -8,51 +10,127 @@ class ParseException(Exception):
 		Exception.__init__(self, f'line {line}: {errormsg}')
 
 class Parser:
-	final_tokentypes = [
+	final_tokentypes = frozenset([
 		Token.STRING_LITERAL, Token.NUMBER_LITERAL,
-		Token.TRUE, Token.FALSE, Token.NULL] + Lexer.type_tokentypes
-
-	expression_with_block_predicate = [Token.IF, Token.LEFT_BRACE, Token.FUNCTION]
+		Token.TRUE, Token.FALSE, Token.NULL] + Lexer.type_tokentypes)
+
+	expression_with_block_predicate = frozenset([Token.IF, Token.LEFT_BRACE, Token.FUNCTION])
+
+	call_path_tokentypes = frozenset([Token.LEFT_PAREN, Token.DOT, Token.LEFT_BRACKET])
+
+	OR, AND, EQUALITY, COMPARISON, SHIFT, TERM, FACTOR, CAST = range(1, 9)
+
+	# token type -> (precedence level, node constructor, does it chain)
+	binary_operators = {
+		Token.OR: (OR, LogicalExpression, True),
+		Token.AND: (AND, LogicalExpression, True),
+		**dict.fromkeys(
+			(Token.EQUAL_EQUAL, Token.BANG_EQUAL),
+			(EQUALITY, BinaryExpression, False)),
+		**dict.fromkeys(
+			(Token.GREATER, Token.LESS, Token.GREATER_EQUAL, Token.LESS_EQUAL),
+			(COMPARISON, BinaryExpression, False)),
+		**dict.fromkeys(
+			(Token.SHL, Token.SHR, Token.SHL_EQUAL, Token.SHR_EQUAL),
+			(SHIFT, BinaryExpression, True)),
+		**dict.fromkeys(
+			(Token.PLUS, Token.MINUS, Token.PLUS_EQUAL, Token.MINUS_EQUAL),
+			(TERM, BinaryExpression, True)),
+		**dict.fromkeys(
+			(Token.SLASH, Token.STAR, Token.DOUBLE_SLASH, Token.PERCENT,
+			 Token.SLASH_EQUAL, Token.STAR_EQUAL, Token.DOUBLE_SLASH_EQUAL,
+			 Token.PERCENT_EQUAL),
+			(FACTOR, BinaryExpression, True)),
+		Token.AS: (CAST, lambda _, left, right: CastExpression(left, right), True),
+	}
+
+	# Takes a `TokenBuffer` from `Lexer.scan` and reads its arrays directly.
+	# A `Lexer`, or any other iterable of tokens (e.g. the stream from
+	# `Lexer.iter_tokens`), is packed into buffers of up to CHUNK tokens as
+	# the parser goes, so the lexer runs interleaved with the parser and only
+	# a chunk is kept in memory. A `Lexer` is read without creating `Token`s
+	LOOKAHEAD = 2
+	CHUNK = 4096
 
 	def __init__(self, tokens):
-		self.tokens = tokens
-		self.pos = 0
+		self.stream = None
+		if isinstance(tokens, Lexer):
+			self.stream = tokens.tokenize()
+			tokens = TokenBuffer()
+		elif not isinstance(tokens, TokenBuffer):
+			self.stream = ((token.type, token.line, token.value) for token in tokens)
+			tokens = TokenBuffer()
+
+		self.load(tokens)
+		if self.stream:
+			self.refill()
+
 		self.line = 0
+		self.value = None
+
+	def load(self, buffer):
+		self.kinds = buffer.kinds
+		self.lines = buffer.lines
+		self.values = buffer.values
+		self.literals = buffer.literals
+		self.pos = 0
+		self.end = len(buffer)
+
+	# starts a new chunk with the tokens that weren't consumed yet
+	def refill(self):
+		buffer = TokenBuffer()
+		for i in range(self.pos, self.end):
+			buffer.append(self.kinds[i], self.lines[i], self.literals[self.values[i]])
+
+		count = Parser.CHUNK + Parser.LOOKAHEAD
+		append = buffer.append
+		for type, line, value in itertools.islice(self.stream, count):
+			append(type, line, value)
+
+		if len(buffer) - (self.end - self.pos) < count:
+			self.stream = None
+
+		self.load(buffer)
 
 
 	# ==== Utils ====
 
 	def peek(self):
-		if self.pos >= len(self.tokens):
-			return None
-		return self.tokens[self.pos]
+		return self.kinds[self.pos] if self.pos < self.end else Token.EOF
 
 	def peek2(self):
-		if self.pos >= len(self.tokens) - 1:
-			return None
-		return self.tokens[self.pos + 1]
+		return self.kinds[self.pos + 1] if self.pos + 1 < self.end else Token.EOF
 
+	# consumes a token and returns its type, the value goes to `self.value`
 	def next(self):
-		if self.pos >= len(self.tokens):
-			return None
+		pos = self.pos
+		if pos >= self.end:
+			self.value = None
+			return Token.EOF
 
-		t = self.tokens[self.pos]
-		self.pos += 1
-		self.line = t.line
-		return t
+		kind = self.kinds[pos]
+		self.value = self.literals[self.values[pos]]
+		self.line = self.lines[pos]
+		self.pos = pos + 1
+
+		if self.stream and self.pos + Parser.LOOKAHEAD > self.end:
+			self.refill()
+
+		return kind
 
 	def expect(self, type, s):
-		t = self.next()
-		if not t or t.type != type:
-			raise ParseException(f'Expected {type} got {t.type if t else None}', self.line)
+		kind = self.next()
+		if kind != type:
+			got = Token.names[kind] if kind != Token.EOF else None
+			raise ParseException(f'Expected {Token.names[type]} got {got}', self.line)
 
-		return t
+		return self.value
 
 	def next_is(self, tokentype):
-		if type(tokentype) in (list, tuple):
-			return self.peek() and self.peek().type in tokentype
-		else:
-			return self.peek() and self.peek().type == tokentype
+		if type(tokentype) is int:
+			return self.peek() == tokentype
+
+		return self.peek() in tokentype
 
 	def match(self, tokentype):
 		if self.next_is(tokentype):
@@ -65,8 +143,7 @@ class Parser:
 	# ==== Some actual AST parsing functions ====
 
 	def final(self):
-		if self.next_is(Token.TABLE)\
-		   and self.peek2() and self.peek2().type == Token.LEFT_BRACE:
+		if self.next_is(Token.TABLE) and self.peek2() == Token.LEFT_BRACE:
 			self.next()
 			self.next()
 
@@ -86,10 +163,12 @@ class Parser:
 			return TableLiteralExpression({k: v for (k, v) in arguments})
 
 		if self.next_is(Parser.final_tokentypes):
-			return LiteralExpression(self.next().value)
+			self.next()
+			return LiteralExpression(self.value)
 
 		if self.next_is(Token.IDENTIFIER):
-			return VariableExpression(self.next().value)
+			self.next()
+			return VariableExpression(self.value)
 
 		if self.match(Token.LEFT_PAREN):
 			expression = self.expression()
@@ -99,10 +178,10 @@ class Parser:
 	def call_path_sub(self):
 		expression = self.final()
 
-		while self.next_is((Token.LEFT_PAREN, Token.DOT, Token.LEFT_BRACKET)):
-			token = self.next()
+		while self.next_is(Parser.call_path_tokentypes):
+			kind = self.next()
 
-			if token.type == Token.LEFT_PAREN:
+			if kind == Token.LEFT_PAREN:
 				arguments = []
 				while not self.next_is(Token.RIGHT_PAREN):
 					arguments.append(self.expression())
@@ -113,10 +192,10 @@ class Parser:
 				self.expect(Token.RIGHT_PAREN, 'Expected )')
 				expression = CallExpression(expression, arguments)
 
-			elif token.type == Token.DOT:
+			elif kind == Token.DOT:
 				expression = DotExpression(expression, self.final())
 
-			elif token.type == Token.LEFT_BRACKET:
+			elif kind == Token.LEFT_BRACKET:
 				expression = SubscriptionExpression(expression, self.expression())
 				self.expect(Token.RIGHT_BRACKET, 'Expected ]')
 
@@ -130,84 +209,36 @@ class Parser:
 
 		return self.call_path_sub()
 
-	# TODO: we should be able to distinguish between `function` as a typename
-	# and function as a function declaration
-	def cast(self):
+	# Precedence climbing over the `binary_operators` table. Parses a chain of
+	# operators that bind tighter than `level`: `binary(Parser.EQUALITY)`
+	# is what used to be `comparison()` and so on
+	def binary(self, level=0):
 		expression = self.unary()
+		limit = Parser.CAST
 
-		while self.match(Token.AS):
-			expression = CastExpression(expression, self.unary())
-
-		return expression
-
-	def factor(self):
-		expression = self.cast()
-
-		tokens = (
-			Token.SLASH, Token.STAR, Token.DOUBLE_SLASH, Token.PERCENT,
-			Token.SLASH_EQUAL, Token.STAR_EQUAL, Token.DOUBLE_SLASH_EQUAL,
-			Token.PERCENT_EQUAL)
-
-		while self.next_is(tokens):
-			expression = BinaryExpression(self.next().type, expression, self.cast())
-
-		return expression
-
-	def term(self):
-		expression = self.factor()
-		tokens = (Token.PLUS, Token.MINUS, Token.PLUS_EQUAL, Token.MINUS_EQUAL)
-		while self.next_is(tokens):
-			expression = BinaryExpression(self.next().type, expression, self.factor())
-
-		return expression
-
-	def shift(self):
-		expression = self.term()
-
-		tokens = (Token.SHL, Token.SHR, Token.SHL_EQUAL, Token.SHR_EQUAL)
-		while self.next_is(tokens):
-			expression = BinaryExpression(self.next().type, expression, self.term())
-
-		return expression
-
-	def comparison(self):
-		expression = self.shift()
-
-		tokens = (Token.GREATER, Token.LESS, Token.GREATER_EQUAL, Token.LESS_EQUAL)
-		if self.next_is(tokens):
-			expression = BinaryExpression(self.next().type, expression, self.shift())
-
-		return expression
-
-	def equality(self):
-		expression = self.comparison()
-
-		tokens = (Token.EQUAL_EQUAL, Token.BANG_EQUAL)
-		if self.next_is(tokens):
-			expression = BinaryExpression(self.next().type, expression, self.comparison())
-
-		return expression
-
-	def logicalfactor(self):
-		expression = self.equality()
-
-		tokens = Token.AND
-		while self.next_is(tokens):
-			expression = LogicalExpression(self.next().type, expression, self.equality())
+		while True:
+			operator = self.binary_operators.get(self.peek())
+			if not operator:
+				return expression
 
-		return expression
+			operator_level, node, chained = operator
+			if operator_level <= level or operator_level > limit:
+				return expression
 
-	def logicalterm(self):
-		expression = self.logicalfactor()
+			kind = self.next()
+			if operator_level == Parser.CAST:
+				right = self.unary()
+			else:
+				right = self.binary(operator_level)
 
-		tokens = Token.OR
-		while self.next_is(tokens):
-			expression = LogicalExpression(self.next().type, expression, self.logicalfactor())
+			expression = node(kind, expression, right)
 
-		return expression
+			# `a < b < c` and `a == b == c` don't chain, the same level
+			# is closed after one operator
+			limit = operator_level if chained else operator_level - 1
 
 	def assign(self):
-		expression = self.logicalterm()
+		expression = self.binary()
 		if expression and self.match(Token.EQUAL):
 			expression = BinaryExpression(Token.EQUAL, expression, self.expression())
 
@@ -229,15 +260,15 @@ class Parser:
 	def funcdeclexpr(self, name_expected=False):
 		if self.match(Token.FUNCTION):
 			name = None
-			if self.next_is(Token.IDENTIFIER):
-				name = self.next().value
+			if self.match(Token.IDENTIFIER):
+				name = self.value
 			elif name_expected:
 				raise ParseException('Expected function name', self.line)
 
 			self.expect(Token.LEFT_PAREN, 'Expected (')
 			argnames = []
 			while not self.next_is(Token.RIGHT_PAREN):
-				arg = self.expect(Token.IDENTIFIER, 'Expected IDENTIFIER').value
+				arg = self.expect(Token.IDENTIFIER, 'Expected IDENTIFIER')
 				argnames.append(arg)
 
 				if not self.next_is(Token.RIGHT_PAREN):
@@ -259,10 +290,15 @@ class Parser:
 			return self.funcdeclexpr()
 
 	def expression(self):
-		if self.next_is(Parser.expression_with_block_predicate):
-			return self.expression_with_block()
-		else:
-			return self.expression_without_block()
+		kind = self.peek()
+		if kind == Token.LEFT_BRACE:
+			return self.block()
+		elif kind == Token.FUNCTION:
+			return self.funcdeclexpr()
+		elif kind == Token.IF:
+			return self.ifexpr()
+
+		return self.assign()
 		
 
 	def block(self):
@@ -295,7 +331,7 @@ class Parser:
 		if self.match(Token.EQUAL):
 			expression = self.expression()
 
-		return LetStatement(identifier.value, expression)
+		return LetStatement(identifier, expression)
 
 	def while_statement(self):
 		self.expect(Token.WHILE, 'Expected while')
@@ -401,7 +437,7 @@ class Parser:
 	# rn it's parsed like (IF ...) (PLUS None None) (IF ...)
 	def parse(self):
 		statements = []
-		while self.peek() != None:
+		while self.peek() != Token.EOF:
 			statements.append(self.statement())
 
 		return statements
\ No newline at end of file
@@ -0,0 +1,389 @@
+from expression import *
+from statement import *
+from bytecode import assignments, fold_binary
+
+# A pass after `Parser.parse` that assigns every variable of a local scope a
+# slot, so frames can be lists instead of dicts.
+#
+# Scopes are created exactly where the interpreter creates them: a block, a
+# `for` statement and a function call (arguments and the function's own
+# name, and the variables of its body, so a call has one frame). The global
+# scope stays a dict, it's shared with the builtins and the REPL defines new
+# globals all the time.
+#
+# A variable can be used before its `let` in the same scope, then it refers
+# to an outer variable with that name (or, in a closure, to this one once the
+# `let` has run). So a reference is a list of candidate slots, innermost
+# first: the first one that's defined wins, and if none is, the variable is
+# looked up in the global scope by name. See `State.load`.
+#
+# A block that declares nothing doesn't get a scope at all (`scoped`), and
+# the body of a loop that creates no functions, so no frame of it can outlive
+# its iteration, runs in one frame that's reset every iteration (`reusable`).
+#
+# Calls whose result a function returns as it is are `tail` calls: the
+# result of its body, of an `if` there, or of a `return`. Engines make them
+# after the function's frame is gone.
+#
+# A `for` loop is `invariant` when its right bound can't change while it
+# runs: it only does arithmetic on literals and local variables that are
+# certainly defined there and that nothing assigns to. Globals don't count,
+# code resolved later (the REPL) may assign them. Such loops evaluate their
+# bounds once, see `counters`.
+#
+# Arithmetic on number literals is folded here too, bottom-up, so the
+# compilers get it from `constant` instead of folding every subtree again.
+#
+# `memoize` needs to know which variables a call may go through that
+# something else could be stored in later. A reference that's called is
+# `assigned` if one of the local variables it may mean is assigned
+# somewhere, and `assigned_globals` has the names of the globals assigned
+# anywhere. Both are True, or False if the variable is only ever assigned
+# the result of `memoize(...)`, which is always a function it checked.
+
+
+arithmetic = (
+	Token.PLUS, Token.MINUS, Token.STAR, Token.SLASH, Token.DOUBLE_SLASH,
+	Token.PERCENT, Token.SHL, Token.SHR)
+
+
+class Reference:
+	__slots__ = ('name', 'candidates', 'assigned')
+
+	def __init__(self, name, candidates):
+		self.name = name
+		self.candidates = candidates
+		self.assigned = None
+
+	def __repr__(self):
+		return self.name
+
+
+class Scope:
+	def declare(self, name):
+		# redeclaring gets the same slot, so `State.declare` still reports it
+		if name not in self.slots:
+			self.slots[name] = len(self.slots)
+
+		return self.slots[name]
+
+	def __init__(self, parent):
+		self.parent = parent
+		self.slots = {}
+		# slots that are defined from here on: arguments, and variables whose
+		# `let` has already been resolved
+		self.defined = set()
+
+
+class Resolver:
+	# annotates the AST, returns the names that aren't defined anywhere
+	def resolve(self, statements):
+		for s in statements:
+			name = self.declared_name(s)
+			if name is not False:
+				self.globals.add(name)
+
+		for s in statements:
+			self.statement(s)
+
+		for s, variables in self.loops:
+			s.invariant = not any(variable in self.assigned for variable in variables)
+
+		for reference, variables in self.callees:
+			assigned = [self.reassigned[v] for v in variables if v in self.reassigned]
+			reference.assigned = any(assigned) if assigned else None
+
+		return sorted(self.undefined, key=str)
+
+	# the name a statement declares in its scope, False if it doesn't
+	def declared_name(self, s):
+		if type(s) is LetStatement:
+			return s.name
+		elif type(s) is FunctionDeclarationStatement:
+			return s.expression.name
+
+		return False
+
+	def reference(self, name):
+		candidates = []
+		scope, depth = self.scope, 0
+
+		while scope:
+			if name in scope.slots:
+				candidates.append((depth, scope.slots[name]))
+			scope, depth = scope.parent, depth + 1
+
+		if not candidates and name not in self.globals:
+			self.undefined.add(name)
+
+		return Reference(name, candidates)
+
+	def begin(self):
+		self.scope = Scope(self.scope)
+		return self.scope
+
+	def end(self):
+		self.scope = self.scope.parent
+
+	# the (scope, slot) a reference certainly means here, None if it may
+	# mean a global: the innermost candidate that's defined. The ones inside
+	# it are declared by a `let` that runs later
+	def definite(self, reference):
+		for depth, slot in reference.candidates:
+			scope = self.scope
+			for _ in range(depth):
+				scope = scope.parent
+
+			if slot in scope.defined:
+				return scope, slot
+
+		return None
+
+	# (scope, slot) of every local variable `reference` may mean
+	def variables_of(self, reference):
+		variables = []
+		for depth, slot in reference.candidates:
+			scope = self.scope
+			for _ in range(depth):
+				scope = scope.parent
+
+			variables.append((scope, slot))
+
+		return variables
+
+	# every variable `reference` may mean, `value` is the expression assigned
+	# to it (None if it isn't one)
+	def assign(self, reference, value=None):
+		anything = not memoized(value)
+		for variable in self.variables_of(reference):
+			self.assigned.add(variable)
+			self.reassigned[variable] = self.reassigned.get(variable, False) or anything
+
+		if self.definite(reference) is None:
+			name = reference.name
+			self.assigned_globals[name] = self.assigned_globals.get(name, False) or anything
+
+	# the local variables the value of `e` depends on if it only does
+	# arithmetic with them, None otherwise
+	def variables(self, e):
+		kind = type(e)
+
+		if kind is LiteralExpression:
+			return []
+
+		elif kind is VariableExpression:
+			variable = self.definite(e.reference)
+			return [variable] if variable else None
+
+		elif kind is UnaryExpression and e.operator == Token.MINUS:
+			return self.variables(e.operand)
+
+		elif kind is BinaryExpression and e.operator in arithmetic:
+			left, right = self.variables(e.left), self.variables(e.right)
+			if left is not None and right is not None:
+				return left + right
+
+		return None
+
+	# ==== Statements ====
+
+	def statement(self, s):
+		kind = type(s)
+
+		if kind is LetStatement:
+			s.slot = self.scope.slots[s.name] if self.scope else None
+			self.expression(s.expression)
+			if self.scope:
+				self.scope.defined.add(s.slot)
+
+		elif kind is FunctionDeclarationStatement:
+			s.slot = self.scope.slots[s.expression.name] if self.scope else None
+			self.expression(s.expression)
+			if self.scope:
+				self.scope.defined.add(s.slot)
+
+		elif kind is ExpressionStatement:
+			self.expression(s.expression)
+
+		elif kind is ReturnStatement:
+			self.expression(s.expression)
+			if self.function:
+				self.tail(s.expression)
+
+		elif kind is WhileStatement:
+			self.expression(s.condition)
+			self.loop_body(s.block)
+
+		elif kind is ForStatement:
+			scope = self.begin()
+			s.slot = scope.declare(s.lvalue.name) if s.has_let else None
+			s.size = len(scope.slots)
+
+			self.expression(s.left_bound)
+			if s.has_let:
+				scope.defined.add(s.slot)
+			self.expression(s.lvalue)
+			self.expression(s.right_bound)
+
+			# the loop's own variable only changes between iterations, when no
+			# loop inside it runs, so it only matters to its own bound
+			if not s.has_let and type(s.lvalue) is VariableExpression:
+				self.assign(s.lvalue.reference)
+
+			s.invariant = False
+			variables = self.variables(s.right_bound)
+			if variables is not None and (scope, s.slot) not in variables:
+				self.loops.append((s, variables))
+
+			self.loop_body(s.block)
+			self.end()
+
+	def tail(self, e):
+		kind = type(e)
+
+		# methods of built-in types never recurse
+		if kind is CallExpression:
+			e.tail = e.cache is None
+		elif kind is BlockExpression:
+			self.tail(e.expression)
+		elif kind is IfExpression:
+			self.tail(e.true_block)
+			self.tail(e.else_block)
+
+	def loop_body(self, block):
+		functions = self.functions
+		self.expression(block)
+		block.reusable = block.scoped and self.functions == functions
+
+	# ==== Expressions ====
+
+	def expression(self, e):
+		kind = type(e)
+
+		if kind is VariableExpression:
+			e.reference = self.reference(e.name)
+
+		elif kind is TableLiteralExpression:
+			for k, v in e.arguments.items():
+				self.expression(k)
+				self.expression(v)
+
+		elif kind is DotExpression:
+			# the right side is a property name
+			self.expression(e.left)
+
+		elif kind is SubscriptionExpression:
+			self.expression(e.expression)
+			self.expression(e.index)
+
+		elif kind is CallExpression:
+			self.expression(e.expression)
+			for argument in e.arguments:
+				self.expression(argument)
+
+			# `t['f']()` is called through `t`
+			callee = e.expression
+			if type(callee) is SubscriptionExpression:
+				callee = callee.expression
+			if type(callee) is VariableExpression:
+				self.callees.append((callee.reference, self.variables_of(callee.reference)))
+
+		elif kind is UnaryExpression:
+			self.expression(e.operand)
+
+		elif kind in (BinaryExpression, LogicalExpression, CastExpression):
+			self.expression(e.left)
+			self.expression(e.right)
+
+			if kind is BinaryExpression:
+				e.constant = fold_binary(e)
+				if type(e.left) is VariableExpression and e.operator == Token.EQUAL:
+					self.assign(e.left.reference, e.right)
+				elif type(e.left) is VariableExpression and e.operator in assignments:
+					self.assign(e.left.reference)
+
+		elif kind is IfExpression:
+			self.expression(e.condition)
+			self.expression(e.true_block)
+			self.expression(e.else_block)
+
+		elif kind is BlockExpression:
+			self.block(e)
+
+		elif kind is FunctionDeclarationExpression:
+			self.functions += 1
+
+			# the scope of a call, see `TrogonFunction.bind`
+			scope = self.begin()
+			argslots = [scope.declare(argname) for argname in e.argnames]
+			self_slot = None
+			if e.name and e.name not in e.argnames:
+				self_slot = scope.declare(e.name)
+			scope.defined.update(scope.slots.values())
+
+			# the body declares its variables in the same frame, unless one of
+			# them would redeclare an argument
+			names = self.declared_names(e.block)
+			merged = not any(name in scope.slots for name in names)
+
+			function, self.function = self.function, True
+			self.block(e.block, scope if merged else None)
+			self.tail(e.block)
+			self.function = function
+			self.end()
+
+			# arguments in slots 0, 1, ... are bound positionally (None),
+			# repeated names keep their slots
+			positional = argslots == list(range(len(argslots)))
+			e.layout = (len(scope.slots), None if positional else argslots, self_slot)
+
+	# `scope` is the one the block declares its variables in instead of its own
+	def block(self, e, scope=None):
+		names = self.declared_names(e)
+
+		e.scoped = bool(names) and scope is None
+		e.reusable = False
+		if e.scoped:
+			scope = self.begin()
+		for name in names:
+			scope.declare(name)
+
+		for s in e.statements:
+			self.statement(s)
+		self.expression(e.expression)
+
+		e.size = len(scope.slots) if e.scoped else 0
+		if e.scoped:
+			self.end()
+
+	def declared_names(self, block):
+		names = [self.declared_name(s) for s in block.statements]
+		return [name for name in names if name is not False]
+
+	def __init__(self, names=(), assigned_globals=None):
+		self.scope = None
+		self.globals = set(names)
+		# shared between the programs of one interpreter, see `memoize.py`
+		self.assigned_globals = {} if assigned_globals is None else assigned_globals
+		# (reference, the variables it may mean) of every call's callee
+		self.callees = []
+		self.undefined = set()
+		self.functions = 0
+		# in a function's body, where `return` returns from it
+		self.function = False
+		# (scope, slot) of the local variables that are assigned somewhere
+		self.assigned = set()
+		# the same, True or False like `assigned_globals`
+		self.reassigned = {}
+		# (for statement, the variables of its right bound)
+		self.loops = []
+
+
+# whether `e` is `memoize(...)`, with the builtin unless a local shadows it
+def memoized(e):
+	return type(e) is CallExpression and type(e.expression) is VariableExpression \
+		and e.expression.name == 'memoize' and not e.expression.reference.candidates
+
+
+def resolve(statements, names=(), assigned_globals=None):
+	return Resolver(names, assigned_globals).resolve(statements)
@@ -12,4 +12,40 @@ class ContinueException(Exception):
 
 class BreakException(Exception):
 	def __init__(self):
-		Exception.__init__(self, 'Uncaught break')
\ No newline at end of file
+		Exception.__init__(self, 'Uncaught break')
+
+
+# How a block ended if not by running to its end. The tree walker passes these
+# up from `complete`/`execute` instead of raising the exceptions above, which
+# are only raised where the block's value is needed, e.g. `1 + { break; }`.
+#
+# CALL is a return of a call's result, `value` is (function, arguments). The
+# function that returns it makes the call after its own frame is gone, see
+# `TrogonFunction.call`
+class Completion:
+	RETURN = 0
+	BREAK = 1
+	CONTINUE = 2
+	CALL = 3
+
+	__slots__ = ('kind', 'value')
+
+	def exception(self):
+		if self.kind == Completion.RETURN:
+			return ReturnException(self.value)
+		elif self.kind == Completion.CALL:
+			function, arguments = self.value
+			return ReturnException(function.call(arguments))
+		elif self.kind == Completion.BREAK:
+			return BreakException()
+
+		return ContinueException()
+
+	def __init__(self, kind, value=None):
+		self.kind = kind
+		self.value = value
+
+	def __repr__(self):
+		return f'(COMPLETION {self.kind} {self.value})'
+
+BREAK, CONTINUE = Completion(Completion.BREAK), Completion(Completion.CONTINUE)
@@ -1,47 +1,31 @@
-import copy
 from runtime import RuntimeException
 
-current_state = None
+# a slot whose `let` hasn't run yet
+UNDEFINED = object()
 
-# TODO: can't place it in `variables.py` due to circular import
-types_passed_by_value = [0, 1, 2, 3, 6]
-#[TrogonType, TrogonBool, TrogonString, TrogonNumber, TrogonNulltype]
+# TODO: can't use `TrogonObject.STRING` here due to circular import
+STRING = 2
 
-class State:
-	def get_state():
-		global current_state
-		return current_state
-
-	def set_state(state):
-		global current_state
-		current_state = state
-
-	def begin(self=None):
-		global current_state
 
-		if self:
-			return State(self)
+# What a variable or a table gets when `value` is stored in it. Numbers,
+# bools, null and types are immutable, so they're simply shared, and tables
+# and functions are references anyway. Strings are passed by value, the new
+# one shares the text until one of them is changed, see `TrogonString.share`
+def copy_value(value):
+	if value.type == STRING:
+		return value.share()
 
-		current_state = State(current_state)
-		return current_state
+	return value
 
-	# TODO:
-	def end(self=None):
-		global current_state
 
-		if self:
-			return self.parent
-
-		current_state = current_state.parent
+class State:
+	__slots__ = ('parent', 'variables', 'slots', 'globals')
 
-	def register(self, name, value, from_literal=False):
+	def register(self, name, value):
 		if name in self.variables:
 			raise RuntimeException(f'Tried to redefine variable {name}')
 
-		if value.type in types_passed_by_value or from_literal:
-			self.variables[name] = copy.deepcopy(value)
-		else:
-			self.variables[name] = copy.copy(value)
+		self.variables[name] = copy_value(value)
 
 	def get(self, name):
 		head = self
@@ -53,7 +37,7 @@ class State:
 
 		return head.variables[name]
 
-	def set(self, name, value, from_literal=False):
+	def set(self, name, value):
 		head = self
 		while head and name not in head.variables:
 			head = head.parent
@@ -61,21 +45,66 @@ class State:
 		if not head or name not in head.variables:
 			raise RuntimeException(f'Implicit variable definition is not allowed')
 
-		if value.type in types_passed_by_value or from_literal:
-			head.variables[name] = copy.deepcopy(value)
-		else:
-			head.variables[name] = copy.copy(value)
+		head.variables[name] = copy_value(value)
+
+	# Local variables live in `slots`, at the indices the resolver gave them,
+	# global ones in `globals.variables` by name. See `resolver.py`
+
+	# `slot` is None in the global scope
+	def declare(self, slot, name, value):
+		if slot is None:
+			return self.register(name, value)
+
+		if self.slots[slot] is not UNDEFINED:
+			raise RuntimeException(f'Tried to redefine variable {name}')
+
+		self.slots[slot] = copy_value(value)
+
+	# a loop body's frame is reused, every iteration starts with no variables
+	def reset(self):
+		self.slots = [UNDEFINED] * len(self.slots)
+
+	def load(self, reference):
+		for depth, slot in reference.candidates:
+			head = self
+			for _ in range(depth):
+				head = head.parent
+
+			value = head.slots[slot]
+			if value is not UNDEFINED:
+				return value
 
-	def debug(self=None):
-		state = State.get_state() if not self else self
+		return self.globals.get(reference.name)
+
+	def store(self, reference, value):
+		for depth, slot in reference.candidates:
+			head = self
+			for _ in range(depth):
+				head = head.parent
+
+			if head.slots[slot] is not UNDEFINED:
+				head.slots[slot] = copy_value(value)
+				return
+
+		self.globals.set(reference.name, value)
+
+	def debug(self):
+		state = self
 		while state:
-			print({x: state.variables[x].value for x in state.variables}, end=' -> ')
+			if state.variables is not None:
+				print({x: state.variables[x].value for x in state.variables}, end=' ')
+			print([x.value for x in state.slots if x is not UNDEFINED], end=' -> ')
 			state = state.parent
 		print('end')
 
-	def __init__(self, parent=None):
+	def __init__(self, parent=None, size=0):
 		self.parent = parent
-		self.variables = {}
+		self.slots = [UNDEFINED] * size
 
-global_state = State()
-current_state = global_state
\ No newline at end of file
+		# only the global scope has variables by name, see `declare`
+		if parent:
+			self.variables = None
+			self.globals = parent.globals
+		else:
+			self.variables = {}
+			self.globals = self
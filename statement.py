@@ -13,7 +13,17 @@ class Statement:
 	BREAK = 8
 	CONTINUE = 9
 
-	def interpret(self):
+	__slots__ = ('type', 'args')
+
+	# runs the statement outside of any block, where a `Completion` has
+	# nowhere to go
+	def interpret(self, state):
+		completion = self.execute(state)
+		if completion is not None:
+			raise completion.exception()
+
+	# runs the statement in a block, returns None or how the block ends
+	def execute(self, state):
 		pass
 
 	def __init__(self, type, args=[]):
@@ -25,21 +35,33 @@ class Statement:
 
 
 class ExpressionStatement(Statement):
-	def interpret(self):
-		self.expression.evaluate()
+	__slots__ = ('expression', 'control')
+
+	def execute(self, state):
+		if self.control:
+			result = self.expression.complete(state)
+			if result.__class__ is Completion:
+				return result
+		else:
+			self.expression.evaluate(state)
 
 	def __init__(self, expression):
 		self.type = Statement.EXPR
 		self.expression = expression
+		# only these pass on a return, break or continue from their blocks
+		self.control = isinstance(
+			expression, (_expression.BlockExpression, _expression.IfExpression))
 
 	def __repr__(self):
 		return f'(EXPR {str(self.expression)});'
 
 
 class LetStatement(Statement):
-	def interpret(self):
-		State.get_state().register(
-			self.name, self.expression.evaluate() if self.expression else TrogonNull)
+	__slots__ = ('name', 'expression', 'slot')
+
+	def execute(self, state):
+		state.declare(
+			self.slot, self.name, self.expression.evaluate(state) if self.expression else TrogonNull)
 
 	def __init__(self, name, expression=None):
 		self.type = Statement.LET
@@ -50,10 +72,25 @@ class LetStatement(Statement):
 		return f'(LET {self.name} {self.expression})'
 
 
+# return, break and continue outside of a block do nothing
+
 class ReturnStatement(Statement):
-	def interpret(self):
+	__slots__ = ('expression',)
+
+	def interpret(self, state):
 		pass
 
+	def execute(self, state):
+		if not self.expression:
+			return Completion(Completion.RETURN, TrogonNull)
+
+		# a tail call, or a break or continue in a block in the expression
+		result = self.expression.complete(state)
+		if result.__class__ is Completion:
+			return result
+
+		return Completion(Completion.RETURN, result)
+
 	def __init__(self, expression):
 		self.type = Statement.RETURN
 		self.expression = expression
@@ -63,9 +100,14 @@ class ReturnStatement(Statement):
 
 
 class BreakStatement(Statement):
-	def interpret(self):
+	__slots__ = ()
+
+	def interpret(self, state):
 		pass
 
+	def execute(self, state):
+		return BREAK
+
 	def __init__(self):
 		self.type = Statement.BREAK
 
@@ -74,9 +116,14 @@ class BreakStatement(Statement):
 
 
 class ContinueStatement(Statement):
-	def interpret(self):
+	__slots__ = ()
+
+	def interpret(self, state):
 		pass
 
+	def execute(self, state):
+		return CONTINUE
+
 	def __init__(self):
 		self.type = Statement.CONTINUE
 
@@ -85,13 +132,24 @@ class ContinueStatement(Statement):
 
 
 class WhileStatement(Statement):
-	def interpret(self):
+	__slots__ = ('condition', 'block')
+
+	# the exceptions come from a break or continue somewhere a value is
+	# needed, see `Completion`
+	def execute(self, state):
+		frame = self.block.loop_frame(state)
 		try:
-			while self.condition.evaluate().to(TrogonBool).value == True:
+			while self.condition.evaluate(state).to(TrogonBool).value == True:
 				try:
-					r = self.block.evaluate()
+					r = self.block.complete(state, frame)
 				except ContinueException as e:
 					continue
+
+				if r.__class__ is Completion:
+					if r.kind == Completion.BREAK:
+						return
+					elif r.kind != Completion.CONTINUE:
+						return r
 		except BreakException as e:
 			return
 
@@ -105,33 +163,67 @@ class WhileStatement(Statement):
 
 
 class ForStatement(Statement):
-	def interpret(self):
-		state = State.begin()
+	__slots__ = (
+		'lvalue', 'left_bound', 'right_bound', 'block', 'has_let', 'slot', 'size', 'invariant')
+
+	def execute(self, state):
+		state = State(state, self.size)
 
 		if self.has_let:
-			state.register(self.lvalue.name, self.left_bound.evaluate())
+			state.declare(self.slot, self.lvalue.name, self.left_bound.evaluate(state))
 		else:
-			self.lvalue.assign(self.left_bound.evaluate())
+			self.lvalue.assign(state, self.left_bound.evaluate(state))
+
+		counter = self.lvalue.evaluate(state)
+		frame = self.block.loop_frame(state)
+		if self.invariant:
+			return self.count(state, frame, counter)
 
-		counter = self.lvalue.evaluate()
 		try:
-			while abs(counter.sub(self.right_bound.evaluate()).value) >= 1:
-				self.lvalue.assign(counter)
+			while abs(counter.sub(self.right_bound.evaluate(state)).value) >= 1:
+				self.lvalue.assign(state, counter)
 
 				try:
-					r = self.block.evaluate()
+					r = self.block.complete(state, frame)
 				except ContinueException as e:
-					pass
+					r = None
+
+				if r.__class__ is Completion:
+					if r.kind == Completion.BREAK:
+						return
+					elif r.kind != Completion.CONTINUE:
+						return r
 
-				if self.right_bound.evaluate().greater(counter).value:
-					counter.value += 1
+				# numbers are shared, so the counter is never changed in place
+				if self.right_bound.evaluate(state).greater(counter).value:
+					counter = number(counter.value + 1)
 				else:
-					counter.value -= 1
+					counter = number(counter.value - 1)
 		except BreakException as e:
 			pass
 
-		finally:
-			State.end()
+	# the loop when its right bound can't change, see `counters`
+	def count(self, state, frame, counter):
+		slots = state.slots if self.has_let else None
+		try:
+			for counter in counters(counter, self.right_bound.evaluate(state)):
+				if slots is not None:
+					slots[self.slot] = counter
+				else:
+					self.lvalue.assign(state, counter)
+
+				try:
+					r = self.block.complete(state, frame)
+				except ContinueException as e:
+					continue
+
+				if r.__class__ is Completion:
+					if r.kind == Completion.BREAK:
+						return
+					elif r.kind != Completion.CONTINUE:
+						return r
+		except BreakException as e:
+			pass
 
 	def __init__(self, lvalue, left_bound, right_bound, block, has_let=False):
 		self.type = Statement.FOR
@@ -140,15 +232,17 @@ class ForStatement(Statement):
 		self.right_bound = right_bound
 		self.block = block
 		self.has_let = has_let
+		self.invariant = False
 
 	def __repr__(self):
 		return f'(FOR {self.lvalue}:={self.left_bound} to {self.right_bound} {self.block})'
 
 
 class FunctionDeclarationStatement(Statement):
-	def interpret(self):
-		state = State.get_state()
-		state.register(self.expression.name, self.expression.evaluate())
+	__slots__ = ('expression', 'slot')
+
+	def execute(self, state):
+		state.declare(self.slot, self.expression.name, self.expression.evaluate(state))
 
 	def __init__(self, expression):
 		self.type = Statement.FUNCDECL
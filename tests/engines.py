@@ -0,0 +1,33 @@
+import contextlib
+import io
+import unittest
+
+from interpreter import Interpreter
+
+# Every test runs its program on all engines: the tree walker is the
+# reference, the others must print exactly the same
+
+
+# what `code` printed, and the error it stopped with if any
+def output(engine, code, stack_size=0):
+	out = io.StringIO()
+	try:
+		with contextlib.redirect_stdout(out):
+			Interpreter(engine, stack_size).run(code)
+	except Exception as e:
+		out.write(f'{type(e).__name__}: {e}\n')
+
+	return out.getvalue()
+
+
+class EngineTestCase(unittest.TestCase):
+	# bytes of stack for the program's thread, see `Interpreter.execute`
+	stack_size = 0
+
+	def assertOutput(self, code, expected):
+		for engine in Interpreter.engines:
+			with self.subTest(engine=engine):
+				self.assertEqual(output(engine, code, self.stack_size), expected)
+
+	def assertError(self, code, message):
+		self.assertOutput(code, f'RuntimeException: {message}\n')
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+
+from cache import ASTCache
+from interpreter import Interpreter
+
+# A cached AST must be the one the parser gives, down to the literals
+
+
+class CacheTest(unittest.TestCase):
+	def assertRoundTrip(self, code):
+		ast = Interpreter().parse(code)
+
+		with tempfile.TemporaryDirectory() as directory:
+			cache = ASTCache(directory)
+			script = os.path.join(directory, 'script.tr')
+			self.assertTrue(cache.store(script, code, ast))
+			self.assertEqual(repr(cache.load(script, code)), repr(ast))
+			self.assertIsNone(cache.load(script, code + ' '))
+
+	def test_scripts(self):
+		for name in ('example.tr', 'debug.tr'):
+			with self.subTest(script=name):
+				with open(os.path.join(os.path.dirname(__file__), '..', name)) as file:
+					self.assertRoundTrip(file.read())
+
+	def test_literals(self):
+		self.assertRoundTrip('''
+			let t = table { 'a': 1, 2.5: true, null: number, false: table {} };
+			for let i in 0 .. 3 { if i as string == '1' { break; } else { continue; } }
+			function f(a, b) { return a.length() + b[0]; }
+			while false { -f(1, 2); }
+		''')
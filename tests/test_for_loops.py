@@ -0,0 +1,128 @@
+import unittest
+
+from expression import Expression
+from lexer import Lexer
+from parser import Parser
+from resolver import resolve
+from statement import ForStatement, Statement
+from tests.engines import EngineTestCase
+
+# A `for` loop whose right bound can't change runs over a native range (see
+# `counters`), the others re-evaluate the bound every iteration. Both must
+# behave the same
+
+
+class ForLoopTest(EngineTestCase):
+	def test_directions(self):
+		self.assertOutput('''
+			for let i in 0 .. 3 { print(i); }
+			for let i in 3 .. 0 { print(i); }
+			for let i in 3 .. 3 { print(i); }
+		''', '0\n1\n2\n3\n2\n1\n')
+
+	def test_break_and_continue(self):
+		self.assertOutput('''
+			function f(n) {
+				let s = 0;
+				for let i in 0 .. n { if i == 2 { continue; } if i == 4 { break; } s = s + 100; }
+				s
+			}
+			print(f(6));
+			for let i in 0 .. 10 { if i % 3 != 0 { continue; } if i > 6 { break; } print(i); }
+		''', '300\n0\n3\n6\n')
+
+	def test_return_from_loop(self):
+		self.assertOutput('''
+			function find(n) { for let i in 0 .. n { if i == 3 { return i * 10; } } 0 }
+			print(find(8)); print(find(2));
+		''', '30\n0\n')
+
+	def test_nested_loop_bound_from_outer_loop(self):
+		self.assertOutput('''
+			function f(n) { let s = 0; for let i in 0 .. n { for let j in 0 .. i { s = s + j; } } s }
+			print(f(6));
+		''', '20\n')
+
+	def test_assigning_the_variable_doesnt_change_the_count(self):
+		self.assertOutput('''
+			function f(n) { let s = 0; for let i in 0 .. n { i = 100; s = s + i; } s }
+			print(f(4));
+		''', '400\n')
+
+	def test_bounds_that_change(self):
+		self.assertOutput('''
+			function shrink(n) { let s = 0; for let i in 0 .. n { n = n - 1; s = s + 1; } s }
+			function outer(n) {
+				let s = 0;
+				let k = n;
+				function dec() { k = k - 1; }
+				for let i in 0 .. k { dec(); s = s + 1; }
+				s
+			}
+			let g = 5;
+			for let i in 0 .. g { g = g + 1; if i > 6 { break; } }
+			print(shrink(10)); print(outer(10)); print(g);
+		''', '5\n5\n13\n')
+
+	def test_bounds_that_arent_integers(self):
+		self.assertOutput('''
+			function f(n) {
+				let s = 0;
+				for let i in 0.5 .. n { s = s + i; }
+				for let i in 0 .. n + 0.5 { s = s + i; }
+				s
+			}
+			function g(n) { let s = 0; for let i in 0 .. true { s = s + 1; } s }
+			print(f(4)); print(g(1));
+		''', '10.5\n1\n')
+		self.assertError(
+			'function f(n) { for let i in 0 .. n { } } f(\'a\');',
+			'- is not supported for types <number> and <string>')
+
+	def test_variable_without_let(self):
+		self.assertOutput('''
+			function f(n) { let x = 0; for x in 0 .. n { } x }
+			print(f(5));
+		''', '4\n')
+
+
+# which loops `Resolver` lets run over a native range, in source order
+def invariant(code):
+	ast = Parser(Lexer(code).scan()).parse()
+	resolve(ast)
+
+	loops = []
+	def walk(node):
+		if isinstance(node, dict):
+			walk(list(node.values()))
+		elif isinstance(node, list):
+			for x in node:
+				walk(x)
+		elif isinstance(node, (Expression, Statement)):
+			if type(node) is ForStatement:
+				loops.append(node.invariant)
+			for cls in type(node).__mro__:
+				for name in getattr(cls, '__slots__', ()):
+					walk(getattr(node, name, None))
+
+	walk(ast)
+	return loops
+
+
+class InvariantTest(unittest.TestCase):
+	def test_literal_and_local_bounds(self):
+		self.assertEqual(invariant('''
+			for let i in 0 .. 10 { }
+			function f(n) { for let i in 0 .. n * 2 { for let j in 0 .. i { } } }
+		'''), [True, True, True])
+
+	def test_bounds_that_may_change(self):
+		self.assertEqual(invariant('''
+			let g = 5;
+			for let i in 0 .. g { }
+			function f(n) { for let i in 0 .. n { n = n - 1; } }
+			function h(n) { for let i in 0 .. i + n { } }
+			function k(n) { for let i in 0 .. m { } let m = 3; }
+			function l(n) { for let i in 0 .. n.length() { } }
+			let t = table { 'f': function(n) { for let i in 0 .. n { n = 0; } } };
+		'''), [False, False, False, False, False, False])
@@ -0,0 +1,65 @@
+from tests.engines import EngineTestCase
+
+# A call's arguments, its own name and the variables of its body share one
+# frame, see `resolver.py`
+
+
+class FrameTest(EngineTestCase):
+	def test_arguments(self):
+		self.assertOutput('function f(a, b, c) { a + b * c } print(f(1, 2, 3));', '7\n')
+		self.assertError('function f(a, b) { a } f(1);', 'Expected 2 arguments, got 1')
+		self.assertError('function f(a, a) { a } f(1, 2);', 'Tried to redefine variable a')
+
+	def test_body_redeclares_an_argument(self):
+		self.assertOutput('function f(x) { let x = 3; x } print(f(1));', '3\n')
+
+	def test_recursion_through_own_name(self):
+		self.assertOutput('''
+			function fact(n) { if n <= 1 { 1 } else { n * fact(n - 1) } }
+			print(fact(10));
+		''', '3628800\n')
+
+	def test_closures_keep_their_frame(self):
+		self.assertOutput('''
+			function counter() { let n = 0; function() { n = n + 1; n } }
+			let c = counter();
+			c(); c();
+			print(c()); print(counter()());
+			function adder(x) { let y = x * 2; function() { x + y } }
+			print(adder(5)());
+		''', '3\n1\n15\n')
+
+	# the loop has one variable, the closures see its last value
+	def test_closures_in_loop_body(self):
+		self.assertOutput('''
+			function f(n) { let fs = table {}; for let i in 0 .. n { fs[i] = function() { i }; } fs }
+			let fs = f(3);
+			print(fs[0]() + fs[1]() * 10 + fs[2]() * 100);
+		''', '222\n')
+
+	def test_variable_before_its_let(self):
+		self.assertOutput('''
+			let x = 'global';
+			function f() { let r = x; let x = 'local'; r + ' ' + x }
+			print(f());
+		''', 'global local\n')
+
+	def test_assignment_before_its_let(self):
+		self.assertOutput('''
+			let x = 1;
+			function f() { x = x + 1; x += 10; let x = 'local'; x += '!'; x }
+			print(f()); print(x);
+		''', 'local!\n12\n')
+
+	def test_assignment_to_the_scope_around(self):
+		self.assertOutput('''
+			function f() { let y = 1; { let z = 2; y += z; y = y * 5; print(y -= 1); } y }
+			print(f());
+		''', '14\n14\n')
+
+	def test_strings_are_copied_into_arguments(self):
+		self.assertOutput('''
+			function f(s) { s[0] = 'x'; s }
+			let s = 'abc';
+			print(f(s)); print(s);
+		''', 'xbc\nabc\n')
@@ -0,0 +1,172 @@
+from tests.engines import EngineTestCase
+
+
+class MemoizeTest(EngineTestCase):
+	def test_caches_results(self):
+		self.assertOutput('''
+			function fib(n) { if n < 2 { n } else { fib(n - 1) + fib(n - 2) } }
+			fib = memoize(fib);
+			print(fib(80)); print(fib.hits()); print(fib.misses());
+		''', '23416728348467685\n78\n81\n')
+
+	def test_evicts_the_least_recently_used(self):
+		self.assertOutput('''
+			function square(n) { n * n }
+			let f = memoize(square, 2);
+			f(1); f(2); f(1); f(3); f(2);
+			print(f.hits()); print(f.misses());
+		''', '1\n4\n')
+
+	def test_refuses_side_effects(self):
+		self.assertError(
+			'function noisy(x) { print(x); x } memoize(noisy);',
+			'Can\'t memoize noisy: it calls print')
+		self.assertError(
+			'let g = table {}; function f(n) { g[0] = n; n } memoize(f);',
+			'Can\'t memoize f: it changes g, which it didn\'t create')
+		self.assertError(
+			'function f(t) { t[0] = 1; 1 } memoize(f);',
+			'Can\'t memoize f: it changes t, which it didn\'t create')
+		self.assertError(
+			'let g = table { 0: 1 }; function f(n) { g.remove(0); n } memoize(f);',
+			'Can\'t memoize f: it changes g, which it didn\'t create')
+		self.assertError(
+			'let x = 0; function f(n) { function g() { x = 1; } g(); n } memoize(f);',
+			'Can\'t memoize f: it assigns to x, which may not be its own variable')
+
+	def test_refuses_calls_it_cant_follow(self):
+		self.assertError(
+			'function f(x) { let p = print; p(x); x } memoize(f);',
+			'Can\'t memoize f: it calls p, which doesn\'t always hold a function it checked')
+		self.assertError(
+			'function f(x) { let g = function(y) { y }; g(x); g = print; x } memoize(f);',
+			'Can\'t memoize f: it calls g, which doesn\'t always hold a function it checked')
+		self.assertError(
+			'function f(x) { function g(h) { h(x) } g(print); x } memoize(f);',
+			'Can\'t memoize f: it calls h, which doesn\'t always hold a function it checked')
+		self.assertError(
+			'let t = table { \'f\': print }; function f(x) { t[\'f\'](x); x } memoize(f);',
+			'Can\'t memoize f: it calls a function from t, which it can\'t see')
+
+	# a global it calls must hold a checked function for good once `memoize` runs
+	def test_refuses_globals_it_cant_trust(self):
+		self.assertError('''
+			let k = 0;
+			function h(x) { bump(); x * 2 }
+			let m = memoize(h);
+			function bump() { k = k + 1; }
+		''', 'Can\'t memoize h: it calls bump, which isn\'t defined yet')
+		self.assertError('''
+			function f(x) { later(x); x }
+			let m = memoize(f);
+			let later = print;
+		''', 'Can\'t memoize f: it calls later, which isn\'t defined yet')
+		self.assertError('''
+			function pure(x) { x }
+			let helper = pure;
+			function g(x) { helper(x) }
+			let m = memoize(g);
+			helper = print;
+		''', 'Can\'t memoize g: it calls helper, which may hold something else later')
+		self.assertError(
+			'let t = table {}; let n = t.length; function f(x) { n() } memoize(f);',
+			'Can\'t memoize f: it calls n, which isn\'t a function it can check')
+
+	def test_refuses_outer_variables_it_cant_trust(self):
+		self.assertError('''
+			function outer() {
+				let helper = function(x) { x };
+				function g(x) { helper(x) }
+				let m = memoize(g);
+				helper = print;
+			}
+			outer();
+		''', 'Can\'t memoize g: it calls helper, which may hold something else later')
+		self.assertError('''
+			function outer() {
+				function g(x) { let h = function() { p(x) }; let p = print; h() }
+				memoize(g);
+			}
+			outer();
+		''', 'Can\'t memoize g: it calls p, which isn\'t defined yet')
+
+	# `memoize` only ever returns a function it checked
+	def test_calls_memoized_globals(self):
+		self.assertOutput('''
+			function square(x) { x * x }
+			square = memoize(square);
+			function f(x) { square(x) + 1 }
+			let g = memoize(f);
+			print(g(3)); print(g(3)); print(square.misses());
+		''', '10\n10\n1\n')
+		self.assertError('''
+			function square(x) { x * x }
+			square = memoize(square);
+			function f(x) { square(x) + 1 }
+			memoize(f);
+			memoize = print;
+		''', 'Can\'t memoize f: it calls square, which may hold something else later')
+
+	def test_calls_through_arguments(self):
+		self.assertOutput('''
+			function apply(g, x) { g(x) }
+			let f = memoize(apply);
+			f(print, 1); f(print, 1);
+			function local(x) { function g(y) { y + 1 } let h = function(y) { g(y) }; h(x) }
+			function immediate(x) { (function(y) { y * 3 })(x) }
+			print(memoize(local)(1)); print(memoize(immediate)(2));
+		''', '1\n1\n2\n6\n')
+
+	# comparisons give bools, unlike the literals
+	def test_caches_booleans(self):
+		self.assertOutput('''
+			function flip(b) { if b { 0 } else { 1 } }
+			let f = memoize(flip);
+			print(f(1 == 1)); print(f(2 > 1)); print(f(1 == 2)); print(f(1 < 0));
+			print(f.hits()); print(f.misses());
+		''', '0\n0\n1\n1\n2\n2\n')
+
+	# the first statement assigns to the global, the `let` hasn't run yet
+	def test_refuses_assignment_before_let(self):
+		self.assertOutput('''
+			let counter = 0;
+			function sneaky(x) { counter = counter + 1; let counter = 5; x }
+			memoize(sneaky);
+		''', 'RuntimeException: Can\'t memoize sneaky: it assigns to counter, '
+			'which may not be its own variable\n')
+		self.assertError(
+			'let x = 0; function f(n) { while n > 0 { x = 1; n = n - 1; } let x = 2; n } memoize(f);',
+			'Can\'t memoize f: it assigns to x, which may not be its own variable')
+
+	def test_accepts_changes_to_what_it_created(self):
+		self.assertOutput('''
+			function build(n) { let t = table {}; t[0] = n; t[0] }
+			function word(n) { let s = 'abc'; s[0] = 'x'; s }
+			function local(n) { let x = 0; function g() { x = n; } g(); x }
+			print(memoize(build)(3)); print(memoize(word)(3)); print(memoize(local)(4));
+		''', '3\nxbc\n4\n')
+
+	def test_refuses_a_created_table_that_is_replaced(self):
+		self.assertError('''
+			let g = table {};
+			function f(n) {
+				let t = table {};
+				let i = 0;
+				while i < 2 { t[0] = n; t = g; i += 1; }
+				n
+			}
+			memoize(f);
+		''', 'Can\'t memoize f: it changes t, which doesn\'t always hold a value it created')
+
+	def test_checks_the_size(self):
+		error = 'The size of a memoized function\'s cache must be a positive integer'
+		infinity = ' * '.join(['99999999999999999999999.0'] * 15)
+		sizes = {
+			'zero': '0', 'fraction': '2.5', 'string': '\'a\'',
+			'infinity': infinity, 'nan': f'({infinity}) - ({infinity})'}
+
+		for name, size in sizes.items():
+			with self.subTest(size=name):
+				self.assertError(f'function f(n) {{ n }} memoize(f, {size});', error)
+
+		self.assertOutput('function f(n) { n } print(memoize(f, 4.0)(7));', '7\n')
@@ -0,0 +1,66 @@
+import unittest
+
+from runtime import RuntimeException
+from tests.engines import EngineTestCase
+from variables import MethodCache, TrogonString, TrogonTable, number
+
+# A call like `x.length()` caches the method for the class of the last
+# receiver at that call site, see `MethodCache`
+
+
+class MethodCallTest(EngineTestCase):
+	def test_receiver_type_changes_at_one_call_site(self):
+		self.assertOutput('''
+			function size(x) { x.length() }
+			print(size('abc')); print(size(table { 0: 1, 1: 2 })); print(size('ab')); print(size(table {}));
+		''', '3\n2\n2\n0\n')
+
+	def test_receiver_type_changes_in_loop(self):
+		self.assertOutput('''
+			let xs = table { 0: 'ab', 1: table { 0: 1 }, 2: 'abcd', 3: table {} };
+			for let i in 0 .. 4 { print(xs[i].length()); }
+		''', '2\n1\n4\n0\n')
+
+	def test_missing_method(self):
+		self.assertOutput('''
+			let xs = table { 0: '{a}', 1: table { 'a': 1 } };
+			for let i in 0 .. 2 { print(xs[i].format(table { 'a': 1 })); }
+		''', '1\nRuntimeException: <table> doesn\'t have a property format\n')
+		self.assertError('print(null.length());', '<nulltype> doesn\'t have a property length')
+
+	def test_arity(self):
+		self.assertError('let s = \'abc\'; s.length(1);', 'Expected 0 arguments, got 1')
+
+	def test_bound_method(self):
+		self.assertOutput('''
+			let s = 'meow';
+			let m = s.length;
+			s = s + '!';
+			print(m()); print(s.length());
+		''', '4\n5\n')
+
+	def test_table_methods(self):
+		self.assertOutput('''
+			let t = table { 0: 1, 1: 2 };
+			t.remove(0); print(t.length());
+			t.clear(); print(t.length());
+		''', '1\n0\n')
+
+
+class MethodCacheTest(unittest.TestCase):
+	def test_lookup_follows_the_receiver(self):
+		cache = MethodCache('length')
+		string, table = TrogonString('abc'), TrogonTable()
+
+		self.assertIs(cache.lookup(string), TrogonString.methods['length'])
+		self.assertIs(cache.lookup(table), TrogonTable.methods['length'])
+		self.assertIs(cache.lookup(string), TrogonString.methods['length'])
+
+	def test_failed_lookup_keeps_the_entry(self):
+		cache = MethodCache('length')
+		string = TrogonString('abc')
+		cache.lookup(string)
+
+		with self.assertRaises(RuntimeException):
+			cache.lookup(number(5))
+		self.assertEqual(cache.lookup(string).call(string, []).value, 3)
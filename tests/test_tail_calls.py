@@ -0,0 +1,127 @@
+import sys
+import threading
+
+from interpreter import Interpreter
+from tests.engines import EngineTestCase, output
+
+# Deeper than the default recursion limit: these only pass if tail calls
+# don't take Python stack
+
+
+class TailCallTest(EngineTestCase):
+	def test_tail_recursion(self):
+		self.assertOutput('''
+			function count(n, total) { if n == 0 { total } else { count(n - 1, total + 1) } }
+			print(count(100000, 0));
+		''', '100000\n')
+
+	def test_tail_call_from_return(self):
+		self.assertOutput('''
+			function count(n) { if n == 0 { return 'done'; } return count(n - 1); }
+			print(count(100000));
+		''', 'done\n')
+
+	def test_mutual_recursion(self):
+		self.assertOutput('''
+			function even(n) { if n == 0 { 'even' } else { odd(n - 1) } }
+			function odd(n) { if n == 0 { 'odd' } else { even(n - 1) } }
+			print(even(100001));
+		''', 'odd\n')
+
+	def test_function_from_table(self):
+		self.assertOutput('''
+			let t = table { 'f': function(n) { if n == 0 { 'done' } else { t['f'](n - 1) } } };
+			print(t['f'](100000));
+		''', 'done\n')
+
+	def test_tail_call_after_loop(self):
+		self.assertOutput('''
+			function twice(n) { n * 2 }
+			function f(n) {
+				let i = 0;
+				while true { i = i + 1; if i == n { break; } }
+				if i > 100 { twice(i) } else { i }
+			}
+			print(f(50)); print(f(500));
+		''', '50\n1000\n')
+
+	def test_return_tail_call_from_loop(self):
+		self.assertOutput('''
+			function tens(i) { i * 10 }
+			function f(n) {
+				for let i in 0 .. 10 {
+					if i == n { return tens(i); }
+					if i % 2 == 0 { continue; }
+					if i > 7 { break; }
+				}
+				-1
+			}
+			print(f(5)); print(f(4)); print(f(20));
+		''', '50\n40\n-1\n')
+
+	def test_break_in_function_without_loop(self):
+		self.assertError('''
+			function f(n) { if n == 0 { break; } f(n - 1) }
+			for let i in 0 .. 3 { f(2); print(i); }
+		''', 'Uncaught break or continue')
+
+
+class RecursionLimitTest(EngineTestCase):
+	code = '''
+		function depth(n) { if n == 0 { 0 } else { 1 + depth(n - 1) } }
+		print(depth(100000));
+	'''
+
+	# only the VM keeps its frames off the Python stack
+	def test_vm_recursion_takes_no_python_stack(self):
+		self.assertEqual(output('vm', self.code), '100000\n')
+
+	def test_other_engines_stop_at_the_recursion_limit(self):
+		for engine in ('tree', 'closures', 'python'):
+			with self.subTest(engine=engine):
+				self.assertEqual(
+					output(engine, self.code), 'RuntimeException: Maximum recursion depth exceeded\n')
+
+
+class DeepRecursionTest(EngineTestCase):
+	stack_size = 1 << 30
+
+	def test_recursion_that_isnt_a_tail_call(self):
+		self.assertOutput('''
+			function depth(n) { if n == 0 { 0 } else { 1 + depth(n - 1) } }
+			print(depth(50000));
+		''', '50000\n')
+
+	def test_restores_the_recursion_limit(self):
+		limit = sys.getrecursionlimit()
+		Interpreter('tree', self.stack_size).run('let x = 1;')
+		self.assertEqual(sys.getrecursionlimit(), limit)
+
+	# one program finishing must not lower the limit under another one
+	def test_programs_running_at_the_same_time(self):
+		limit = sys.getrecursionlimit()
+		deep = '''
+			function depth(n) { if n == 0 { 0 } else { 1 + depth(n - 1) } }
+			let result = depth(50000);
+		'''
+
+		for engine in Interpreter.engines:
+			with self.subTest(engine=engine):
+				interpreter = Interpreter(engine, self.stack_size)
+				errors = []
+
+				def run():
+					try:
+						interpreter.run(deep)
+					except BaseException as e:
+						errors.append(e)
+
+				thread = threading.Thread(target=run)
+				thread.start()
+				while thread.is_alive():
+					Interpreter(engine, self.stack_size).run('let x = 1;')
+				thread.join()
+
+				self.assertEqual(errors, [])
+				self.assertEqual(interpreter.globals.variables['result'].value, 50000)
+				self.assertEqual(sys.getrecursionlimit(), limit)
@@ -0,0 +1,594 @@
+import itertools
+
+from expression import *
+from statement import *
+from runtime import *
+from variables import *
+from lexer import Token
+from bytecode import FunctionTemplate, assignments
+from state import State, UNDEFINED
+
+# Translates a program to Python source, so CPython's own compiler and
+# interpreter do the work. Every Trogon function becomes a Python function
+# `body(state)` and the program itself becomes `program(state)`.
+#
+# Scopes are still `State` objects (one Python local per block), values are
+# still the classes from `variables.py`, so the generated code behaves like
+# the tree walker. Blocks, `if` and `and`/`or` can't be Python expressions
+# when they contain statements: they're lowered to statements that leave the
+# result in a temporary. A function that can't be translated (or that CPython
+# refuses to compile, e.g. too many nested loops) is run by the tree walker.
+
+
+class TranspileException(Exception):
+	pass
+
+
+class TranspiledFunction(TrogonFunction):
+	type = TrogonObject.FUNCTION
+	__slots__ = ('body',)
+
+	# makes the tail calls the body returns, see `TrogonFunction.call`
+	def call(self, arguments):
+		function = self
+		while True:
+			result = function.body(function.bind(arguments))
+			if result.__class__ is not Completion:
+				return result
+
+			function, arguments = result.value
+			if function.__class__ is not TranspiledFunction:
+				return function.call(arguments)
+
+	def __init__(self, template, state):
+		self.arity = len(template.argnames)
+		self.name = template.name
+		self.argnames = template.argnames
+		self.block = template.block
+		self.body = template.code
+		self.layout = template.layout
+		self.state = state
+
+
+# the fallback for functions the transpiler gave up on
+def tree_function(e, state):
+	return TrogonFunction(len(e.argnames), e.name, e.argnames, e.block, e.layout, state)
+
+
+runtime = {
+	'State': State,
+	'UNDEFINED': UNDEFINED,
+	'TrogonTable': TrogonTable,
+	'number': number,
+	'counters': counters,
+	'TrogonBool': TrogonBool,
+	'TrogonNull': TrogonNull,
+	'TrogonTrue': TrogonTrue,
+	'TrogonFalse': TrogonFalse,
+	'ReturnException': ReturnException,
+	'BreakException': BreakException,
+	'ContinueException': ContinueException,
+	'Completion': Completion,
+	'RuntimeException': RuntimeException,
+	'TranspiledFunction': TranspiledFunction,
+	'tree_function': tree_function,
+	'binary': BinaryExpression.functions,
+}
+
+methods = {
+	Token.PLUS: 'add', Token.MINUS: 'sub', Token.STAR: 'mul',
+	Token.SLASH: 'divide', Token.DOUBLE_SLASH: 'div', Token.PERCENT: 'mod',
+	Token.SHL: 'shl', Token.SHR: 'shr', Token.EQUAL_EQUAL: 'equal',
+	Token.GREATER: 'greater', Token.LESS: 'less'
+}
+
+HEADER = 0 # in a loop condition or bound
+BODY = 1
+
+
+class Transpiler:
+	def transpile_program(self, statements):
+		self.emit('def program(s0):')
+		self.depth += 1
+		self.emit('pass')
+
+		for s in statements:
+			mark, scope = len(self.lines), self.scope
+			try:
+				self.statement(s)
+			except (TranspileException, RecursionError):
+				del self.lines[mark:]
+				self.depth, self.scope, self.loops = 1, scope, []
+				self.emit(f'{self.constant(s)}.interpret(s0)')
+
+		try:
+			return self.define('program')
+		except (SyntaxError, RecursionError, MemoryError):
+			def program(state):
+				for s in statements:
+					s.interpret(state)
+
+			return program
+
+	def transpile_function(self, block):
+		name = self.name('body')
+		self.emit(f'def {name}(s0):')
+		self.depth += 1
+		self.emit(f'return {self.expression(block)}')
+		return self.define(name)
+
+	def define(self, name):
+		source = '\n'.join(self.lines)
+		exec(compile(source, f'<trogon {name}>', 'exec'), self.namespace)
+		self.sources.append(source)
+		return self.namespace[name]
+
+	# ==== Output ====
+
+	def emit(self, line):
+		self.lines.append('\t' * self.depth + line)
+
+	def name(self, prefix):
+		return f'{prefix}{next(self.counter)}'
+
+	def constant(self, value):
+		name = self.name('c')
+		self.namespace[name] = value
+		return name
+
+	# stores `value` in a temporary at `mark` unless it's a name already
+	def spill(self, value, mark):
+		if value.isidentifier():
+			return value
+
+		temporary = self.name('t')
+		self.lines.insert(mark, '\t' * self.depth + f'{temporary} = {value}')
+		return temporary
+
+	# compiles the expressions in order. When one of them needs statements,
+	# the values before it are saved to temporaries first
+	def sequence(self, expressions):
+		values = []
+		for e in expressions:
+			mark = len(self.lines)
+			value = self.expression(e)
+
+			if len(self.lines) != mark:
+				for i, previous in enumerate(values):
+					if not previous.isidentifier():
+						values[i] = self.spill(previous, mark)
+						mark += 1
+
+			values.append(value)
+
+		return values
+
+	def raise_exception(self, exception, message=None):
+		argument = repr(message) if message else ''
+		self.emit(f'raise {exception.__name__}({argument})')
+		return 'None'
+
+	# ==== Statements ====
+
+	def statement(self, s):
+		kind = type(s)
+
+		if kind is ExpressionStatement:
+			self.effect(s.expression)
+
+		elif kind is LetStatement:
+			value = self.expression(s.expression) if s.expression else 'TrogonNull'
+			self.emit(f'{self.scope}.declare({s.slot}, {s.name!r}, {value})')
+
+		elif kind is WhileStatement:
+			self.while_statement(s)
+
+		elif kind is ForStatement:
+			self.for_statement(s)
+
+		elif kind is FunctionDeclarationStatement:
+			value = self.expression(s.expression)
+			self.emit(f'{self.scope}.declare({s.slot}, {s.expression.name!r}, {value})')
+
+		# return/break/continue outside of a block do nothing
+
+	def block_statement(self, s):
+		if s.type == Statement.RETURN:
+			value = self.expression(s.expression) if s.expression else 'TrogonNull'
+			if self.function:
+				self.emit(f'return {value}')
+			else:
+				self.emit(f'raise ReturnException({value})')
+
+		elif s.type in (Statement.BREAK, Statement.CONTINUE):
+			is_break = s.type == Statement.BREAK
+
+			if not self.loops:
+				if self.function:
+					self.raise_exception(RuntimeException, 'Uncaught break or continue')
+				else:
+					self.raise_exception(BreakException if is_break else ContinueException)
+			elif self.loops[-1] == HEADER:
+				# it would leave the loop that's evaluating it, Python can't
+				raise TranspileException('break or continue in a loop header')
+			else:
+				self.emit('break' if is_break else 'continue')
+
+		else:
+			self.statement(s)
+
+	def while_statement(self, s):
+		frame = self.loop_frame(s.block)
+		self.loops.append(HEADER)
+		self.emit('while True:')
+		self.depth += 1
+
+		mark = len(self.lines)
+		condition = self.expression(s.condition)
+		if len(self.lines) == mark:
+			self.lines[mark - 1] = '\t' * (self.depth - 1) + \
+				f'while {condition}.to(TrogonBool).value == True:'
+		else:
+			self.emit(f'if {condition}.to(TrogonBool).value != True:')
+			self.emit('\tbreak')
+
+		self.loops[-1] = BODY
+		mark = len(self.lines)
+		self.block(s.block, result=False, frame=frame)
+		self.suite(mark)
+
+		self.depth -= 1
+		self.loops.pop()
+
+	def for_statement(self, s):
+		outer = self.scope
+		self.scope = self.name('s')
+		self.emit(f'{self.scope} = State({outer}, {s.size})')
+
+		left_bound = self.expression(s.left_bound)
+		if s.has_let:
+			self.emit(f'{self.scope}.declare({s.slot}, {s.lvalue.name!r}, {left_bound})')
+		else:
+			self.assign(s.lvalue, self.spill(left_bound, len(self.lines)), result=False)
+
+		counter, stepped = self.name('t'), self.name('t')
+		self.emit(f'{counter} = {self.expression(s.lvalue)}')
+		if s.invariant:
+			return self.counting_for_statement(s, counter, outer)
+
+		self.emit(f'{stepped} = False')
+		frame = self.loop_frame(s.block)
+
+		# the step is at the top of the loop, so `continue` runs it
+		self.loops.append(HEADER)
+		self.emit('while True:')
+		self.depth += 1
+
+		self.emit(f'if {stepped}:')
+		self.depth += 1
+		self.emit(f'if {self.expression(s.right_bound)}.greater({counter}).value:')
+		self.emit(f'\t{counter} = number({counter}.value + 1)')
+		self.emit('else:')
+		self.emit(f'\t{counter} = number({counter}.value - 1)')
+		self.depth -= 1
+
+		self.emit(f'{stepped} = True')
+		self.emit(f'if not abs({counter}.sub({self.expression(s.right_bound)}).value) >= 1:')
+		self.emit('\tbreak')
+		self.assign(s.lvalue, counter, result=False)
+
+		self.loops[-1] = BODY
+		self.block(s.block, result=False, frame=frame)
+
+		self.depth -= 1
+		self.loops.pop()
+		self.scope = outer
+
+	# the rest of a `for` loop whose right bound can't change, see `counters`
+	def counting_for_statement(self, s, counter, outer):
+		right_bound = self.expression(s.right_bound)
+		frame = self.loop_frame(s.block)
+
+		self.loops.append(BODY)
+		self.emit(f'for {counter} in counters({counter}, {right_bound}):')
+		self.depth += 1
+
+		if s.has_let:
+			self.emit(f'{self.scope}.slots[{s.slot}] = {counter}')
+		else:
+			self.assign(s.lvalue, counter, result=False)
+		self.block(s.block, result=False, frame=frame)
+
+		self.depth -= 1
+		self.loops.pop()
+		self.scope = outer
+
+	# the frame a loop's body reuses, None if it can't be reused
+	def loop_frame(self, block):
+		if not block.reusable:
+			return None
+
+		frame = self.name('s')
+		self.emit(f'{frame} = State({self.scope}, {block.size})')
+		return frame
+
+	# ==== Expressions ====
+
+	# returns a Python expression for the value of `e`, it's evaluated once
+	# and after every statement emitted so far
+	def expression(self, e):
+		if e is None:
+			return self.raise_exception(
+				AttributeError, '\'NoneType\' object has no attribute \'evaluate\'')
+
+		return self.expressions[type(e)](self, e)
+
+	# compiles `e` for its side effects only
+	def effect(self, e):
+		kind = type(e)
+
+		if kind is BlockExpression:
+			self.block(e, result=False)
+		elif kind is IfExpression:
+			self.if_expression(e, result=False)
+		elif kind is BinaryExpression and (
+				e.operator == Token.EQUAL or e.operator in assignments):
+			self.assignment(e, result=False)
+		else:
+			value = self.expression(e)
+			if not value.isidentifier():
+				self.emit(value)
+
+	def literal(self, e):
+		return self.constant(e.value)
+
+	def table_literal(self, e):
+		table = self.name('t')
+		self.emit(f'{table} = TrogonTable()')
+
+		for k, v in e.arguments.items():
+			k, v = self.sequence([k, v])
+			self.emit(f'{table}.subscript_assign({k}, {v})')
+
+		return table
+
+	def variable(self, e):
+		reference = e.reference
+		if not reference.candidates:
+			return f'{self.scope}.globals.get({reference.name!r})'
+
+		# a local variable of this scope or the one around it is read
+		# straight from its slot, `load` only runs if it isn't defined yet
+		depth, slot = reference.candidates[0]
+		if len(reference.candidates) == 1 and depth <= 1:
+			frame = self.scope + '.parent' * depth
+			return (f'(v if (v := {frame}.slots[{slot}]) is not UNDEFINED '
+				+ f'else {self.scope}.load({self.constant(reference)}))')
+
+		return f'{self.scope}.load({self.constant(reference)})'
+
+	def dot(self, e):
+		if not isinstance(e.right, VariableExpression):
+			return self.raise_exception(RuntimeException, 'Expected VariableExpression!')
+
+		return f'{self.expression(e.left)}.dot({e.right.name!r})'
+
+	def subscription(self, e):
+		expression, index = self.sequence([e.expression, e.index])
+		return f'{expression}.subscript({index})'
+
+	def cast(self, e):
+		left, right = self.sequence([e.left, e.right])
+		return f'{left}.to({right}.value)'
+
+	def call(self, e):
+		if e.cache is not None:
+			return self.method_call(e)
+
+		callee, *arguments = self.sequence([e.expression] + e.arguments)
+		if e.tail:
+			return f'Completion(Completion.CALL, ({callee}, [{", ".join(arguments)}]))'
+
+		return f'{callee}.call([{", ".join(arguments)}])'
+
+	# the method is looked up before the arguments run, like in the tree
+	# walker. Every call site gets its own name for the receiver
+	def method_call(self, e):
+		receiver = self.name('r')
+		method = f'{self.constant(e.cache)}.lookup({receiver} := {self.expression(e.expression.left)})'
+
+		mark = len(self.lines)
+		arguments = self.sequence(e.arguments)
+		if len(self.lines) != mark:
+			method = self.spill(method, mark)
+
+		return f'{method}.call({receiver}, [{", ".join(arguments)}])'
+
+	def unary(self, e):
+		operand = self.expression(e.operand)
+
+		if e.operator == Token.MINUS:
+			return f'{operand}.unary_minus()'
+
+		return f'(TrogonFalse if {operand}.to(TrogonBool).value else TrogonTrue)'
+
+	def operator(self, operator, left, right):
+		if operator in methods:
+			return f'{left}.{methods[operator]}({right})'
+
+		return f'binary[{operator}]({left}, {right})'
+
+	def binary(self, e):
+		if e.operator == Token.EQUAL or e.operator in assignments:
+			return self.assignment(e)
+
+		value = e.constant
+		if value is not None:
+			return self.constant(value)
+
+		left, right = self.sequence([e.left, e.right])
+		return self.operator(e.operator, left, right)
+
+	def assignment(self, e, result=True):
+		value = self.expression(e.right)
+
+		if getattr(e.left, 'type', None) not in (Expression.LVALUE, Expression.SUBSCRIPTION):
+			self.effect_of(value)
+			return self.raise_exception(RuntimeException, 'Expected lvalue!')
+
+		# the right side is evaluated before anything in the target
+		value = self.spill(value, len(self.lines))
+		return self.assign(e.left, value, assignments.get(e.operator), result)
+
+	def effect_of(self, value):
+		if not value.isidentifier():
+			self.emit(value)
+
+	# `value` is a name, returns the result of the assignment (if `result`)
+	def assign(self, target, value, operator=None, result=True):
+		if isinstance(target, VariableExpression):
+			if operator:
+				value = self.operator(operator, self.variable(target), value)
+
+			self.emit(f'{self.scope}.store({self.constant(target.reference)}, {value})')
+			return self.variable(target) if result else None
+
+		if operator:
+			current = self.expression(target)
+			value = self.spill(self.operator(operator, current, value), len(self.lines))
+
+		if isinstance(target, SubscriptionExpression):
+			expression, index = self.sequence([target.expression, target.index])
+			assignment = f'{expression}.subscript_assign({index}, {value})'
+			if not result:
+				self.emit(assignment)
+				return None
+
+			return self.spill(assignment, len(self.lines))
+
+		elif isinstance(target, DotExpression):
+			return self.raise_exception(
+				RuntimeException, 'Assignment to a dot expression is not implemented')
+
+		return 'TrogonNull'
+
+	def logical(self, e):
+		left = self.expression(e.left)
+		mark = len(self.lines)
+		right = self.expression(e.right)
+
+		if e.operator == Token.AND:
+			test, short = f'not {left}.to(TrogonBool).value', 'TrogonFalse'
+		else:
+			test, short = f'{left}.to(TrogonBool).value', 'TrogonTrue'
+
+		if len(self.lines) == mark:
+			return f'({short} if {test} else {right}.to(TrogonBool))'
+
+		# the right side has statements, they may only run if it's evaluated
+		lowered = ['\t' + line for line in self.lines[mark:]]
+		del self.lines[mark:]
+
+		temporary = self.name('t')
+		self.emit(f'if {test}:')
+		self.emit(f'\t{temporary} = {short}')
+		self.emit('else:')
+		self.lines.extend(lowered)
+		self.emit(f'\t{temporary} = {right}.to(TrogonBool)')
+		return temporary
+
+	def block(self, e, result=True, frame=None):
+		outer = self.scope
+		if frame:
+			self.scope = frame
+			self.emit(f'{frame}.reset()')
+		elif e.scoped:
+			self.scope = self.name('s')
+			self.emit(f'{self.scope} = State({outer}, {e.size})')
+
+		for s in e.statements:
+			self.block_statement(s)
+
+		value = None
+		if result:
+			value = self.expression(e.expression) if e.expression else 'TrogonNull'
+		elif e.expression:
+			self.effect(e.expression)
+
+		self.scope = outer
+		return value
+
+	def if_expression(self, e, result=True):
+		temporary = self.name('t') if result else None
+		condition = self.expression(e.condition)
+
+		self.emit(f'if {condition}.to(TrogonBool).value == True:')
+		self.depth += 1
+		self.branch(e.true_block, temporary)
+		self.depth -= 1
+
+		if e.else_block or result:
+			self.emit('else:')
+			self.depth += 1
+			if e.else_block:
+				self.branch(e.else_block, temporary)
+			else:
+				# that's what IfExpression.evaluate returns
+				self.emit(f'{temporary} = None')
+			self.depth -= 1
+
+		return temporary
+
+	def branch(self, e, temporary):
+		if temporary:
+			self.emit(f'{temporary} = {self.expression(e)}')
+		else:
+			mark = len(self.lines)
+			self.effect(e)
+			self.suite(mark)
+
+	# Python doesn't allow empty blocks
+	def suite(self, mark):
+		if len(self.lines) == mark:
+			self.emit('pass')
+
+	def function(self, e):
+		transpiler = Transpiler(self.namespace, self.counter, function=True)
+		try:
+			body = transpiler.transpile_function(e.block)
+		except (TranspileException, SyntaxError, RecursionError, MemoryError):
+			return f'tree_function({self.constant(e)}, {self.scope})'
+
+		self.sources.extend(transpiler.sources)
+		template = FunctionTemplate(e.name, e.argnames, e.block, body, e.layout)
+		return f'TranspiledFunction({self.constant(template)}, {self.scope})'
+
+	expressions = {
+		LiteralExpression: literal,
+		TableLiteralExpression: table_literal,
+		VariableExpression: variable,
+		DotExpression: dot,
+		SubscriptionExpression: subscription,
+		CastExpression: cast,
+		CallExpression: call,
+		UnaryExpression: unary,
+		BinaryExpression: binary,
+		LogicalExpression: logical,
+		BlockExpression: block,
+		IfExpression: if_expression,
+		FunctionDeclarationExpression: function,
+	}
+
+	def __init__(self, namespace=None, counter=None, function=False):
+		self.namespace = namespace if namespace is not None else dict(runtime)
+		self.counter = counter or itertools.count(1)
+		self.function = function
+		self.lines = []
+		self.depth = 0
+		self.scope = 's0'
+		self.loops = []
+		self.sources = []
+
+
+def run(statements, state):
+	return Transpiler().transpile_program(statements)(state)
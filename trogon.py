@@ -1,46 +1,171 @@
+import argparse
 import sys
+import time
+import tracemalloc
 
+from cache import ASTCache, CACHE_DIRECTORY
 from lexer import Token, LexingException, Lexer
 from expression import *
 from statement import *
 from parser import ParseException, Parser
-from variables import *
-from state import global_state
+from interpreter import Interpreter
+
+
+# Wall time and peak traced memory of every phase, for --stats
+class Stats:
+	def measure(self, phase, function, *arguments):
+		if not self.enabled:
+			return function(*arguments)
+
+		tracemalloc.reset_peak()
+		start = time.perf_counter()
+		try:
+			return function(*arguments)
+		finally:
+			elapsed = time.perf_counter() - start
+			self.phases.append((phase, elapsed, tracemalloc.get_traced_memory()[1]))
+
+	def report(self, file=sys.stderr):
+		if not self.enabled:
+			return
+
+		print('### STATS ###', file=file)
+		for phase, elapsed, peak in self.phases:
+			print(f'{phase:>10}: {elapsed:10.4f}s {peak / 2 ** 20:10.2f} MiB peak', file=file)
+
+		for name, count in self.counts:
+			print(f'{name:>10}: {count}', file=file)
+
+	def count(self, name, value):
+		if self.enabled:
+			self.counts.append((name, value))
+
+	def __init__(self, enabled):
+		self.enabled = enabled
+		self.phases = []
+		self.counts = []
+
+		if enabled:
+			tracemalloc.start()
+
+
+# the fields of a slotted object, AST nodes have no __dict__
+def slots(node):
+	return [name for cls in type(node).__mro__ for name in getattr(cls, '__slots__', ())]
+
+
+def count_nodes(ast):
+	count = 0
+	pending = list(ast)
+
+	while pending:
+		node = pending.pop()
+		if isinstance(node, (list, tuple)):
+			pending.extend(node)
+		elif isinstance(node, dict):
+			pending.extend(node.keys())
+			pending.extend(node.values())
+		elif isinstance(node, (Expression, Statement)):
+			count += 1
+			pending.extend(getattr(node, name) for name in slots(node) if hasattr(node, name))
+
+	return count
+
+
+def run(interpreter, code, args, stats, cache=None):
+	ast = None
+	if cache:
+		ast = stats.measure('load', cache.load, args.fname, code)
+
+	# the parser streams the tokens from the lexer, they're only all kept to
+	# print or count them. A cached AST needs none, they're only lexed again
+	# to print them
+	tokens = Lexer(code)
+	if args.dump_tokens or stats.enabled and ast is None:
+		tokens = stats.measure('lex', tokens.scan)
+		stats.count('tokens', len(tokens))
+	elif ast is not None:
+		stats.count('tokens', 'not lexed, the AST is from the cache')
+
+	if args.dump_tokens:
+		print("### LEXING ###")
+		print(tokens)
+		print()
+
+	if ast is not None:
+		if args.dump_ast:
+			print('### LOADED FROM CACHE ###')
+			print(ast)
+	else:
+		ast = stats.measure('parse', Parser(tokens).parse)
+		if args.dump_ast:
+			print('### PARSING ###')
+			print(ast)
+
+		if cache:
+			stats.measure('store', cache.store, args.fname, code, ast)
+
+	stats.count('nodes', count_nodes(ast))
+
+	# not fatal: the program may never get to them
+	undefined = stats.measure('resolve', interpreter.resolve, ast)
+	for name in undefined:
+		print(f'Warning: variable {name} is not defined', file=sys.stderr)
+
+	program, dump = stats.measure('compile', interpreter.prepare, ast)
+	if args.dump_code and dump:
+		print('### COMPILED ###')
+		print(dump())
+
+	if args.dump_tokens or args.dump_ast or args.dump_code:
+		print('### INTERPRETING ###')
+
+	# TODO: rn implementation ignores return/break/continue in the root of the file
+	stats.measure('execute', interpreter.execute, program)
 
-global_state.register('print', TrogonPrintFunction())
-global_state.register('printf', TrogonPrintFormattedFunction())
-global_state.register('input', TrogonInputFunction())
-global_state.register('random', TrogonRandomFunction())
 
 if __name__ == '__main__':
-	if len(sys.argv) > 2:
-		print('Usage: python trogon.py [fname]')
-		sys.exit(1)
+	argparser = argparse.ArgumentParser(description='Trogon interpreter')
+	argparser.add_argument('fname', nargs='?', help='script to run, starts a REPL if omitted')
+	argparser.add_argument(
+		'--engine', choices=Interpreter.engines, default='tree',
+		help='tree walks the AST (the reference), vm compiles it to bytecode first, '
+			+ 'closures compiles every node to a Python closure, '
+			+ 'python translates the script to Python source')
+	argparser.add_argument(
+		'--no-cache', action='store_true',
+		help=f'always parse the script, don\'t use {CACHE_DIRECTORY}')
+	argparser.add_argument('--dump-tokens', action='store_true', help='print the tokens')
+	argparser.add_argument('--dump-ast', action='store_true', help='print the AST')
+	argparser.add_argument(
+		'--dump-code', action='store_true',
+		help='print the bytecode or the Python source of the vm and python engines')
+	argparser.add_argument(
+		'--stack-size', type=int, default=1024, metavar='MIB',
+		help='stack of the thread the script runs on, recursion that isn\'t a tail call '
+			+ 'goes about as deep as it allows on every engine but vm. '
+			+ '0 runs it on the main thread with Python\'s recursion limit')
+	argparser.add_argument(
+		'--stats', action='store_true',
+		help='report time and peak memory of every phase to stderr (memory tracing slows it down)')
+	args = argparser.parse_args()
+	interpreter = Interpreter(args.engine, args.stack_size << 20)
 
-	if len(sys.argv) == 2:
+	if args.fname:
 		code = ''
 		try:
-			file =  open(sys.argv[1], 'r')
+			file =  open(args.fname, 'r')
 			code = file.read()
 			file.close()
 		except:
 			print('An error occured. You\'re dumb')
 			sys.exit(1)
 
-		print("### LEXING ###")
-		lexer = Lexer(code)
-		tokens = lexer.scan()
-		print(tokens)
-		print()
-
-		print('### PARSING ###')
-		parser = Parser(tokens)
-		ast = parser.parse()
-		print(ast)
-
-		print('### INTERPRETING ###')
-		for s in ast:
-			s.interpret()
+		stats = Stats(args.stats)
+		try:
+			run(interpreter, code, args, stats, ASTCache() if not args.no_cache else None)
+		finally:
+			stats.report()
 
 	else:
 		while True:
@@ -51,18 +176,4 @@ if __name__ == '__main__':
 			#print(code)
 			print()
 
-			print("### LEXING ###")
-			lexer = Lexer(code)
-			tokens = lexer.scan()
-			print(tokens)
-			print()
-
-			print('### PARSING ###')
-			parser = Parser(tokens)
-			ast = parser.parse()
-			print(ast)
-
-			print('### INTERPRETING ###')
-			# TODO: rn implementation ignores return/break/continue in the root of the file
-			for s in ast:
-				s.interpret()
\ No newline at end of file
+			run(interpreter, code, args, Stats(False))
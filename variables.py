@@ -1,8 +1,52 @@
 from runtime import *
 from state import *
 from lexer import *
-import copy
 import random
+import functools
+
+# A method of a built-in type, `function(receiver, arguments)`. Types keep
+# theirs in `methods`, so calling one creates nothing but the result
+class Method:
+	__slots__ = ('name', 'arity', 'function')
+
+	def call(self, receiver, arguments):
+		if len(arguments) != self.arity:
+			raise RuntimeException(
+				f'Expected {self.arity} arguments, got {len(arguments)}')
+
+		return self.function(receiver, arguments)
+
+	def __init__(self, name, arity, function):
+		self.name = name
+		self.arity = arity
+		self.function = function
+
+	def __repr__(self):
+		return f'<method {self.name}>'
+
+
+# The call site of `receiver.name(...)`. It remembers the class of the last
+# receiver with its method, as one tuple so threads sharing the site never
+# see half of an update, and looks the name up again only when the class
+# changes
+class MethodCache:
+	__slots__ = ('name', 'entry')
+
+	def lookup(self, receiver):
+		kind, method = self.entry
+		if receiver.__class__ is not kind:
+			method = receiver.method(self.name)
+			self.entry = (receiver.__class__, method)
+
+		return method
+
+	def __init__(self, name):
+		self.name = name
+		self.entry = (None, None)
+
+	def __repr__(self):
+		return self.name
+
 
 class TrogonObject:
 	NULL = 0
@@ -13,6 +57,10 @@ class TrogonObject:
 	TABLE = 5
 	TYPE = 6
 
+	# values are slotted, programs create a lot of them. `type` is a class
+	# attribute of every subclass
+	__slots__ = ()
+
 	def unary_minus(self):
 		raise RuntimeException(
 			f'Unary minus is not supported for type <{typename[self.type]}>')
@@ -21,9 +69,19 @@ class TrogonObject:
 		raise RuntimeException(
 			f'Call is not supported for type <{typename[self.type]}>')
 
+	# name -> `Method`
+	methods = {}
+
+	def method(self, name):
+		method = self.methods.get(name)
+		if method is None:
+			raise RuntimeException(
+				f'<{typename[self.type]}> doesn\'t have a property {name}')
+
+		return method
+
 	def dot(self, argument):
-		raise RuntimeException(
-			f'<{typename[self.type]}> doesn\'t have a property {argument}')
+		return TrogonBoundMethod(self, self.method(argument))
 
 	def subscript(self, index):
 		raise RuntimeException(
@@ -57,10 +115,6 @@ class TrogonObject:
 		raise RuntimeException(
 			f'Can\'t cast <{typename[self.type]}> to <{typename[o.type]}>')
 
-	def __init__(self, type, value):
-		self.type = type
-		self.value = value
-
 	def __hash__(self):
 		return hash((self.type, self.value))
 
@@ -68,6 +122,10 @@ class TrogonObject:
 		if self is x:
 			return TrogonTrue
 
+		# tables mix values with str and number keys, see `table_key`
+		if type(x) in (str, int, float, bool):
+			return False
+
 		return self.equal(x).value
 
 	def __repr__(self):
@@ -76,6 +134,7 @@ class TrogonObject:
 
 class TrogonNullType(TrogonObject):
 	type = TrogonObject.NULL
+	__slots__ = ('value',)
 
 	def to(self, o):
 		if o == TrogonNull:
@@ -103,12 +162,13 @@ TrogonNull = TrogonNullType()
 
 class TrogonBool(TrogonObject):
 	type = TrogonObject.BOOL
+	__slots__ = ('value',)
 
 	def equal(self, y):
 		if y.type != TrogonObject.BOOL:
 			return TrogonObject.equal(self, y)
 
-		return TrogonBool(True if self.value == y.value else False)
+		return boolean(self.value == y.value)
 
 	def to(self, o):
 		if o == TrogonBool:
@@ -118,7 +178,7 @@ class TrogonBool(TrogonObject):
 			return TrogonString('true' if self.value == True else 'false')
 
 		elif o == TrogonNumber:
-			return TrogonNumber(1 if self.value == True else 0)
+			return number(1 if self.value == True else 0)
 
 		return TrogonObject.to(self, o)
 
@@ -130,9 +190,10 @@ TrogonTrue, TrogonFalse = TrogonBool(True), TrogonBool(False)
 
 class TrogonNumber(TrogonObject):
 	type = TrogonObject.NUMBER
+	__slots__ = ('value',)
 
 	def unary_minus(self):
-		return TrogonNumber(-self.value)
+		return number(-self.value)
 
 	def if_second_operand_is_number(f, operator):
 		def inner(x, y):
@@ -140,7 +201,7 @@ class TrogonNumber(TrogonObject):
 				TrogonObject.not_supported_error(operator)(x, y)
 				return TrogonNull # just to be safe :)
 
-			return TrogonNumber(f(x.value, y.value))
+			return number(f(x.value, y.value))
 
 		return inner
 
@@ -191,49 +252,199 @@ class TrogonNumber(TrogonObject):
 		self.value = value
 
 
-class TrogonString(TrogonObject):
-	type = TrogonObject.STRING
+# The value factory. Operations get their results from here instead of
+# creating them: bools are always `TrogonTrue`/`TrogonFalse`, and small
+# integers come from a cache, so loops and comparisons don't create garbage.
+# Both are fine to share since numbers and bools are never changed
 
-	# TODO: this needs a proper lexer and parser
-	# TODO: some way to escape braces?
-	def format(self, arguments):
-		table = arguments[0]
-		if table.type != TrogonObject.TABLE:
-			raise RuntimeException('Expected table as an argument to string.format')
+def boolean(value):
+	return TrogonTrue if value else TrogonFalse
 
-		pos = 0
+
+def number(value):
+	# not `isinstance`, `true` and `false` are numbers with a bool value
+	if type(value) is int and small_numbers_low <= value < small_numbers_high:
+		return small_numbers[value - small_numbers_low]
+
+	return TrogonNumber(value)
+
+
+# interns the integers from `low` up to (not including) `high`
+def intern_numbers(low, high):
+	global small_numbers, small_numbers_low, small_numbers_high
+	small_numbers = [TrogonNumber(x) for x in range(low, high)]
+	small_numbers_low, small_numbers_high = low, high
+
+intern_numbers(-128, 1024)
+
+
+# The values of the counter of a `for` loop whose right bound doesn't change
+# (see `resolver.py`). It stops when it's closer than 1 to the bound and
+# steps by 1 towards it, so between integers that's just a `range`
+def counters(counter, right):
+	if counter.__class__ is TrogonNumber and right.__class__ is TrogonNumber:
+		start, stop = counter.value, right.value
+		if type(start) is int and type(stop) is int:
+			return map(number, range(start, stop, 1 if stop > start else -1))
+
+	return steps(counter, right)
+
+def steps(counter, right):
+	while abs(counter.sub(right).value) >= 1:
+		yield counter
+
+		if right.greater(counter).value:
+			counter = number(counter.value + 1)
+		else:
+			counter = number(counter.value - 1)
+
+
+# A format pattern split into literal text and the names of its
+# placeholders, so `format` and `printf` don't parse it on every call. A
+# broken pattern still renders up to the error, the same as when it was
+# parsed while rendering
+#
+# TODO: some way to escape braces?
+class FormatTemplate:
+	__slots__ = ('parts', 'error')
+
+	# the text, the values and then the error, if any
+	def render(self, table):
 		result = []
-		while pos < len(self.value):
-			char = self.value[pos]
+		for literal, name in self.parts:
+			result.append(literal)
+			if name is not None:
+				# names are str keys, see `table_key`
+				result.append(table.value.get(name, TrogonNull).to(TrogonString).value)
+
+		if self.error:
+			raise RuntimeException(self.error)
+
+		return ''.join(result)
+
+	def __init__(self, pattern):
+		self.parts = []
+		self.error = None
+
+		literal = []
+		pos = 0
+		while pos < len(pattern):
+			char = pattern[pos]
 			if char == '{':
-				argname = []
-				pos += 1
-				while pos < len(self.value) and self.value[pos] != '}':
-					if self.value[pos] == '{':
-						raise RuntimeException('Unexpected { in a format pattern')
-					argname.append(self.value[pos])
-					pos += 1
-
-				if self.value[pos] != '}':
-					raise RuntimeException('Expected } in a format pattern')
-
-				s = ''.join(table.subscript(TrogonString(argname)).to(TrogonString).value)
-				result.append(s)
+				end = pos + 1
+				while end < len(pattern) and pattern[end] not in '{}':
+					end += 1
+
+				if end == len(pattern):
+					self.error = 'Expected } in a format pattern'
+				elif pattern[end] == '{':
+					self.error = 'Unexpected { in a format pattern'
+				if self.error:
+					break
+
+				self.parts.append((''.join(literal), pattern[pos + 1:end]))
+				literal = []
+				pos = end
 			elif char == '}':
-				raise RuntimeException('Unexpected } in a format pattern')
+				self.error = 'Unexpected } in a format pattern'
+				break
 			else:
-				result.append(char)
+				literal.append(char)
 			pos += 1
 
-		return TrogonString(''.join(result))
+		self.parts.append((''.join(literal), None))
 
-	def dot(self, argument):
-		if argument == 'length':
-			return TrogonCallable(0, lambda _: TrogonNumber(len(self.value)))
-		if argument == 'format':
-			return TrogonCallable(1, lambda x: self.format(x))
+	def __repr__(self):
+		return f'(FORMAT {self.parts} {self.error})'
 
-		return TrogonObject.dot(self, argument)
+
+# the templates of the patterns used last, a script usually has a few
+@functools.lru_cache(maxsize=256)
+def format_template(pattern):
+	return FormatTemplate(pattern)
+
+
+class TrogonString(TrogonObject):
+	type = TrogonObject.STRING
+	__slots__ = ('text', 'rope', 'chars')
+
+	# A string is one of:
+	#  - `text`, a native str. It caches its own hash, so a string used as a
+	#    table key is hashed once
+	#  - `rope`, a concatenation that hasn't been joined yet, see `add`
+	#  - `chars`, a list of characters once `subscript_assign` has changed it
+	# The other two are None. `value` joins a rope or the characters into
+	# `text` the first time it's needed.
+	#
+	# `text` and ropes are never changed, so a rope can refer to parts of other
+	# strings and `share` doesn't copy anything.
+
+	# concatenations shorter than that are joined right away
+	ROPE_LENGTH = 64
+
+	@property
+	def value(self):
+		text = self.text
+		return text if text is not None else self.join()
+
+	def join(self):
+		if self.chars is not None:
+			self.text = ''.join(self.chars)
+			self.chars = None
+			return self.text
+
+		# a rope of n concatenations is n levels deep, so no recursion
+		parts = []
+		pending = [self.rope]
+		while pending:
+			part = pending.pop()
+			if type(part) is str:
+				parts.append(part)
+			else:
+				pending.append(part[1])
+				pending.append(part[0])
+
+		self.text = ''.join(parts)
+		self.rope = None
+		return self.text
+
+	# the string as a rope part: a str or a (left, right, length) tuple
+	def part(self):
+		if self.text is not None:
+			return self.text
+		elif self.rope is not None:
+			return self.rope
+
+		return self.join()
+
+	# without joining a rope
+	def length(self):
+		if self.text is not None:
+			return len(self.text)
+		elif self.rope is not None:
+			return self.rope[2]
+
+		return len(self.chars)
+
+	# the characters to change in place
+	def builder(self):
+		if self.chars is None:
+			self.chars = list(self.value)
+			self.text = None
+
+		return self.chars
+
+	def format(self, arguments):
+		table = arguments[0]
+		if table.type != TrogonObject.TABLE:
+			raise RuntimeException('Expected table as an argument to string.format')
+
+		return TrogonString(format_template(self.value).render(table))
+
+	methods = {
+		'length': Method('length', 0, lambda self, arguments: number(self.length())),
+		'format': Method('format', 1, format),
+	}
 
 	def equal(self, y):
 		if y.type != TrogonObject.STRING:
@@ -246,7 +457,18 @@ class TrogonString(TrogonObject):
 			TrogonObject.not_supported_error('+')(self, y)
 			return TrogonNull
 
-		return TrogonString(self.value + y.value)
+		left, right = self.part(), y.part()
+		length = (len(left) if type(left) is str else left[2]) + \
+			(len(right) if type(right) is str else right[2])
+
+		# a rope is never shorter, so both are str here
+		if length < TrogonString.ROPE_LENGTH:
+			return TrogonString(left + right)
+
+		string = TrogonString.__new__(TrogonString)
+		string.text = string.chars = None
+		string.rope = (left, right, length)
+		return string
 
 	def subscript(self, index):
 		if index.type != TrogonObject.NUMBER:
@@ -256,10 +478,11 @@ class TrogonString(TrogonObject):
 		if type(index.value) != int:
 			raise RuntimeException('Can\'t subscript strings with a non-integer')
 
-		if index.value < 0 or index.value >= len(self.value):
+		value = self.chars if self.chars is not None else self.value
+		if index.value < 0 or index.value >= len(value):
 			raise RuntimeException('String subscription out of bounds')
 
-		return TrogonString(self.value[index.value])
+		return TrogonString(value[index.value])
 
 	def subscript_assign(self, index, value):
 		if index.type != TrogonObject.NUMBER:
@@ -269,20 +492,22 @@ class TrogonString(TrogonObject):
 		if type(index.value) != int:
 			raise RuntimeException('Can\'t subscript strings with a non-integer')
 
-		if index.value < 0 or index.value >= len(self.value):
+		chars = self.builder()
+		if index.value < 0 or index.value >= len(chars):
 			raise RuntimeException('String subscription out of bounds')
 
 		if value.type != TrogonObject.STRING:
 			raise RuntimeException(
 				f'Can\'t assign <{typename[index.type]}> to a string character!')
 
-		if len(value.value) > 1:
+		char = value.value
+		if len(char) > 1:
 			raise RuntimeException('Can\'t assign a string to a string character')
 
-		if not value.value:
-			del self.value[index.value]
+		if not char:
+			del chars[index.value]
 		else:
-			self.value[index.value] = str(value.value[0])
+			chars[index.value] = char
 
 		return self
 
@@ -294,24 +519,101 @@ class TrogonString(TrogonObject):
 
 		elif o == TrogonNumber:
 			# TODO: yeah, it should be a something like `try_to_parse` function
-			return TrogonNumber(int(''.join(self.value)))
+			return number(int(self.value))
 
 		elif o == TrogonBool:
-			return TrogonTrue if len(self.value) > 0 else TrogonFalse
+			return TrogonTrue if self.length() > 0 else TrogonFalse
 
 		return TrogonObject.to(self, o)
 
-	def __init__(self, value=None):
-		self.value = [x for x in value] if value else []
+	# A copy for a new variable or table slot. Only the characters of a
+	# changed string belong to one string, they're joined first
+	def share(self):
+		string = TrogonString.__new__(TrogonString)
+		string.text = self.text if self.chars is None else self.join()
+		string.rope = self.rope
+		string.chars = None
+		return string
+
+	def __init__(self, value=''):
+		self.text = value
+		self.rope = self.chars = None
 
 	def __hash__(self):
-		return hash(''.join(self.value))
+		return hash(self.value)
+
+
+# A table's dict is keyed by the Python values of strings and numbers, so a
+# lookup doesn't hash a tuple or create a bool to compare two keys. Bools,
+# null, functions and types are keys themselves. A string is never equal to
+# a number, and numbers are equal to each other like before (`true` is 1)
+
+def table_key(index):
+	kind = index.type
+	if kind == TrogonObject.STRING or kind == TrogonObject.NUMBER:
+		return index.value
+	elif kind == TrogonObject.TABLE:
+		raise RuntimeException('Can\'t subscript tables with tables!')
+
+	return index
+
 
+# the Trogon value of a key, tables only create them when they're iterated
+def table_index(key):
+	kind = type(key)
+	if kind is str:
+		return TrogonString(key)
+	elif kind is int or kind is float or kind is bool:
+		return number(key)
 
+	return key
+
+
+# Like in Lua, a table has an array part, a list with the values of the
+# keys 0 .. n-1, and `value`, the dict with all the other keys. Arrays don't
+# hash their indices and don't keep a key for every element.
+#
+# Tables are iterated (and printed) in insertion order, so a key only goes to
+# the array part while the dict is empty. Then everything in the array part
+# was added before anything in the dict. Removing the last element shrinks
+# the array, removing any other moves the rest of the table into the dict.
 class TrogonTable(TrogonObject):
 	type = TrogonObject.TABLE
+	__slots__ = ('value', 'array')
+
+	# where the array part keeps `key`, None if it doesn't. Numbers equal to
+	# an integer index are the same key (`1.0`, `true`), like in a dict
+	def position(self, key):
+		kind = type(key)
+		if kind is not int:
+			if kind is bool or kind is float and key.is_integer():
+				key = int(key)
+			else:
+				return None
+
+		return key if 0 <= key < len(self.array) else None
+
+	# the value of a key from `table_key`, None if there's no such key
+	def find(self, key):
+		position = self.position(key)
+		if position is not None:
+			return self.array[position]
+
+		return self.value.get(key)
+
+	# the pairs with the keys as Trogon values
+	def items(self):
+		for key, value in enumerate(self.array):
+			yield number(key), value
+
+		for key, value in self.value.items():
+			yield table_index(key), value
+
+	def length(self):
+		return len(self.array) + len(self.value)
 
 	def clear(self):
+		self.array = ()
 		self.value.clear()
 		return TrogonNull
 
@@ -321,47 +623,87 @@ class TrogonTable(TrogonObject):
 		if key.type == TrogonObject.TABLE:
 			raise RuntimeException('Tables can\'t be table keys')
 
-		if key in self.value:
-			del self.value[key]
+		key = table_key(key)
+		position = self.position(key)
+		if position is None:
+			self.value.pop(key, None)
+		elif position == len(self.array) - 1:
+			self.array.pop()
+		else:
+			hash = dict(enumerate(self.array))
+			del hash[position]
+			hash.update(self.value)
+			self.value = hash
+			self.array = ()
 
 		return TrogonNull
 
-	def dot(self, argument):
-		if argument == 'clear':
-			return TrogonCallable(0, lambda _: self.clear())
-		if argument == 'remove':
-			return TrogonCallable(1, lambda x: self.remove(x))
-		if argument == 'length':
-			return TrogonCallable(0, lambda _: TrogonNumber(len(self.value)))
-
-		TrogonObject.dot(self, argument)
+	methods = {
+		'clear': Method('clear', 0, lambda self, arguments: self.clear()),
+		'remove': Method('remove', 1, remove),
+		'length': Method('length', 0, lambda self, arguments: number(self.length())),
+	}
 
+	# integers skip `table_key` and `position`, arrays are indexed with them
+	# the most
 	def subscript(self, index):
-		if index.type == TrogonObject.TABLE:
-			raise RuntimeException('Can\'t subscript tables with tables!')
-
-		if index in self.value:
-			return self.value[index]
-
-		return TrogonNull
+		key = index.value if index.type == TrogonObject.NUMBER else table_key(index)
+		kind = type(key)
+		if kind is int:
+			array = self.array
+			if 0 <= key < len(array):
+				return array[key]
+			return self.value.get(key, TrogonNull)
+		elif kind is str or not self.array:
+			return self.value.get(key, TrogonNull)
+
+		value = self.find(key)
+		return value if value is not None else TrogonNull
 
 	def subscript_assign(self, index, value):
-		if index.type == TrogonObject.TABLE:
-			raise RuntimeException('Can\'t subscript tables with tables!')
+		key = index.value if index.type == TrogonObject.NUMBER else table_key(index)
+		value = copy_value(value)
+
+		kind = type(key)
+		if kind is int:
+			array = self.array
+			if 0 <= key < len(array):
+				array[key] = value
+			elif key == len(array) and not self.value:
+				if array:
+					array.append(value)
+				else:
+					self.array = [value]
+			else:
+				self.value[key] = value
+			return self
+		elif kind is str or not self.array:
+			self.value[key] = value
+			return self
+
+		position = self.position(key)
+		if position is not None:
+			self.array[position] = value
+		else:
+			self.value[key] = value
 
-		v = copy.deepcopy(value) if value.type in types_passed_by_value else copy.copy(value)
-		self.value[index] = v
-		return self 
+		return self
 
 	def equal(self, y):
 		if y.type != TrogonObject.TABLE:
 			return TrogonObject.equal(self, y)
 
-		if len(self.value) != len(y.value):
+		if self.length() != y.length():
 			return TrogonFalse
 
+		for k, v in enumerate(self.array):
+			other = y.find(k)
+			if other is None or v != other:
+				return TrogonFalse
+
 		for k, v in self.value.items():
-			if k not in y.value or v != y.value[k]:
+			other = y.find(k)
+			if other is None or v != other:
 				return TrogonFalse
 
 		return TrogonTrue
@@ -372,17 +714,16 @@ class TrogonTable(TrogonObject):
 
 		elif o == TrogonString: # TODO: cross referencing table
 			pairs = []
-			for key in self.value:
-				key_string = ''.join(key.to(TrogonString).value)
+			for key, value in self.items():
+				key_string = key.to(TrogonString).value
 				if key.type == TrogonObject.STRING:
 					key_string = "'" + key_string + "'"
 
-				value = self.value[key]
 				value_string = None
 				if self == value:
 					value_string = r'{...}'
 				else:
-					value_string = ''.join(value.to(TrogonString).value)
+					value_string = value.to(TrogonString).value
 					if value.type == TrogonObject.STRING:
 						value_string = "'" + value_string + "'"
 
@@ -391,16 +732,19 @@ class TrogonTable(TrogonObject):
 			return TrogonString('{' + ', '.join(pairs) + '}')
 
 		elif o == TrogonBool:
-			return TrogonTrue if len(self.value) > 0 else TrogonFalse
+			return TrogonTrue if self.length() > 0 else TrogonFalse
 
 		return TrogonObject.to(self, o)
 
 	def __init__(self):
 		self.value = {}
+		# a list once it has anything
+		self.array = ()
 
 
 class TrogonCallable(TrogonObject):
 	type = TrogonObject.FUNCTION
+	__slots__ = ('arity', 'function')
 	value = None
 
 	def check_arity(self, arguments):
@@ -432,8 +776,24 @@ class TrogonCallable(TrogonObject):
 		self.function = function
 
 
+# `receiver.name` that isn't called right away, e.g. `let n = s.length;`
+class TrogonBoundMethod(TrogonCallable):
+	type = TrogonObject.FUNCTION
+	__slots__ = ('receiver',)
+
+	# `function` is the `Method`
+	def call(self, arguments):
+		return self.function.call(self.receiver, arguments)
+
+	def __init__(self, receiver, method):
+		self.arity = method.arity
+		self.receiver = receiver
+		self.function = method
+
+
 class TrogonPrintFunction(TrogonCallable):
 	type = TrogonObject.FUNCTION
+	__slots__ = ()
 
 	def equal(self, y):
 		return TrogonTrue if isinstance(y, TrogonPrintFunction) else TrogonFalse
@@ -441,7 +801,7 @@ class TrogonPrintFunction(TrogonCallable):
 	def call(self, arguments):
 		self.check_arity(arguments)
 
-		print(''.join(arguments[0].to(TrogonString).value))
+		print(arguments[0].to(TrogonString).value)
 		return TrogonNull
 
 	def __init__(self):
@@ -450,6 +810,7 @@ class TrogonPrintFunction(TrogonCallable):
 
 class TrogonPrintFormattedFunction(TrogonCallable):
 	type = TrogonObject.FUNCTION
+	__slots__ = ()
 
 	def equal(self, y):
 		return TrogonTrue if isinstance(y, TrogonPrintFormattedFunction) else TrogonFalse
@@ -458,7 +819,7 @@ class TrogonPrintFormattedFunction(TrogonCallable):
 		self.check_arity(arguments)
 
 		pattern, table = arguments
-		print(''.join(pattern.format([table]).to(TrogonString).value), end='')
+		print(pattern.format([table]).to(TrogonString).value, end='')
 		return TrogonNull
 
 	def __init__(self):
@@ -467,6 +828,7 @@ class TrogonPrintFormattedFunction(TrogonCallable):
 
 class TrogonInputFunction(TrogonCallable):
 	type = TrogonObject.FUNCTION
+	__slots__ = ()
 
 	def equal(self, y):
 		return TrogonTrue if isinstance(y, TrogonInputFunction) else TrogonFalse
@@ -481,51 +843,77 @@ class TrogonInputFunction(TrogonCallable):
 
 class TrogonFunction(TrogonCallable):
 	type = TrogonObject.FUNCTION
+	__slots__ = ('name', 'argnames', 'block', 'layout', 'state')
 
 	def equal(self, y):
 		if not isinstance(y, TrogonFunction):
 			return TrogonFalse
 
-		return TrogonBool(self.arity == y.arity and self.block == y.block)
+		return boolean(self.arity == y.arity and self.block == y.block)
 
-	def call(self, arguments):
-		self.check_arity(arguments)
+	# The frame of a call, `layout` comes from the resolver. Usually the
+	# arguments are its first slots, then they're stored in place: no slot
+	# is defined yet, and only strings need `copy_value`
+	def bind(self, arguments):
+		if len(arguments) != self.arity:
+			self.check_arity(arguments)
+
+		size, argslots, self_slot = self.layout
+		state = State(self.state, size)
 
-		state = self.state.begin()
-		state_previous = State.get_state()
-		State.set_state(state)
+		if argslots is None:
+			slots = state.slots
+			i = 0
+			for value in arguments:
+				slots[i] = value.share() if value.type == TrogonObject.STRING else value
+				i += 1
+		else:
+			for i, slot in enumerate(argslots):
+				state.declare(slot, self.argnames[i], arguments[i])
 
-		for i, argname in enumerate(self.argnames):
-			state.register(argname, arguments[i])
-		
-		if self.name and self.name not in self.argnames:
-			state.register(self.name, self)
+		if self_slot is not None:
+			state.slots[self_slot] = self
 
-		try:
-			result = self.block.evaluate()
-		except ReturnException as e:
-			result = e.value
-		except (ContinueException, BreakException) as e:
-			raise RuntimeException('Uncaught break or continue')
-		finally:
-			state.end()
-			State.set_state(state_previous)
+		return state
 
-		return result
+	# Tail calls to other tree walked functions run in this loop instead of
+	# a new Python frame, so tail recursion goes as deep as it likes
+	def call(self, arguments):
+		function = self
+		while True:
+			try:
+				result = function.block.complete(function.bind(arguments))
+			except ReturnException as e:
+				return e.value
+			except (ContinueException, BreakException) as e:
+				raise RuntimeException('Uncaught break or continue')
+
+			if result.__class__ is not Completion:
+				return result
+			elif result.kind == Completion.RETURN:
+				return result.value
+			elif result.kind != Completion.CALL:
+				raise RuntimeException('Uncaught break or continue')
+
+			function, arguments = result.value
+			if function.__class__ is not TrogonFunction:
+				return function.call(arguments)
 
 	def __hash__(self):
 		return hash((self.arity, self.block))
 
-	def __init__(self, arity, name, argnames, block):
+	def __init__(self, arity, name, argnames, block, layout, state):
 		self.arity = arity
 		self.name = name
 		self.argnames = argnames
 		self.block = block
-		self.state = State.get_state()
+		self.layout = layout
+		self.state = state
 
 
 class TrogonRandomFunction(TrogonCallable):
 	type = TrogonObject.FUNCTION
+	__slots__ = ()
 
 	def equal(self, y):
 		return TrogonTrue if isinstance(y, TrogonRandomFunction) else TrogonFalse
@@ -538,7 +926,7 @@ class TrogonRandomFunction(TrogonCallable):
 		   not isinstance(x.value, int) or not isinstance(y.value, int):
 			raise RuntimeException('Random takes 2 integer arguments')
 
-		return TrogonNumber(random.randrange(x.value, y.value))
+		return number(random.randrange(x.value, y.value))
 
 	def __init__(self):
 		self.arity = 2
@@ -546,6 +934,7 @@ class TrogonRandomFunction(TrogonCallable):
 
 class TrogonType(TrogonCallable):
 	type = TrogonObject.TYPE
+	__slots__ = ('value',)
 
 	def equal(self, y):
 		if not isinstance(y, TrogonType):
@@ -555,6 +944,12 @@ class TrogonType(TrogonCallable):
 
 	def call(self, arguments):
 		self.check_arity(arguments)
+
+		if self.value is TrogonBool:
+			return TrogonFalse
+		elif self.value is TrogonNumber:
+			return number(0)
+
 		return self.value()
 
 	def to(self, o):
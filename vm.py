@@ -0,0 +1,381 @@
+from bytecode import *
+from state import State, UNDEFINED, copy_value
+
+# A stack machine for the code from `bytecode.Compiler`.
+#
+# Calls between Trogon functions don't use the Python stack: the caller's
+# registers are pushed to `frames` and the loop just continues with the
+# callee's code. A tail call doesn't even push them, the callee returns
+# straight to the caller's caller. A frame is a tuple (code, pc, state, stack
+# height, number of loops), cheaper to create than an object. Loops push a
+# record to `loops` so `break`/`continue` can restore the stack height and
+# the scope they started with.
+
+
+class VMFunction(TrogonFunction):
+	type = TrogonObject.FUNCTION
+	__slots__ = ('code',)
+
+	# called from Python (builtins), not from the VM itself
+	def call(self, arguments):
+		return execute(self.code, self.bind(arguments))
+
+	def __init__(self, template, state):
+		self.arity = len(template.argnames)
+		self.name = template.name
+		self.argnames = template.argnames
+		self.block = template.block
+		self.code = template.code
+		self.layout = template.layout
+		self.state = state
+
+
+class LoopRecord:
+	__slots__ = ('exit', 'next', 'height', 'state')
+
+	def __init__(self, exit, next, height, state):
+		self.exit = exit
+		self.next = next
+		self.height = height
+		self.state = state
+
+
+def execute(code, state):
+	instructions = code.instructions
+	constants = code.constants
+	pc = 0
+
+	# every scope of the program shares them
+	variables = state.globals.variables
+
+	stack = []
+	push = stack.append
+	pop = stack.pop
+	frames = []
+	loops = []
+
+	while True:
+		opcode = instructions[pc]
+		argument = instructions[pc + 1]
+		pc += 2
+
+		# sorted by how often they run in bench.py's programs
+		if opcode == LOAD_LOCAL:
+			value = state.slots[argument]
+			push(value if value is not UNDEFINED else state.load(code.references[pc - 1]))
+
+		elif opcode == LOAD_GLOBAL:
+			value = variables.get(constants[argument])
+			# not defined, let it raise
+			push(value if value is not None else state.globals.get(constants[argument]))
+
+		elif opcode == LOAD_CONST:
+			push(constants[argument])
+
+		elif opcode == MOD_CONST:
+			stack[-1] = stack[-1].mod(constants[argument])
+
+		elif opcode == JUMP_IF_FALSE:
+			# comparisons give the canonical bools
+			condition = pop()
+			if condition is not TrogonTrue and (
+					condition is TrogonFalse or condition.to(TrogonBool).value != True):
+				pc = argument
+
+		elif opcode == JUMP:
+			pc = argument
+
+		elif opcode == FOR_ITER:
+			counter = next(stack[-1], None)
+			if counter is None:
+				pc = argument
+			else:
+				push(counter)
+
+		elif opcode == SET_LOCAL:
+			slots = state.slots
+			if slots[argument] is not UNDEFINED:
+				slots[argument] = copy_value(pop())
+			else:
+				state.store(code.references[pc - 1], pop())
+
+		elif opcode == SUB_CONST:
+			stack[-1] = stack[-1].sub(constants[argument])
+
+		elif opcode == LESS_CONST:
+			stack[-1] = stack[-1].less(constants[argument])
+
+		elif opcode == EQUAL_CONST:
+			stack[-1] = stack[-1].equal(constants[argument])
+
+		elif opcode == CALL:
+			callee = stack[-argument - 1]
+			arguments = stack[len(stack) - argument:]
+			del stack[len(stack) - argument - 1:]
+
+			if callee.__class__ is VMFunction:
+				callee_state = callee.bind(arguments)
+				frames.append((code, pc, state, len(stack), len(loops)))
+				code = callee.code
+				instructions = code.instructions
+				constants = code.constants
+				state = callee_state
+				pc = 0
+			else:
+				push(callee.call(arguments))
+
+		elif opcode == RETURN:
+			result = pop()
+			if not frames:
+				return result
+
+			code, pc, state, base, loop_count = frames.pop()
+			instructions = code.instructions
+			constants = code.constants
+			del stack[base:]
+			del loops[loop_count:]
+			push(result)
+
+		elif opcode == SET_GLOBAL:
+			name = constants[argument]
+			if name in variables:
+				variables[name] = copy_value(pop())
+			else:
+				state.globals.set(name, pop())
+
+		elif opcode == SUBSCRIPT:
+			index = pop()
+			stack[-1] = stack[-1].subscript(index)
+
+		elif opcode == SET_SUBSCR:
+			index = pop()
+			pop().subscript_assign(index, pop())
+
+		elif opcode == ADD:
+			y = pop()
+			stack[-1] = stack[-1].add(y)
+
+		elif opcode == SWAP:
+			stack[-1], stack[-2] = stack[-2], stack[-1]
+
+		elif opcode == ADD_CONST:
+			stack[-1] = stack[-1].add(constants[argument])
+
+		elif opcode == POP:
+			pop()
+
+		elif opcode == BINARY:
+			y = pop()
+			stack[-1] = BinaryExpression.functions[argument](stack[-1], y)
+
+		elif opcode == SUB:
+			y = pop()
+			stack[-1] = stack[-1].sub(y)
+
+		elif opcode == LESS:
+			y = pop()
+			stack[-1] = stack[-1].less(y)
+
+		elif opcode == EQUAL:
+			y = pop()
+			stack[-1] = stack[-1].equal(y)
+
+		elif opcode == MOD:
+			y = pop()
+			stack[-1] = stack[-1].mod(y)
+
+		elif opcode == SET_NAME:
+			state.store(constants[argument], pop())
+
+		elif opcode == STORE_SUBSCR:
+			index = pop()
+			container = pop()
+			stack[-1] = container.subscript_assign(index, stack[-1])
+
+		elif opcode == LOAD_OUTER:
+			value = state.parent.slots[argument]
+			push(value if value is not UNDEFINED else state.load(code.references[pc - 1]))
+
+		elif opcode == SET_OUTER:
+			slots = state.parent.slots
+			if slots[argument] is not UNDEFINED:
+				slots[argument] = copy_value(pop())
+			else:
+				state.store(code.references[pc - 1], pop())
+
+		elif opcode == STORE_LOCAL or opcode == STORE_OUTER:
+			slots = state.slots if opcode == STORE_LOCAL else state.parent.slots
+			if slots[argument] is not UNDEFINED:
+				slots[argument] = stack[-1] = copy_value(stack[-1])
+			else:
+				reference = code.references[pc - 1]
+				state.store(reference, stack[-1])
+				stack[-1] = state.load(reference)
+
+		elif opcode == TAIL_CALL:
+			callee = stack[-argument - 1]
+			arguments = stack[len(stack) - argument:]
+
+			if callee.__class__ is VMFunction:
+				state = callee.bind(arguments)
+				# what RETURN would clean up
+				if frames:
+					del stack[frames[-1][3]:]
+					del loops[frames[-1][4]:]
+				else:
+					stack.clear()
+					loops.clear()
+
+				code = callee.code
+				instructions = code.instructions
+				constants = code.constants
+				pc = 0
+			else:
+				# the code after it returns the result
+				del stack[len(stack) - argument - 1:]
+				push(callee.call(arguments))
+
+		elif opcode == LOAD_METHOD:
+			receiver = stack[-1]
+			stack[-1] = constants[argument].lookup(receiver)
+			push(receiver)
+
+		elif opcode == CALL_METHOD:
+			arguments = stack[len(stack) - argument:]
+			del stack[len(stack) - argument:]
+			receiver = pop()
+			stack[-1] = stack[-1].call(receiver, arguments)
+
+		elif opcode == MUL:
+			y = pop()
+			stack[-1] = stack[-1].mul(y)
+
+		elif opcode == GREATER:
+			y = pop()
+			stack[-1] = stack[-1].greater(y)
+
+		elif opcode == LOAD_NAME:
+			push(state.load(constants[argument]))
+
+		elif opcode == STORE_GLOBAL:
+			name = constants[argument]
+			if name in variables:
+				variables[name] = stack[-1] = copy_value(stack[-1])
+			else:
+				state.globals.set(name, stack[-1])
+
+		elif opcode == STORE_NAME:
+			reference = constants[argument]
+			state.store(reference, stack[-1])
+			stack[-1] = state.load(reference)
+
+		elif opcode == BEGIN_SCOPE:
+			state = State(state, argument)
+
+		elif opcode == END_SCOPE:
+			state = state.parent
+
+		elif opcode == ENTER_FRAME:
+			state = stack[-argument - 1]
+			state.reset()
+
+		elif opcode == DEFINE_NAME:
+			slot, name = constants[argument]
+			state.declare(slot, name, pop())
+
+		elif opcode == FOR_RANGE:
+			right = pop()
+			stack[-1] = counters(stack[-1], right)
+
+		elif opcode == FOR_TEST:
+			right = pop()
+			if abs(stack[-1].sub(right).value) < 1:
+				pc = argument
+
+		elif opcode == FOR_STEP:
+			right = pop()
+			counter = stack[-1]
+			# numbers are shared, so the counter is never changed in place
+			if right.greater(counter).value:
+				stack[-1] = number(counter.value + 1)
+			else:
+				stack[-1] = number(counter.value - 1)
+
+		elif opcode == DUP:
+			push(stack[-1])
+
+		elif opcode == AND_JUMP:
+			if not pop().to(TrogonBool).value:
+				push(TrogonFalse)
+				pc = argument
+
+		elif opcode == OR_JUMP:
+			if pop().to(TrogonBool).value:
+				push(TrogonTrue)
+				pc = argument
+
+		elif opcode == TO_BOOL:
+			stack[-1] = stack[-1].to(TrogonBool)
+
+		elif opcode == UNARY_MINUS:
+			stack[-1] = stack[-1].unary_minus()
+
+		elif opcode == UNARY_NOT:
+			stack[-1] = TrogonFalse if stack[-1].to(TrogonBool).value else TrogonTrue
+
+		elif opcode == DOT:
+			stack[-1] = stack[-1].dot(constants[argument])
+
+		elif opcode == CAST:
+			target = pop()
+			stack[-1] = stack[-1].to(target.value)
+
+		elif opcode == NEW_FRAME:
+			push(State(state, argument))
+
+		elif opcode == MAKE_FUNCTION:
+			push(VMFunction(constants[argument], state))
+
+		elif opcode == NEW_TABLE:
+			push(TrogonTable())
+
+		elif opcode == TABLE_SET:
+			value = pop()
+			key = pop()
+			stack[-1].subscript_assign(key, value)
+
+		elif opcode == SETUP_LOOP:
+			loops.append(LoopRecord(*constants[argument], len(stack), state))
+
+		elif opcode == POP_LOOP:
+			loops.pop()
+
+		elif opcode == BREAK or opcode == CONTINUE:
+			target = len(loops) - 1 - argument
+			loop = loops[target]
+
+			if opcode == BREAK:
+				del loops[target:]
+				pc = loop.exit
+			else:
+				del loops[target + 1:]
+				pc = loop.next
+
+			del stack[loop.height:]
+			state = loop.state
+
+		elif opcode == RAISE:
+			raise constants[argument]()
+
+		elif opcode == RAISE_RETURN:
+			raise ReturnException(pop())
+
+		elif opcode == HALT:
+			return TrogonNull
+
+		else:
+			raise RuntimeException(f'Unknown opcode {opcode}')
+
+
+def run(statements, state):
+	return execute(Compiler().compile_program(statements), state)